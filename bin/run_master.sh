@@ -33,6 +33,7 @@ do
 done
 
 $BIN_PATH/../loomengine/master/manage.py migrate
+$BIN_PATH/../loomengine/master/manage.py createcachetable
 $BIN_PATH/../loomengine/master/manage.py collectstatic --noinput
 
 gunicorn loomengine.master.master.wsgi --bind ${LOOM_MASTER_INTERNAL_IP}:${LOOM_MASTER_INTERNAL_PORT} --log-level ${LOOM_LOG_LEVEL} --capture-output -w ${LOOM_MASTER_GUNICORN_WORKERS_COUNT}
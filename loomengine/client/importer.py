@@ -7,7 +7,7 @@ from loomengine.client.common import verify_server_is_running, get_server_url, \
     verify_has_connection_settings, parse_as_json_or_yaml
 from loomengine.utils.filemanager import FileManager
 from loomengine.utils.connection import Connection
-from loomengine.utils.exceptions import DuplicateFileError
+from loomengine.utils.exceptions import DuplicateFileError, FileUploadError
 
 class AbstractImporter(object):
     """Common functions for the various subcommands under 'loom import'
@@ -46,7 +46,7 @@ class FileImporter(AbstractImporter):
                 self.args.note,
                 force_duplicates=self.args.force_duplicates,
             )
-        except DuplicateFileError as e:
+        except (DuplicateFileError, FileUploadError) as e:
             raise SystemExit(e.message)
         if len(files_imported) == 0:
             raise SystemExit('ERROR! Did not find any files matching "%s"'
@@ -72,8 +72,13 @@ class ShowFile(AbstractShow):
             source_type=None
         else:
             source_type=self.args.type
+        if self.args.detail:
+            fields = None
+        else:
+            fields = ['uuid', 'filename']
         self.files = self.connection.get_file_data_object_index(
-            query_string=self.args.file_id, source_type=source_type)
+            query_string=self.args.file_id, source_type=source_type,
+            fields=fields)
 
     def _show_files(self):
         print '[showing %s files]' % len(self.files)
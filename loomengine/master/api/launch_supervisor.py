@@ -0,0 +1,167 @@
+import errno
+import os
+import select
+import subprocess
+import threading
+import time
+
+from django import db
+
+from api import get_setting
+
+
+class LaunchSupervisor(object):
+    """Owns the launch subprocesses (ansible-playbook) started by one
+    server process, so that the task that starts one can return at once
+    instead of waiting for it to exit.
+
+    A single thread waits on the output of all children together. While
+    a task runner is being launched, it sends heartbeats for its
+    TaskAttempt, all in one write per interval. When a launch exits with
+    an error, the TaskAttempt fails with the output as the detail.
+    """
+
+    READ_SIZE = 65536
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        with cls._instance_lock:
+            # Not shared with a forked child, which has no copy of
+            # the thread
+            if cls._instance is None or cls._instance.pid != os.getpid():
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.children = {}
+        self.lock = threading.Lock()
+        (self.wake_read_fd, self.wake_write_fd) = os.pipe()
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def launch(self, cmd_list, env, task_attempt_uuid=None):
+        """Start a subprocess and return. If task_attempt_uuid is given,
+        the TaskAttempt gets heartbeats while the subprocess runs and
+        fails if it exits with an error.
+        """
+        p = subprocess.Popen(cmd_list, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        with self.lock:
+            self.children[p.stdout.fileno()] = _Child(p, task_attempt_uuid)
+        # Wake the thread so that it waits on the new child too
+        os.write(self.wake_write_fd, 'x')
+        return p
+
+    def _run(self):
+        heartbeat_interval = int(
+            get_setting('TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS'))
+        last_heartbeat = time.time()
+        while True:
+            try:
+                with self.lock:
+                    fds = self.children.keys()
+                timeout = max(
+                    0, last_heartbeat + heartbeat_interval - time.time())
+                for fd in self._wait_for_output(
+                        fds + [self.wake_read_fd], timeout):
+                    if fd == self.wake_read_fd:
+                        os.read(fd, self.READ_SIZE)
+                    else:
+                        self._read_output(fd)
+                if time.time() >= last_heartbeat + heartbeat_interval:
+                    self._send_heartbeats()
+                    last_heartbeat = time.time()
+            except Exception as e:
+                # Keep supervising the other children
+                print 'Error in launch supervisor: %s' % str(e)
+
+    def _wait_for_output(self, fds, timeout):
+        # poll has no limit on fd numbers, but is missing when eventlet
+        # has patched select. Eventlet's select has no such limit.
+        if not hasattr(select, 'poll'):
+            return select.select(fds, [], [], timeout)[0]
+        poller = select.poll()
+        for fd in fds:
+            poller.register(fd, select.POLLIN | select.POLLHUP)
+        return [fd for (fd, event) in poller.poll(timeout * 1000)]
+
+    def _read_output(self, fd):
+        child = self.children[fd]
+        try:
+            data = os.read(fd, self.READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        if data:
+            child.add_output(data)
+            return
+        # End of output. The child has exited or soon will.
+        with self.lock:
+            del self.children[fd]
+        child.p.stdout.close()
+        child.p.wait()
+        child.flush_output()
+        if child.p.returncode != 0 and child.task_attempt_uuid is not None:
+            self._fail(child)
+
+    def _send_heartbeats(self):
+        from api.models.tasks import TaskAttempt
+        with self.lock:
+            uuids = [child.task_attempt_uuid
+                     for child in self.children.values()
+                     if child.task_attempt_uuid is not None]
+        if not uuids:
+            return
+        try:
+            db.close_old_connections()
+            TaskAttempt.record_heartbeats_in_bulk(uuids)
+        except Exception as e:
+            print 'Failed to send heartbeats for %s TaskAttempts: %s' \
+                % (len(uuids), str(e))
+
+    def _fail(self, child):
+        from api.models.tasks import TaskAttempt
+        try:
+            db.close_old_connections()
+            task_attempt = TaskAttempt.objects.get(uuid=child.task_attempt_uuid)
+            task_attempt.add_timepoint(
+                "Failed to launch worker process for TaskAttempt %s" \
+                % task_attempt.uuid,
+                detail=child.output,
+                is_error=True)
+            task_attempt.fail()
+        except Exception as e:
+            # The TaskAttempt will be restarted when it is found to be
+            # unresponsive
+            print 'Failed to record launch error for TaskAttempt %s: %s' \
+                % (child.task_attempt_uuid, str(e))
+
+
+class _Child(object):
+
+    def __init__(self, p, task_attempt_uuid):
+        self.p = p
+        self.task_attempt_uuid = task_attempt_uuid
+        self.output = ''
+        self.partial_line = ''
+
+    def add_output(self, data):
+        self.output += data
+        lines = (self.partial_line + data).split('\n')
+        self.partial_line = lines.pop()
+        for line in lines:
+            print line.strip()
+
+    def flush_output(self):
+        if self.partial_line:
+            print self.partial_line.strip()
+            self.partial_line = ''
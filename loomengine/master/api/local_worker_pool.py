@@ -0,0 +1,84 @@
+import docker
+import os
+
+from api import get_setting
+from api.scheduler import parse_resources
+
+
+class LocalWorkerPool(object):
+    """Runs task runners as Docker containers on the server's own host,
+    as local_run_task.yml does, but without starting ansible-playbook
+    for each task.
+
+    The scheduler decides when a task may start. get_capacity gives it
+    the host's cores and memory, or LOCAL_WORKER_MAX_CORES and
+    LOCAL_WORKER_MAX_MEMORY_GB if they are set. The cores and memory
+    requested by each task runner are recorded in container labels.
+    """
+
+    DOCKER_SOCKET = 'unix://var/run/docker.sock'
+    TASK_ATTEMPT_LABEL = 'org.loomengine.task-attempt'
+    CORES_LABEL = 'org.loomengine.cores'
+    MEMORY_LABEL = 'org.loomengine.memory-gb'
+
+    def __init__(self, docker_client=None):
+        if docker_client is None:
+            docker_client = docker.Client(
+                base_url=self.DOCKER_SOCKET, version='auto')
+        self.docker_client = docker_client
+
+    def get_capacity(self):
+        max_cores = get_setting('LOCAL_WORKER_MAX_CORES', required=False)
+        max_memory_gb = get_setting('LOCAL_WORKER_MAX_MEMORY_GB',
+                                    required=False)
+        if not max_cores or not max_memory_gb:
+            info = self.docker_client.info()
+        if not max_cores:
+            max_cores = info['NCPU']
+        if not max_memory_gb:
+            max_memory_gb = info['MemTotal'] / float(1024**3)
+        return (float(max_cores), float(max_memory_gb))
+
+    def start(self, task_attempt):
+        """Start a task runner container
+        """
+        (cores, memory_gb, disk_gb) = parse_resources(
+            task_attempt.task.step_run.template.resources)
+        storage_root = get_setting('LOOM_STORAGE_ROOT')
+        command = "/bin/bash -c 'loom-taskrunner --task_attempt_id %s "\
+                  "--master_url %s --log_level %s --log_file %s'" % (
+                      task_attempt.uuid,
+                      get_setting('LOCAL_WORKER_MASTER_URL'),
+                      get_setting('TASKRUNNER_LOG_LEVEL'),
+                      os.path.join(storage_root, 'loom_taskrunner-%s.log'
+                                   % task_attempt.uuid))
+        container = self.docker_client.create_container(
+            image=get_setting('LOOM_DOCKER_IMAGE'),
+            name=self.get_container_name(task_attempt.uuid),
+            command=command,
+            volumes=['/var/run/docker.sock', storage_root],
+            labels={
+                self.TASK_ATTEMPT_LABEL: str(task_attempt.uuid),
+                self.CORES_LABEL: str(cores),
+                self.MEMORY_LABEL: str(memory_gb),
+            },
+            host_config=self.docker_client.create_host_config(
+                binds=['/var/run/docker.sock:/var/run/docker.sock',
+                       '%s:%s' % (storage_root, storage_root)],
+                network_mode='host'))
+        self.docker_client.start(container)
+        return container['Id']
+
+    def remove(self, task_attempt_uuid):
+        try:
+            self.docker_client.remove_container(
+                self.get_container_name(task_attempt_uuid), force=True)
+        except docker.errors.NotFound:
+            pass
+
+    @classmethod
+    def get_container_name(cls, task_attempt_uuid):
+        return '%s%s-%s' % (
+            get_setting('LOOM_SERVER_NAME'),
+            get_setting('LOOM_TASKRUNNER_CONTAINER_NAME_SUFFIX'),
+            task_attempt_uuid)
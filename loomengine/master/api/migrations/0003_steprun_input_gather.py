@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 17:48
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_task_data_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stepruninput',
+            name='gather',
+            field=jsonfield.fields.JSONField(null=True),
+        ),
+    ]
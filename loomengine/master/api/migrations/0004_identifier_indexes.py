@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 17:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+FILENAME_INDEX = 'api_filedataobject_filename_idx'
+
+def create_filename_index(apps, schema_editor):
+    # filename is too long for a full index on MySQL, so index a prefix
+    if schema_editor.connection.vendor == 'mysql':
+        column = 'filename(255)'
+    else:
+        column = 'filename'
+    schema_editor.execute(
+        'CREATE INDEX %s ON api_filedataobject (%s)'
+        % (FILENAME_INDEX, column))
+
+def drop_filename_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'DROP INDEX %s ON api_filedataobject' % FILENAME_INDEX)
+    else:
+        schema_editor.execute('DROP INDEX %s' % FILENAME_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_steprun_input_gather'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filedataobject',
+            name='md5',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='fileresource',
+            name='md5',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='template',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.RunPython(create_filename_index, drop_filename_index),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 18:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_counters(apps, schema_editor):
+    # Runs that started before the counters existed
+    WorkflowRun = apps.get_model('api', 'WorkflowRun')
+    StepRun = apps.get_model('api', 'StepRun')
+    # The total comes from the template, as in WorkflowRun.postprocess,
+    # since steps may not all have been created yet
+    for run in WorkflowRun.objects.select_related('template__workflow'):
+        if run.template is None:
+            steps_total = run.steps.count()
+        else:
+            steps_total = run.template.workflow.steps.count()
+        WorkflowRun.objects.filter(id=run.id).update(
+            status_steps_total=steps_total,
+            status_steps_finished=run.steps.filter(
+                status_is_finished=True).count())
+    for run in StepRun.objects.all():
+        StepRun.objects.filter(id=run.id).update(
+            status_tasks_created=run.tasks.count(),
+            status_tasks_finished=run.tasks.filter(
+                status_is_finished=True).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_task_status_is_waiting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='steprun',
+            name='status_tasks_created',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='steprun',
+            name='status_tasks_finished',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='workflowrun',
+            name='status_steps_finished',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='workflowrun',
+            name='status_steps_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(set_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import F
+
+
+BATCH_SIZE = 500
+
+
+def set_root_node(apps, schema_editor):
+    # Roots created by InputOutputNode before root_node was saved there,
+    # and the nodes added below them
+    DataNode = apps.get_model('api', 'DataNode')
+    DataNode.objects.filter(parent__isnull=True, root_node__isnull=True)\
+                    .update(root_node_id=F('id'))
+    while True:
+        nodes = list(DataNode.objects.filter(
+            root_node__isnull=True, parent__root_node__isnull=False)\
+                     .values_list('id', 'parent__root_node_id'))
+        if not nodes:
+            break
+        ids_by_root = {}
+        for (node_id, root_node_id) in nodes:
+            ids_by_root.setdefault(root_node_id, []).append(node_id)
+        for (root_node_id, ids) in ids_by_root.items():
+            for i in range(0, len(ids), BATCH_SIZE):
+                DataNode.objects.filter(id__in=ids[i:i+BATCH_SIZE])\
+                                .update(root_node_id=root_node_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_scheduler_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_root_node, migrations.RunPython.noop),
+    ]
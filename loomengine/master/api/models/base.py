@@ -1,6 +1,8 @@
+from collections import OrderedDict
 from django.db import models
 import jinja2
 import re
+import threading
 
 from api.exceptions import *
 
@@ -60,8 +62,42 @@ class _ModelNameMixin(object):
         return cls.all_cap_re.sub(r'\1_\2', s1).lower()
 
 
+class LRUCache(object):
+    """A small thread-safe in-process cache that discards the least
+    recently used entry once it holds max_size entries.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
 class FilterHelper(object):
 
+    UUID_LENGTH = 36
+    MD5_LENGTH = 32
+
     def __init__(self, Model):
         self.Model = Model
 
@@ -76,9 +112,11 @@ class FilterHelper(object):
         if name is not None:
             filter_args[self.Model.NAME_FIELD] = name
         if hash_value is not None:
-            filter_args[self.Model.HASH_FIELD+'__startswith'] = hash_value
+            filter_args.update(self._get_prefix_filter_args(
+                self.Model.HASH_FIELD, hash_value, self.MD5_LENGTH))
         if id is not None:
-            filter_args['uuid__startswith'] = id
+            filter_args.update(self._get_prefix_filter_args(
+                'uuid', id, self.UUID_LENGTH))
         return self.Model.objects.filter(**filter_args)
 
     def filter_by_name_or_id(self, query_string):
@@ -93,9 +131,31 @@ class FilterHelper(object):
         if name:
             kwargs[self.Model.NAME_FIELD] = name
         if id:
-            kwargs['uuid__startswith'] = id
+            kwargs.update(self._get_prefix_filter_args(
+                'uuid', id, self.UUID_LENGTH))
         return self.Model.objects.filter(**kwargs)
 
+    def is_unique_identifier(self, query_string):
+        """True if query_string includes a complete uuid, so that it
+        can never match more than one object.
+        """
+        name, id, hash_value = self._parse_as_name_or_id_or_hash(query_string)
+        return id is not None and len(id.strip()) >= self.UUID_LENGTH
+
+    @classmethod
+    def _get_prefix_filter_args(cls, field, prefix, full_length):
+        # uuids and md5s are lowercase hex, so the identifier is normalized
+        # to lowercase. A complete value is matched exactly. A partial one
+        # is matched as a range, [prefix, next prefix), which unlike LIKE
+        # can use the index on any database backend.
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return {}
+        if len(prefix) >= full_length:
+            return {field: prefix}
+        upper_bound = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        return {field+'__gte': prefix, field+'__lt': upper_bound}
+
     def _parse_as_name_or_id_or_hash(self, query_string):
         name = None
         id = None
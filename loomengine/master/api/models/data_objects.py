@@ -1,11 +1,13 @@
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 from django.dispatch import receiver
 import jsonfield
 import os
 
-from .base import BaseModel
+from .base import BaseModel, FilterHelper, LRUCache
 from api import get_setting
+from api import tasks
 from api.models import uuidstr
 from api.exceptions import NoFileMatchError, MultipleFileMatchesError
 
@@ -23,6 +25,8 @@ class RelativeFileRootError(Exception):
     pass
 class InvalidSourceTypeError(Exception):
     pass
+class MD5MismatchError(Exception):
+    pass
 
 
 class DataObjectManager():
@@ -45,13 +49,24 @@ class BooleanDataObjectManager(DataObjectManager):
 
 class FileDataObjectManager(DataObjectManager):
 
+    # Recently resolved identifiers that include a complete uuid,
+    # mapped to the primary key of the matching FileDataObject
+    _resolved_identifiers = LRUCache(1000)
+
     @classmethod
     def get_by_value(cls, value):
-        matches = FileDataObject.filter_by_name_or_id_or_hash(value)
-        if matches.count() == 0:
+        value = value.strip()
+        pk = cls._resolved_identifiers.get(value)
+        if pk is not None:
+            try:
+                return FileDataObject.objects.get(pk=pk)
+            except FileDataObject.DoesNotExist:
+                cls._resolved_identifiers.delete(value)
+        matches = list(FileDataObject.filter_by_name_or_id_or_hash(value))
+        if len(matches) == 0:
             raise NoFileMatchError(
                 'ERROR! No file found that matches value "%s"' % value)
-        elif matches.count() > 1:
+        elif len(matches) > 1:
             match_id_list = ['%s@%s' % (match.filename, match.uuid)
                              for match in matches]
             match_id_string = ('", "'.join(match_id_list))
@@ -59,7 +74,9 @@ class FileDataObjectManager(DataObjectManager):
                 'ERROR! Multiple files were found matching value "%s": "%s". '\
                 'Use a more precise identifier to select just one file.' % (
                     value, match_id_string))
-        return matches.first()
+        if FilterHelper(FileDataObject).is_unique_identifier(value):
+            cls._resolved_identifiers.set(value, matches[0].pk)
+        return matches[0]
 
     def get_substitution_value(self):
         return self.model.filedataobject.filename
@@ -187,10 +204,11 @@ class FileDataObject(DataObject):
     NAME_FIELD = 'filename'
     HASH_FIELD = 'md5'
     
+    # filename is indexed in a migration, with a prefix length on MySQL
     filename = models.CharField(max_length=1024)
     file_resource = models.ForeignKey('FileResource', null=True,
                                       related_name='file_data_objects')
-    md5 = models.CharField(max_length=255)
+    md5 = models.CharField(max_length=255, db_index=True)
     source_type = models.CharField(
         max_length=255,
         choices=(('imported', 'Imported'),
@@ -199,6 +217,10 @@ class FileDataObject(DataObject):
     )
     file_import = jsonfield.JSONField(null=True)
 
+    @classmethod
+    def filter_by_md5_list(cls, md5_list):
+        return cls.objects.filter(md5__in=[md5 for md5 in md5_list if md5])
+
     def initialize(self):
         if not self.file_resource:
             self._initialize_file_resource()
@@ -210,7 +232,9 @@ class FileDataObject(DataObject):
         #
         # If a file with identical content has already been uploaded,
         # re-use it if permitted by settings. 
-        if not get_setting('KEEP_DUPLICATE_FILES'):
+        # A blank md5 means the client will calculate it during upload
+        # and set it with FileResource.finalize.
+        if not get_setting('KEEP_DUPLICATE_FILES') and self.md5:
             matching_file_resources = FileResource.objects.filter(
                 md5=self.md5,
                 upload_status='complete')
@@ -295,7 +319,7 @@ class FileResource(BaseModel):
     datetime_created = models.DateTimeField(
         default=timezone.now, editable=False)
     file_url = models.CharField(max_length=1000)
-    md5 = models.CharField(max_length=255)
+    md5 = models.CharField(max_length=255, db_index=True)
     upload_status = models.CharField(
         max_length=255,
         default='incomplete',
@@ -303,8 +327,54 @@ class FileResource(BaseModel):
                  ('complete', 'Complete'),
                  ('failed', 'Failed')))
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(FileResource, cls).from_db(db, field_names, values)
+        # Kept so that post_save can tell when the upload completes
+        instance._saved_upload_status = instance.upload_status
+        return instance
+
     def is_ready(self):
         return self.upload_status == 'complete'
+
+    def finalize(self, md5):
+        """Record an md5 that the client calculated while uploading
+        and mark the upload complete. File data objects that were created
+        without an md5 get this one.
+        """
+        for file_data_object in self.file_data_objects.all():
+            if file_data_object.md5 and file_data_object.md5 != md5:
+                raise MD5MismatchError(
+                    'Uploaded file has md5 %s but file %s@%s expects %s' % (
+                        md5, file_data_object.filename,
+                        file_data_object.uuid, file_data_object.md5))
+        for file_data_object in self.file_data_objects.filter(md5=''):
+            file_data_object.md5 = md5
+            file_data_object.save()
+        self.md5 = md5
+        self.upload_status = 'complete'
+        self.save()
+
+    @classmethod
+    def set_upload_status_in_bulk(cls, uuids, upload_status):
+        """Update upload_status on many resources with one query.
+        _change is incremented so that concurrent saves of a stale copy
+        still raise ConcurrentModificationError.
+        """
+        resources = cls.objects.filter(uuid__in=uuids)
+        count = resources.update(
+            upload_status=upload_status, _change=F('_change')+1)
+        if upload_status == 'complete':
+            # update() sends no post_save, so do what the receiver would
+            for resource_id in resources.values_list('id', flat=True):
+                tasks.create_tasks_for_file_resource(resource_id)
+        return count
+
+    @classmethod
+    def can_finalize_md5_after_upload(cls):
+        # When duplicates are not kept, the storage path is derived from
+        # the md5, so it must be known before upload.
+        return bool(get_setting('KEEP_DUPLICATE_FILES'))
     
     @classmethod
     def create_incomplete_resource_for_import(cls, file_data_object):
@@ -432,17 +502,39 @@ class FileResource(BaseModel):
         }
         return source_type_to_path[file_data_object.source_type]
 
+    # Maps each LOOM_STORAGE_TYPE to a function that returns the url
+    # prefix for files stored there. The client's filemanager must have
+    # a storage backend registered for the url scheme.
+    _storage_url_prefixes = {
+        'LOCAL': lambda: 'file://',
+        'GOOGLE_STORAGE': lambda: 'gs://' + get_setting('GOOGLE_STORAGE_BUCKET'),
+        'S3': lambda: 's3://' + get_setting('S3_BUCKET'),
+    }
+
+    @classmethod
+    def register_storage_type(cls, storage_type, get_url_prefix):
+        cls._storage_url_prefixes[storage_type.upper()] = get_url_prefix
+
     @classmethod
     def _add_url_prefix(cls, path):
         if not path.startswith('/'):
             raise RelativePathError(
                 'Expected an absolute path but got path="%s"' % path)
         LOOM_STORAGE_TYPE = get_setting('LOOM_STORAGE_TYPE')
-        if LOOM_STORAGE_TYPE == 'LOCAL':
-            return 'file://' + path
-        elif LOOM_STORAGE_TYPE == 'GOOGLE_STORAGE':
-            return 'gs://' + get_setting('GOOGLE_STORAGE_BUCKET') + path
-        else:
+        try:
+            get_url_prefix = cls._storage_url_prefixes[LOOM_STORAGE_TYPE]
+        except KeyError:
             raise InvalidFileServerTypeError(
                 'Couldn\'t recognize value for setting LOOM_STORAGE_TYPE="%s"'\
                 % LOOM_STORAGE_TYPE)
+        return get_url_prefix() + path
+
+
+@receiver(models.signals.post_save, sender=FileResource)
+def _post_save_file_resource_signal_receiver(sender, instance, **kwargs):
+    # Files become ready for use as inputs when their upload completes.
+    # Later saves of a complete resource change nothing for its steps.
+    if instance.is_ready() and \
+       getattr(instance, '_saved_upload_status', None) != 'complete':
+        tasks.create_tasks_for_file_resource(instance.id)
+    instance._saved_upload_status = instance.upload_status
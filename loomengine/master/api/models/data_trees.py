@@ -1,6 +1,8 @@
 from .base import BaseModel
 from django.db import models
+from django.core.cache import caches
 from django.core.exceptions import ObjectDoesNotExist
+import math
 
 from api.models.data_objects import DataObject
 from api.models import uuidstr
@@ -47,6 +49,22 @@ class DataNode(BaseModel):
 
     EMPTY_BRANCH_VALUE = []
 
+    # Maximum number of rows per INSERT or SELECT when building
+    # a tree in bulk
+    BULK_CREATE_BATCH_SIZE = 500
+
+    def get_contents_cache_key(self):
+        # Rendered contents of a tree are cached under this key by
+        # DataNodeSerializer. It is the same for all nodes in the tree.
+        if self.root_node_id is None or self.root_node_id == self.id:
+            root_uuid = self.uuid
+        else:
+            root_uuid = self.root_node.uuid
+        return 'data-tree-contents-%s' % root_uuid
+
+    def invalidate_cached_contents(self):
+        caches['shared'].delete(self.get_contents_cache_key())
+
     @classmethod
     def create_from_scalar(self, data_object):
         data_node = DataNode.objects.create()
@@ -56,6 +74,63 @@ class DataNode(BaseModel):
         data_node.save()
         return data_node
 
+    def add_data_objects_in_bulk(self, contents):
+        """Add a whole tree of data below this empty node.
+        contents is a DataObject, or a list of [lists of]^n DataObjects.
+        None marks a missing branch.
+
+        The tree is built in memory and saved one level at a time with
+        bulk_create, so the number of queries depends on the height
+        of the tree rather than the number of nodes.
+        """
+        if not isinstance(contents, list):
+            self._add_scalar_data_object(contents)
+            return
+        if not self._is_missing_branch():
+            raise RootDataAlreadyExistsError(
+                'Failed to add data since the DataNode is already '\
+                'initialized')
+        self.degree = len(contents)
+        self.save()
+        root_node_id = self.root_node_id or self.id
+        level = [(self, contents)]
+        while level:
+            branches = []
+            new_nodes = []
+            for (parent, items) in level:
+                for (index, item) in enumerate(items):
+                    if item is None:
+                        continue
+                    if isinstance(item, list):
+                        node = DataNode(parent_id=parent.id,
+                                        root_node_id=root_node_id,
+                                        index=index,
+                                        degree=len(item))
+                        branches.append((node, item))
+                    else:
+                        node = DataNode(parent_id=parent.id,
+                                        root_node_id=root_node_id,
+                                        index=index,
+                                        data_object=item)
+                    new_nodes.append(node)
+            DataNode.objects.bulk_create(
+                new_nodes, batch_size=self.BULK_CREATE_BATCH_SIZE)
+            self._set_ids_from_database([node for (node, item) in branches])
+            level = branches
+        self.invalidate_cached_contents()
+
+    @classmethod
+    def _set_ids_from_database(cls, nodes):
+        # bulk_create does not set primary keys on all database
+        # backends, so look them up by uuid.
+        for i in range(0, len(nodes), cls.BULK_CREATE_BATCH_SIZE):
+            chunk = nodes[i:i+cls.BULK_CREATE_BATCH_SIZE]
+            ids = dict(DataNode.objects.filter(
+                uuid__in=[node.uuid for node in chunk]).values_list(
+                    'uuid', 'id'))
+            for node in chunk:
+                node.id = ids[node.uuid]
+
     def add_leaf(self, index, data_object):
         self._check_index(index)
         existing_leaf = self._get_child_by_index(index)
@@ -63,6 +138,7 @@ class DataNode(BaseModel):
             raise LeafDataAlreadyExistsError(
                 'Leaf data node already exists at this index')
         else:
+            self.invalidate_cached_contents()
             return DataNode.objects.create(
                 parent=self,
                 root_node=self.root_node,
@@ -124,6 +200,144 @@ class DataNode(BaseModel):
                     'Requested branch is missing')
             return child.get_node(path)
         
+    def is_complete(self):
+        """True if every branch below this node has all of its
+        children and every leaf has data.
+        """
+        return self._is_complete(self._load_subtree())
+
+    def is_ready(self):
+        """True if this node is complete and the data at every leaf
+        is ready, e.g. files have finished uploading.
+        """
+        return self._is_complete(self._load_subtree(), check_ready=True)
+
+    def get_ready_leaves(self):
+        """Returns (path, data_object) for each leaf below this node
+        whose data is ready. path is a list of (index, degree) pairs,
+        as used by add_data_object.
+        """
+        leaves = []
+        self._collect_ready_leaves(self._load_subtree(), [], leaves)
+        return leaves
+
+    def get_ready_branches(self):
+        """Returns (path, [data_object, ...]) for each branch one level
+        above the leaves whose leaves are all present and ready. This is
+        the data for a 'gather' input. If this node is a scalar leaf,
+        it is returned as a list of one.
+        """
+        branches = []
+        for (path, degree, leaves) in self._get_leaf_branches():
+            ready = [leaf.data_object for leaf in leaves
+                     if leaf.data_object.is_ready()]
+            if degree is None:
+                # Scalar
+                if ready:
+                    branches.append((path, ready))
+                continue
+            if len(ready) == degree:
+                branches.append((path, ready))
+        return branches
+
+    def get_ready_batches(self, batch_size):
+        """Splits each branch one level above the leaves into batches of
+        batch_size consecutive leaves, and returns (path, [data_object,
+        ...]) for each batch whose leaves are all present and ready.
+        The path of a batch is the path of its branch extended by
+        (batch_index, batch_count).
+        """
+        batches = []
+        for (path, degree, leaves) in self._get_leaf_branches():
+            if degree is None:
+                # Scalar
+                if leaves[0].data_object.is_ready():
+                    batches.append((path, [leaves[0].data_object]))
+                continue
+            ready = dict((leaf.index, leaf.data_object) for leaf in leaves
+                         if leaf.data_object.is_ready())
+            batch_count = int(math.ceil(float(degree) / batch_size))
+            for batch_index in range(batch_count):
+                indexes = range(batch_index * batch_size,
+                                min((batch_index + 1) * batch_size, degree))
+                if all([index in ready for index in indexes]):
+                    batches.append(
+                        (path + [(batch_index, batch_count)],
+                         [ready[index] for index in indexes]))
+        return batches
+
+    def _get_leaf_branches(self):
+        # Returns (path, degree, [leaf nodes]) for each branch one level
+        # above the leaves. A scalar root is returned as
+        # ([], None, [self]).
+        branches = []
+        self._collect_leaf_branches(self._load_subtree(), [], branches)
+        return branches
+
+    def _load_subtree(self, related_fields=('data_object',)):
+        # Returns {parent_id: [children sorted by index]} for all nodes
+        # below this one. Nodes that know their root are loaded with one
+        # query on root_node. Otherwise one query per level is used.
+        children = {}
+        if self.root_node_id is not None:
+            nodes = DataNode.objects.filter(root_node_id=self.root_node_id)\
+                                    .exclude(id=self.root_node_id)\
+                                    .select_related(*related_fields)
+            for node in nodes:
+                children.setdefault(node.parent_id, []).append(node)
+        else:
+            frontier = [self.id]
+            while frontier:
+                parent_ids = frontier
+                frontier = []
+                for i in range(0, len(parent_ids), self.BULK_CREATE_BATCH_SIZE):
+                    level = DataNode.objects.filter(
+                        parent_id__in=parent_ids[
+                            i:i+self.BULK_CREATE_BATCH_SIZE])\
+                        .select_related(*related_fields)
+                    for node in level:
+                        children.setdefault(node.parent_id, []).append(node)
+                        frontier.append(node.id)
+        for siblings in children.values():
+            siblings.sort(key=lambda node: node.index)
+        return children
+
+    def _is_complete(self, children, check_ready=False):
+        if self.data_object is not None:
+            return not check_ready or self.data_object.is_ready()
+        if self.degree is None:
+            return False
+        my_children = children.get(self.id, [])
+        if len(my_children) != self.degree:
+            return False
+        return all([child._is_complete(children, check_ready=check_ready)
+                    for child in my_children])
+
+    def _collect_ready_leaves(self, children, path, leaves):
+        if self.data_object is not None:
+            if self.data_object.is_ready():
+                leaves.append((path, self.data_object))
+            return
+        for child in children.get(self.id, []):
+            child._collect_ready_leaves(
+                children, path + [(child.index, self.degree)], leaves)
+
+    def _collect_leaf_branches(self, children, path, branches):
+        if self.data_object is not None:
+            branches.append((path, None, [self]))
+            return
+        if self.degree is None:
+            return
+        my_children = children.get(self.id, [])
+        if not my_children:
+            return
+        if all([child.data_object is not None for child in my_children]):
+            branches.append((path, self.degree, my_children))
+            return
+        for child in my_children:
+            child._collect_leaf_branches(
+                children, path + [(child.index, self.degree)], branches)
+
     def _get_child_by_index(self, index):
         try:
             child = self.children.get(index=index)
@@ -147,6 +361,7 @@ class DataNode(BaseModel):
                 "already initialized")
         self.data_object = data_object
         self.save()
+        self.invalidate_cached_contents()
 
     def _is_missing_branch(self):
         return (self.degree is None
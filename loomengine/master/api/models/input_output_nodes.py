@@ -1,6 +1,8 @@
 from .base import BaseModel
 from django.db import models
+import itertools
 
+from api import tasks
 from api.models.data_objects import DataObject
 from api.models.data_trees import DataNode
 
@@ -56,6 +58,7 @@ class InputOutputNode(BaseModel):
     def _initialize_data_root(self):
         self.data_root = DataNode.objects.create()
         self.data_root.root_node = self.data_root
+        self.data_root.save()
         self.save()
 
     def add_data_object(self, path, data_object):
@@ -68,6 +71,8 @@ class InputOutputNode(BaseModel):
         if self.data_root is None:
             self._initialize_data_root()
         self.data_root.add_data_object(path, data_object)
+        # Any StepRun reading from this tree may now have ready inputs
+        tasks.create_tasks_for_data_root(self.data_root.id)
 
     def is_connected(self, connected_node):
         if self.data_root is None or connected_node.data_root is None:
@@ -110,41 +115,93 @@ class InputNodeSet(object):
     Each input node may have more than one DataObject,
     and DataObjects may arrive to the node at different times.
     An InputNodeSet corresponds to a single StepRun.
+
+    Inputs in the same group are combined by dot product: their data
+    paths must match, except that an input with a shorter path (e.g. a
+    scalar) is reused for every path that it is a prefix of. Groups are
+    combined with each other by cross product, in order of group number.
     """
     def __init__(self, input_nodes):
         self.input_nodes = input_nodes
 
     def get_ready_input_sets(self):
-        # This is simplified and only handles scalar inputs
+        """Returns one InputSet for each data path where all inputs are
+        ready. Inputs that are still arriving produce more InputSets on
+        later calls.
+        """
+        groups = {}
         for input_node in self.input_nodes:
-            if not input_node.is_ready():
+            groups.setdefault(input_node.group, []).append(input_node)
+        ready_by_group = [self._get_ready_items_for_group(groups[group])
+                          for group in sorted(groups.keys())]
+        input_sets = []
+        for combination in itertools.product(*ready_by_group):
+            data_path = []
+            input_items = []
+            for (group_path, group_items) in combination:
+                data_path.extend(group_path)
+                input_items.extend(group_items)
+            input_sets.append(InputSet(data_path, input_items))
+        return input_sets
+
+    def _get_ready_items_for_group(self, input_nodes):
+        # Returns a list of (path, [InputItem, ...])
+        ready_data = []
+        for input_node in input_nodes:
+            ready = dict((tuple(path), data) for (path, data)
+                         in input_node.get_ready_data())
+            if not ready:
                 return []
-        return [InputSet(self.input_nodes)]
+            ready_data.append((input_node, ready))
+        depth = max([len(path) for (input_node, ready) in ready_data
+                     for path in ready.keys()])
+        candidate_paths = set()
+        for (input_node, ready) in ready_data:
+            candidate_paths.update(
+                [path for path in ready.keys() if len(path) == depth])
+        items_by_path = []
+        for path in sorted(candidate_paths):
+            items = []
+            for (input_node, ready) in ready_data:
+                input_depth = len(ready.keys()[0])
+                data = ready.get(path[:input_depth])
+                if data is None:
+                    break
+                items.append(InputItem(input_node.channel,
+                                       input_node.type,
+                                       data))
+            else:
+                items_by_path.append((list(path), items))
+        return items_by_path
 
     def get_missing_inputs(self):
         missing = []
         for input_node in self.input_nodes:
-            if not input_node.is_ready():
+            if not input_node.get_ready_data():
                 missing.append(input_node)
         return missing
 
 
 class InputItem(object):
-    """A DataObject and its channel name"""
+    """The data for one input channel of a Task. data is either a
+    DataObject or, for a gathered input, a list of DataObjects.
+    """
 
-    def __init__(self, input_node):
-        self.data_object = input_node.get_data_as_scalar()
-        self.type = self.data_object.type
-        self.channel = input_node.channel
+    def __init__(self, channel, type, data):
+        self.channel = channel
+        self.type = type
+        self.data = data
 
 
 class InputSet(object):
     """An InputNodeSet can produce one or more InputSets, and each
-    InputSet corresponds to a single TaskRun.
+    InputSet corresponds to a single Task. data_path is the position
+    of the Task's outputs in the StepRun's output trees.
     """
 
-    def __init__(self, input_nodes):
-        self.input_items = [InputItem(i) for i in input_nodes]
+    def __init__(self, data_path, input_items):
+        self.data_path = data_path
+        self.input_items = input_items
 
     def __iter__(self):
         return self.input_items.__iter__()
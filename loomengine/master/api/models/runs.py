@@ -1,4 +1,5 @@
 from django.db import models, IntegrityError
+from django.db.models import F
 from django.dispatch import receiver
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.utils import timezone
@@ -104,6 +105,18 @@ class Run(BaseModel):
     # True if ANY input ports have not received all inputs
     # status_waiting_for_inputs = models.BooleanField(default=False)
 
+    # Only changed by F() expressions, never by save, so that a save
+    # from a stale copy of the run does not undo a concurrent increment
+    COUNTER_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        if self.pk and self.COUNTER_FIELDS and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS]
+        super(Run, self).save(*args, **kwargs)
+
     @property
     def status(self):
         if self.status_is_failed:
@@ -276,6 +289,12 @@ class Run(BaseModel):
     def kill(self, kill_message):
         return self._get_manager().kill(kill_message)
 
+    def _set_finished_after_update(self):
+        # Match this copy to the row, after it was finished with update()
+        self.status_is_running = False
+        self.status_is_finished = True
+        self._change += 1
+
     def add_timepoint(self, message, detail='', is_error=False):
         timepoint = RunTimepoint.objects.create(
             message=message, run=self, detail=detail, is_error=is_error)
@@ -296,12 +315,13 @@ class RunTimepoint(BaseModel):
 
 class WorkflowRun(Run):
 
-    # True if ANY steps are running
-    # status_running = models.BooleanField(default=False)
+    # Counters are updated with F() expressions, so that concurrent
+    # updates from child runs are not lost. status_steps_total is set
+    # before the steps are created.
+    status_steps_total = models.IntegerField(default=0)
+    status_steps_finished = models.IntegerField(default=0)
 
-    # status_steps_waiting = models.IntegerField(default=0)
-    # status_steps_running = models.IntegerField(default=0)
-    # status_steps_finished = models.IntegerField(default=0)
+    COUNTER_FIELDS = ('status_steps_finished',)
 
     def add_step(self, step_run):
         step_run.parent = self
@@ -327,6 +347,9 @@ class WorkflowRun(Run):
         if not run.postprocessing_status == 'not_started':
             return
         run.postprocessing_status = 'in_progress'
+        # Set before any step is created, since a step may finish before
+        # the rest are created
+        run.status_steps_total = run.template.workflow.steps.count()
         try:
             run.save()
         except ConcurrentModificationError:
@@ -344,6 +367,9 @@ class WorkflowRun(Run):
             run.save()
             raise e
 
+        # A workflow with no steps is finished as soon as it is ready
+        run.update_workflow_status()
+
     def _initialize_inputs(self):
         run = self.downcast()
         visited_channels = set()
@@ -424,21 +450,34 @@ class WorkflowRun(Run):
             connector = self.connectors.get(channel=io_node.channel)
         connector.connect(io_node)
 
+    def child_finished(self, child):
+        """Count a finished step, and finish this run too if it was the
+        last one.
+        """
+        self.add_timepoint("Child Run %s@%s finished successfully" % (
+            child.name, child.uuid))
+        WorkflowRun.objects.filter(id=self.id).update(
+            status_steps_finished=F('status_steps_finished')+1)
+        self.update_workflow_status()
+
     def update_workflow_status(self):
-        if self._are_children_finished():
-            self.status_is_running = False
-            self.status_is_finished = True
-            self.save()
-            self.add_timepoint("Run %s@%s finished successfully" % (
-                self.name, self.uuid))
-            if self.parent:
-                self.parent.add_timepoint("Child Run %s@%s finished successfully" % (
-                    self.name, self.uuid))
+        (steps_total, steps_finished) = WorkflowRun.objects.filter(
+            id=self.id).values_list(
+                'status_steps_total', 'status_steps_finished').get()
+        if steps_finished < steps_total:
+            return
+        # Only one caller finishes the run, if several see the last step
+        # finish
+        if not WorkflowRun.objects.filter(
+                id=self.id, status_is_running=True).update(
+                    status_is_running=False, status_is_finished=True,
+                    _change=F('_change')+1):
+            return
+        self._set_finished_after_update()
+        self.add_timepoint("Run %s@%s finished successfully" % (
+            self.name, self.uuid))
         if self.parent:
-            self.parent.update_workflow_status()
-
-    def _are_children_finished(self):
-        return all([step.status_is_finished for step in self.steps.all()])
+            self.parent.child_finished(self)
 
     def _kill(self, kill_message):
         self.add_timepoint('Run killed', detail=kill_message, is_error=True)
@@ -454,24 +493,61 @@ class StepRun(Run):
     command = models.TextField()
     interpreter = models.CharField(max_length=1024)
 
-    # True if ANY tasks are running
-    # status_running = models.BooleanField(default=False)
+    # Counters are updated with F() expressions, so that concurrent
+    # updates from tasks are not lost
+    status_tasks_created = models.IntegerField(default=0)
+    status_tasks_finished = models.IntegerField(default=0)
 
-    # status_tasks_running = models.IntegerField(default=0)
-    # status_tasks_finished = models.IntegerField(default=0)
-    # status_tasks_failed = models.IntegerField(default=0)
+    COUNTER_FIELDS = ('status_tasks_created', 'status_tasks_finished')
 
     def create_ready_tasks(self, do_start=True):
-        # This is a temporary limit. It assumes no parallel workflows, and no
-        # failure recovery, so each step has only one Task.
-        if self.tasks.count() > 0:
-            # Already ran. Nothing new to process
-            return []
-        else:
-            for input_set in InputNodeSet(
-                    self.inputs.all()).get_ready_input_sets():
-                task = Task.create_from_input_set(input_set, self)
-            return self.tasks.all()
+        # One Task is created for each data path whose inputs are ready.
+        # Paths that already have a Task are skipped, so this can be
+        # called again as more input data arrives.
+        existing_paths = set([self._path_key(task.data_path)
+                              for task in self.tasks.all()])
+        new_tasks = []
+        for input_set in InputNodeSet(
+                self.inputs.all()).get_ready_input_sets():
+            if self._path_key(input_set.data_path) in existing_paths:
+                continue
+            new_tasks.append(Task.create_from_input_set(input_set, self))
+            existing_paths.add(self._path_key(input_set.data_path))
+        if new_tasks:
+            StepRun.objects.filter(id=self.id).update(
+                status_tasks_created=F('status_tasks_created')+len(new_tasks))
+        return new_tasks
+
+    def task_finished(self):
+        StepRun.objects.filter(id=self.id).update(
+            status_tasks_finished=F('status_tasks_finished')+1)
+        self.update_status()
+
+    def are_all_tasks_finished(self):
+        # Tasks still running is the usual case, so check that first
+        (tasks_created, tasks_finished) = StepRun.objects.filter(
+            id=self.id).values_list(
+                'status_tasks_created', 'status_tasks_finished').get()
+        if tasks_finished < tasks_created:
+            return False
+        # All input data must have arrived and be ready, and each
+        # data path must have a finished Task.
+        inputs = self.inputs.all()
+        if not all([input.data_root is not None
+                    and input.data_root.is_ready()
+                    for input in inputs]):
+            return False
+        finished_paths = set([self._path_key(task.data_path)
+                              for task in self.tasks.filter(
+                                      status_is_finished=True)])
+        for input_set in InputNodeSet(inputs).get_ready_input_sets():
+            if self._path_key(input_set.data_path) not in finished_paths:
+                return False
+        return True
+
+    @classmethod
+    def _path_key(cls, data_path):
+        return tuple([tuple(step) for step in (data_path or [])])
 
     @classmethod
     def postprocess(cls, run_uuid):
@@ -509,6 +585,12 @@ class StepRun(Run):
             run.save()
             raise e
 
+        # Pull the image while waiting for inputs
+        tasks.prewarm_image((run.template.environment or {}).get('docker_image'))
+
+        # Inputs may already have data
+        tasks.create_tasks_from_step_run(run.uuid)
+
     def _initialize_inputs(self):
         visited_channels = set()
         for input in self.template.inputs:
@@ -522,7 +604,8 @@ class StepRun(Run):
                 channel=input.get('channel'),
                 type=input.get('type'),
                 group=input.get('group'),
-                mode=input.get('mode'))
+                mode=input.get('mode'),
+                gather=input.get('gather'))
             
             # One of these two should always take effect. The other is ignored.
             self._connect_input_to_parent(run_input)
@@ -563,15 +646,20 @@ class StepRun(Run):
         return self.outputs.get(channel=channel)
 
     def update_status(self):
-        self.status_is_finished = True
-        self.status_is_running = False
-        self.save()
+        if not self.are_all_tasks_finished():
+            return
+        # Only one caller finishes the run, if several see the last task
+        # finish
+        if not StepRun.objects.filter(
+                id=self.id, status_is_running=True).update(
+                    status_is_running=False, status_is_finished=True,
+                    _change=F('_change')+1):
+            return
+        self._set_finished_after_update()
         self.add_timepoint("Run %s@%s finished successfully" % (self.name, self.uuid))
         if self.parent:
-            self.parent.add_timepoint(
-                "Child Run %s@%s finished successfully" % (self.name, self.uuid))
-            self.parent.update_workflow_status()
-                
+            self.parent.child_finished(self)
+
 
     def _kill(self, kill_message):
         self.add_timepoint('Run killed', detail=kill_message, is_error=True)
@@ -589,6 +677,26 @@ class AbstractStepRunInput(InputOutputNode):
             return False
         return self.get_data_as_scalar().is_ready()
 
+    def get_ready_data(self):
+        """Returns (path, data) for each item of ready input data. With
+        mode 'gather', each item is the list of DataObjects from one
+        branch. Otherwise each item is one DataObject.
+
+        By default a branch is gathered when all of its leaves are
+        ready. The 'gather' option 'batch_size' instead gathers it in
+        consecutive batches of that many leaves, each as soon as it
+        is ready.
+        """
+        if self.data_root is None:
+            return []
+        if self.mode == 'gather':
+            options = self.gather or {}
+            if options.get('batch_size'):
+                return self.data_root.get_ready_batches(
+                    int(options.get('batch_size')))
+            return self.data_root.get_ready_branches()
+        return self.data_root.get_ready_leaves()
+
     class Meta:
         abstract=True
 
@@ -599,6 +707,8 @@ class StepRunInput(AbstractStepRunInput):
                                  on_delete=models.CASCADE)
     mode = models.CharField(max_length=255)
     group = models.IntegerField()
+    # Options for incremental gather. See get_ready_data
+    gather = jsonfield.JSONField(null=True)
 
 
 class StepRunOutput(InputOutputNode):
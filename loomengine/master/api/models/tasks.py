@@ -1,15 +1,18 @@
-from django.db import models
+from django.core.cache import caches
+from django.db import IntegrityError, models, transaction
 from django.dispatch import receiver
 from django.core.exceptions import ObjectDoesNotExist
 from django.dispatch import receiver
 from django.utils import timezone
+import datetime
 import os
 import jsonfield
 
 from api import tasks
 from api.models import uuidstr
 from .base import BaseModel, render_from_template
-from api.models.data_objects import DataObject, FileDataObject
+from api.models.data_objects import DataObject, DataObjectArray, \
+    FileDataObject
 from api import get_setting
 
 
@@ -35,6 +38,9 @@ class Task(BaseModel):
                                  related_name='tasks',
                                  on_delete=models.CASCADE,
                                  null=True) # null for testing only
+    # Position of this Task's outputs in the StepRun output trees,
+    # as a list of [index, degree] pairs. Empty if not scattered.
+    data_path = jsonfield.JSONField(default=list)
 
     selected_task_attempt = models.OneToOneField('TaskAttempt',
                                                related_name='task_as_selected',
@@ -46,6 +52,8 @@ class Task(BaseModel):
     status_is_failed = models.BooleanField(default=False)
     status_is_killed = models.BooleanField(default=False)
     status_is_finished = models.BooleanField(default=False)
+    # Queued for the scheduler to start a new TaskAttempt
+    status_is_waiting = models.BooleanField(default=False)
 
     @property
     def attempt_number(self):
@@ -55,7 +63,7 @@ class Task(BaseModel):
         heartbeat = int(get_setting('TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS'))
         timeout = int(get_setting('TASKRUNNER_HEARTBEAT_TIMEOUT_SECONDS'))
         try:
-            last_heartbeat = self.selected_task_attempt.last_heartbeat
+            last_heartbeat = self.selected_task_attempt.get_last_heartbeat()
         except AttributeError:
             # No TaskAttempt selected
             last_heartbeat = self.datetime_created
@@ -80,10 +88,10 @@ class Task(BaseModel):
         self.status_is_running = False
         self.save()
         self.step_run.add_timepoint('Child Task %s finished successfully' % self.uuid)
-        self.step_run.update_status()
         for output in self.outputs.all():
             output.pull_data_object()
             output.push_data_object()
+        self.step_run.task_finished()
         for task_attempt in self.task_attempts.all():
             task_attempt.cleanup()
 
@@ -132,13 +140,20 @@ class Task(BaseModel):
             interpreter=step_run.interpreter,
             environment=step_run.template.environment,
             resources=step_run.template.resources,
+            data_path=input_set.data_path,
         )
         for input in input_set:
+            if isinstance(input.data, list):
+                # Gathered input
+                data_object = DataObjectArray.create_from_list(
+                    input.data, input.type)
+            else:
+                data_object = input.data
             TaskInput.objects.create(
                 task=task,
                 channel=input.channel,
                 type=input.type,
-                data_object = input.data_object)
+                data_object = data_object)
         for step_run_output in step_run.outputs.all():
             task_output = TaskOutput.objects.create(
                 channel = step_run_output.channel,
@@ -228,8 +243,11 @@ class TaskOutput(BaseModel):
 
     def push_data_object(self):
         step_run_output = self.task.step_run.get_output(self.channel)
-        if not step_run_output.has_scalar():
-            step_run_output.add_data_object([], self.data_object)
+        path = [tuple(step) for step in self.task.data_path]
+        if step_run_output.data_root is None or \
+           not step_run_output.data_root.has_data_object(
+               [index for (index, degree) in path]):
+            step_run_output.add_data_object(path, self.data_object)
 
 
 class TaskTimepoint(BaseModel):
@@ -259,6 +277,8 @@ class TaskAttempt(BaseModel):
     rendered_command = models.TextField()
     environment = jsonfield.JSONField()
     resources = jsonfield.JSONField()
+    # Heartbeats are kept in the "heartbeats" cache, so that they don't
+    # each write a row here. This is only the time of the last save.
     last_heartbeat = models.DateTimeField(auto_now=True)
     status_is_failed = models.BooleanField(default=False)
     status_is_finished = models.BooleanField(default=False)
@@ -266,9 +286,29 @@ class TaskAttempt(BaseModel):
     status_is_running = models.BooleanField(default=True)
     status_is_cleaned_up = models.BooleanField(default=False)
 
+    HEARTBEAT_CACHE_SECONDS = 24*60*60
+
     def heartbeat(self):
-        task_attempt = TaskAttempt.objects.get(uuid=self.uuid)
-        task_attempt.save()
+        self.record_heartbeats_in_bulk([self.uuid])
+
+    @classmethod
+    def record_heartbeats_in_bulk(cls, uuids):
+        now = timezone.now()
+        with transaction.atomic():
+            caches['heartbeats'].set_many(
+                dict([(cls._get_heartbeat_key(uuid), now) for uuid in uuids]),
+                cls.HEARTBEAT_CACHE_SECONDS)
+
+    def get_last_heartbeat(self):
+        last_heartbeat = caches['heartbeats'].get(
+            self._get_heartbeat_key(self.uuid))
+        if last_heartbeat is None or last_heartbeat < self.last_heartbeat:
+            return self.last_heartbeat
+        return last_heartbeat
+
+    @classmethod
+    def _get_heartbeat_key(cls, uuid):
+        return 'task-attempt-%s' % uuid
 
     def get_output(self, channel):
         return self.outputs.get(channel=channel)
@@ -282,6 +322,7 @@ class TaskAttempt(BaseModel):
         task_attempt.status_is_failed = True
         task_attempt.status_is_running = False
         task_attempt.save()
+        tasks.schedule_tasks()
         task_attempt.add_timepoint(
             "TaskAttempt %s failed" % self.uuid,
             detail='The TaskRunner experienced an error when executing '\
@@ -302,6 +343,7 @@ class TaskAttempt(BaseModel):
         self.status_is_finished = True
         self.status_is_running = False
         self.save()
+        tasks.schedule_tasks()
         try:
             task = self.task_as_selected
         except ObjectDoesNotExist:
@@ -380,6 +422,24 @@ class TaskAttempt(BaseModel):
                             str(self.uuid),
                             'logs')
 
+    def get_input_cache_dir(self):
+        # Shared by all task attempts on a node. Keep it on the same
+        # filesystem as the working dirs so inputs can be hard-linked.
+        return os.path.join(get_setting('FILE_ROOT_FOR_WORKER'),
+                            'input_cache')
+
+    def get_image_lock_dir(self):
+        # Shared by all task runners on a node, so that each image is
+        # pulled once
+        return os.path.join(get_setting('FILE_ROOT_FOR_WORKER'),
+                            'image_locks')
+
+    def get_heartbeat_dir(self):
+        # Shared by all task runners on a node, so that one request
+        # carries the heartbeats of all of them
+        return os.path.join(get_setting('FILE_ROOT_FOR_WORKER'),
+                            'heartbeats')
+
     def get_worker_log_file(self):
         return os.path.join(self.get_log_dir(), 'worker.log')
 
@@ -393,6 +453,7 @@ class TaskAttempt(BaseModel):
         self.status_is_killed = True
         self.status_is_running = False
         self.save()
+        tasks.schedule_tasks()
         self.add_timepoint('TaskAttempt killed', detail=kill_message, is_error=True)
 
     def cleanup(self):
@@ -498,3 +559,78 @@ class TaskAttemptTimepoint(BaseModel):
     message = models.CharField(max_length=255)
     detail = models.TextField(null=True, blank=True)
     is_error = models.BooleanField(default=False)
+
+
+class SchedulerLease(models.Model):
+    """A single row that is leased by whichever server process is running
+    a scheduling pass, on any host. It is taken with a conditional
+    update rather than a lock, so a process that finds it taken never
+    waits. Instead it sets rerun, and the holder makes another pass
+    before it lets go. It is only changed with update(), so it has no
+    _change field.
+    """
+
+    LEASE_ID = 1
+    # Long enough for any pass. A lease left by a process that died
+    # expires after this.
+    LEASE_SECONDS = 300
+
+    expires = models.DateTimeField(default=timezone.now)
+    rerun = models.BooleanField(default=False)
+
+    class Meta:
+        app_label = 'api'
+
+    @classmethod
+    def acquire(cls):
+        """Returns True if the lease was taken. Otherwise asks the holder
+        to make another pass.
+        """
+        cls._get_or_create()
+        if cls._try_to_acquire():
+            return True
+        cls.objects.filter(id=cls.LEASE_ID).update(rerun=True)
+        # The holder may have let go before it saw rerun
+        return cls._try_to_acquire()
+
+    @classmethod
+    def release(cls):
+        """Lets go of the lease, unless another pass was requested while
+        it was held. Returns False if the caller should make that pass
+        while still holding the lease.
+        """
+        if cls.objects.filter(id=cls.LEASE_ID, rerun=False).update(
+                expires=timezone.now()):
+            return True
+        cls.objects.filter(id=cls.LEASE_ID).update(
+            rerun=False,
+            expires=timezone.now()
+            + datetime.timedelta(seconds=cls.LEASE_SECONDS))
+        return False
+
+    @classmethod
+    def abandon(cls):
+        """Lets go of the lease after an error, dropping any pass that was
+        requested while it was held.
+        """
+        cls.objects.filter(id=cls.LEASE_ID).update(
+            rerun=False, expires=timezone.now())
+
+    @classmethod
+    def _try_to_acquire(cls):
+        now = timezone.now()
+        return bool(cls.objects.filter(
+            id=cls.LEASE_ID, expires__lte=now).update(
+                rerun=False,
+                expires=now + datetime.timedelta(seconds=cls.LEASE_SECONDS)))
+
+    @classmethod
+    def _get_or_create(cls):
+        if cls.objects.filter(id=cls.LEASE_ID).exists():
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(id=cls.LEASE_ID)
+        except IntegrityError:
+            # Created by another process
+            pass
@@ -83,7 +83,7 @@ class Template(BaseModel):
                                      ('step', 'Step')))
     datetime_created = models.DateTimeField(default=timezone.now,
                                             editable=False)
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     postprocessing_status = models.CharField(
         max_length=255,
         default='incomplete',
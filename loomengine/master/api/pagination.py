@@ -0,0 +1,32 @@
+from rest_framework import pagination
+from rest_framework.pagination import _positive_int
+
+
+class CursorPagination(pagination.CursorPagination):
+    """Keyset pagination on datetime_created, with id to break ties.
+
+    Pagination is applied only if the request has a 'page_size' or
+    'cursor' query parameter. Otherwise the full list is returned as
+    before, so older clients that expect a list keep working.
+    """
+
+    ordering = ('-datetime_created', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_size_query_param not in request.query_params \
+           and self.cursor_query_param not in request.query_params:
+            return None
+        return super(CursorPagination, self).paginate_queryset(
+            queryset, request, view=view)
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
@@ -0,0 +1,111 @@
+"""Decides which waiting Tasks may start, given what is already running.
+
+Capacity is modeled as a total of cores, memory and disk, plus a limit
+on the number of tasks, for all of the workers together. Any limit that
+is None is unlimited. Waiting tasks are packed first-fit into what is
+left: a task that does not fit is passed over for a smaller one behind
+it, rather than holding up the queue.
+
+Runs take turns. Each turn goes to the run with the fewest running
+tasks, so a wide scatter in one run does not starve the runs queued
+after it, and no run may have more than max_tasks_per_run running.
+"""
+
+from collections import defaultdict
+
+
+def parse_resources(resources):
+    """Returns (cores, memory_gb, disk_gb) requested by a step.
+    A step with no request for cores is counted as one core.
+    """
+    resources = resources or {}
+    return (float(resources.get('cores') or 1),
+            parse_gb(resources.get('memory')),
+            parse_gb(resources.get('disk_size')))
+
+
+def parse_gb(value):
+    # Sizes are in GB, e.g. "4", "4G" or "4GB"
+    if not value:
+        return 0.0
+    return float(str(value).strip().upper().rstrip('B').rstrip('G'))
+
+
+def _parse_limit(value):
+    if value is None or str(value).strip() == '':
+        return None
+    return float(value)
+
+
+class TaskScheduler(object):
+
+    def __init__(self, max_cores=None, max_memory_gb=None, max_disk_gb=None,
+                 max_tasks=None, max_tasks_per_run=None):
+        self.max_cores = _parse_limit(max_cores)
+        self.max_memory_gb = _parse_limit(max_memory_gb)
+        self.max_disk_gb = _parse_limit(max_disk_gb)
+        self.max_tasks = _parse_limit(max_tasks)
+        self.max_tasks_per_run = _parse_limit(max_tasks_per_run)
+
+    def select(self, running, waiting):
+        """running is a list of (run_id, resources) for started tasks.
+        waiting is a list of (run_id, resources, task) in the order the
+        tasks were queued. Returns the tasks to start, in order.
+        """
+        used = [0.0, 0.0, 0.0]
+        running_per_run = defaultdict(int)
+        for (run_id, resources) in running:
+            self._add(used, parse_resources(resources))
+            running_per_run[run_id] += 1
+        count = len(running)
+
+        queues = defaultdict(list)
+        run_order = []
+        for (run_id, resources, task) in waiting:
+            if run_id not in queues:
+                run_order.append(run_id)
+            queues[run_id].append((parse_resources(resources), task))
+
+        selected = []
+        while self.max_tasks is None or count < self.max_tasks:
+            # Fewest running tasks first, then whichever run queued first
+            candidates = sorted(
+                [run_id for run_id in run_order if queues[run_id]
+                 and not self._run_is_full(running_per_run[run_id])],
+                key=lambda run_id: (running_per_run[run_id],
+                                    run_order.index(run_id)))
+            admitted = False
+            for run_id in candidates:
+                for (i, (request, task)) in enumerate(queues[run_id]):
+                    if count == 0 or self._fits(used, request):
+                        # With nothing running, a task larger than the
+                        # whole capacity may still run alone.
+                        del queues[run_id][i]
+                        self._add(used, request)
+                        running_per_run[run_id] += 1
+                        count += 1
+                        selected.append(task)
+                        admitted = True
+                        break
+                if admitted:
+                    break
+            if not admitted:
+                break
+        return selected
+
+    def _run_is_full(self, count):
+        return self.max_tasks_per_run is not None \
+            and count >= self.max_tasks_per_run
+
+    def _fits(self, used, request):
+        for (total, limit, requested) in zip(
+                used,
+                [self.max_cores, self.max_memory_gb, self.max_disk_gb],
+                request):
+            if limit is not None and total + requested > limit:
+                return False
+        return True
+
+    def _add(self, used, request):
+        for i in range(len(used)):
+            used[i] += request[i]
@@ -19,6 +19,19 @@ def _get_class_from_string(kls):
     return m
 
 
+def project_fields(serializer, field_names):
+    """Render only the given top-level fields. For a ListSerializer
+    this applies to each item. Omitted fields are removed before
+    rendering, so nested data for them is never read.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    serializer.projected_fields = field_names
+    for name in list(serializer.fields.keys()):
+        if name not in field_names:
+            serializer.fields.pop(name)
+
+
 class RecursiveField(serializers.Serializer):
     def to_representation(self, value):
         serializer = self.parent.parent.__class__(value, context=self.context)
@@ -127,6 +140,8 @@ class SuperclassModelSerializer(serializers.HyperlinkedModelSerializer):
                 except ObjectDoesNotExist:
                     pass
             serializer = SubclassSerializer(instance, context=self.context)
+            if getattr(self, 'projected_fields', None) is not None:
+                project_fields(serializer, self.projected_fields)
             if isinstance(serializer, self.__class__):
                 return super(SuperclassModelSerializer, serializer)\
                     .to_representation(instance)
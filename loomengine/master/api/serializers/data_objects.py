@@ -85,6 +85,8 @@ class FileDataObjectSerializer(serializers.ModelSerializer):
         view_name='data-object-detail',
         lookup_field='uuid'
     )
+    # Blank if the client will set it after upload
+    md5 = serializers.CharField(required=False, allow_blank=True)
     
     class Meta:
         model = FileDataObject
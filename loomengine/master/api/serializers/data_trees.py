@@ -1,6 +1,6 @@
-import copy
 import jsonschema
 
+from django.core.cache import caches
 from rest_framework import serializers
 
 from .data_objects import DataObjectSerializer
@@ -13,6 +13,17 @@ class DataNodeSerializer(serializers.HyperlinkedModelSerializer):
 
     MISSING_BRANCH_VALUE = None
     EMPTY_BRANCH_VALUE = []
+    CACHE_TIMEOUT_SECONDS = 3600
+
+    # Loaded with each node so that leaves render without more queries
+    RELATED_FIELDS = (
+        'data_object',
+        'data_object__stringdataobject',
+        'data_object__booleandataobject',
+        'data_object__integerdataobject',
+        'data_object__floatdataobject',
+        'data_object__filedataobject__file_resource',
+    )
 
     # Serializes/deserializers a tree of DataObjects.
     # Input is a string, integer, float, boolean, or dict representation 
@@ -111,66 +122,80 @@ class DataNodeSerializer(serializers.HyperlinkedModelSerializer):
         return data_node
 
     def _add_data_objects(self, data_node, contents, data_type):
-        path = []
-        self._extend_all_paths_and_add_data_at_leaves(
-            data_node, contents, path, data_type)
+        data_node.add_data_objects_in_bulk(
+            self._get_data_objects(contents, data_type))
 
     def _data_tree_to_data_struct(self, data_node):
+        # The whole tree is loaded with one query and assembled in memory.
+        # Rendered contents of a root node are cached in a table shared by
+        # all server processes, but only once the tree is complete and all
+        # leaves are ready, since data may still be added to the tree and
+        # the status of a file may still change.
+        if data_node.root_node_id != data_node.id:
+            return self._render_data_node(
+                data_node, data_node._load_subtree(self.RELATED_FIELDS), [])
+        cache = caches['shared']
+        cache_key = data_node.get_contents_cache_key()
+        base_url = self._get_base_url()
+        cached = cache.get(cache_key) or {}
+        if base_url in cached:
+            return cached[base_url]
+        leaves = []
+        children = data_node._load_subtree(self.RELATED_FIELDS)
+        contents = self._render_data_node(data_node, children, leaves)
+        if data_node._is_complete(children) \
+           and all([leaf.is_ready() for leaf in leaves]):
+            cached[base_url] = contents
+            cache.set(cache_key, cached, self.CACHE_TIMEOUT_SECONDS)
+        return contents
+
+    def _get_base_url(self):
+        # Rendered contents include hyperlinks, which depend on the host
+        # of the request
+        request = self.context.get('request')
+        if request is None:
+            return ''
+        return request.build_absolute_uri('/')
+
+    def _render_data_node(self, data_node, children, leaves):
         if data_node._is_missing_branch():
             return self.MISSING_BRANCH_VALUE
         elif data_node._is_empty_branch():
             return self.EMPTY_BRANCH_VALUE
         if data_node._is_leaf():
+            leaves.append(data_node.data_object)
             s = DataObjectSerializer(data_node.data_object, context=self.context)
             return s.data
         else:
             contents = [self.MISSING_BRANCH_VALUE] * data_node.degree
-            for child in data_node.children.all():
-                contents[child.index] = self._data_tree_to_data_struct(child)
+            for child in children.get(data_node.id, []):
+                contents[child.index] = self._render_data_node(
+                    child, children, leaves)
             return contents
 
-    def _extend_all_paths_and_add_data_at_leaves(
-            self, data_node, contents, path, data_type):
-        # Recursive function that extends 'path' until reaching a leaf node,
-        # where data is finally added.
-        # 'path' is the partial path to some intermediate
-        # node, while 'contents' is the representation of all branches and 
-        # leaves beyond that path.
-        # For example, given path (0,2) and data [['10','20']['30','40']],
-        # the function places all data under (0,2) and ignores the other
-        # root-level branch (1,2).
-        # The function adds these four data objects at
-        # their corresponding paths:
-        # 10 at [(0,2), (0,2), (0,2)]
-        # 20 at [(0,2), (0,2), (1,2)]
-        # 30 at [(0,2), (1,2), (0,2)]
-        # 40 at [(0,2), (1,2), (1,2)]
-        if not isinstance(contents, list):
-            if isinstance(contents, dict):
-                s = DataObjectSerializer(data=contents, context=self.context)
-                s.is_valid(raise_exception=True)
-                data_object = s.save()
-            else:
-                try:
-                    data_object = DataObject.get_by_value(
-                        contents,
-                        data_type)
-                except NoFileMatchError as e:
-                    raise serializers.ValidationError(e.message)
-                except MultipleFileMatchesError as e:
-                    raise serializers.ValidationError(e.message)
-            data_node.add_data_object(path, data_object)
-            return
-        elif len(contents) == 0:
-            # An empty list represents a node of degree 0
-            data_node.degree = 0
-            data_node.save()
+    def _get_data_objects(self, contents, data_type):
+        # Returns a copy of 'contents' with each leaf replaced by its
+        # DataObject, e.g. [['10','20'],['30','40']] becomes a list of
+        # lists of 4 DataObjects. The tree itself is saved afterward
+        # in bulk. None marks a missing branch and is left in place.
+        if contents is None:
+            return None
+        elif isinstance(contents, list):
+            return [self._get_data_objects(item, data_type)
+                    for item in contents]
+        elif isinstance(contents, dict):
+            s = DataObjectSerializer(data=contents, context=self.context)
+            s.is_valid(raise_exception=True)
+            return s.save()
         else:
-            for i in range(len(contents)):
-                path_i = copy.deepcopy(path)
-                path_i.append((i, len(contents)))
-                self._extend_all_paths_and_add_data_at_leaves(
-                    data_node, contents[i], path_i, data_type)
+            try:
+                return DataObject.get_by_value(
+                    contents,
+                    data_type)
+            except NoFileMatchError as e:
+                raise serializers.ValidationError(e.message)
+            except MultipleFileMatchesError as e:
+                raise serializers.ValidationError(e.message)
 
 
 class ExpandableDataNodeSerializer(DataNodeSerializer):
@@ -84,10 +84,11 @@ class StepRunInputSerializer(InputOutputNodeSerializer):
 
     mode = serializers.CharField()
     group = serializers.IntegerField()
+    gather = serializers.JSONField(required=False)
 
     class Meta:
         model = StepRunInput
-        fields = ('type', 'channel', 'data', 'mode', 'group')
+        fields = ('type', 'channel', 'data', 'mode', 'group', 'gather')
 
 
 class StepRunOutputSerializer(InputOutputNodeSerializer):
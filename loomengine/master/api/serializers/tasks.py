@@ -78,6 +78,10 @@ class TaskAttemptLogFileSerializer(CreateWithParentModelSerializer):
 
 class TaskAttemptTimepointSerializer(CreateWithParentModelSerializer):
 
+    # Declared so that a TaskRunner can send the time it recorded the
+    # timepoint. The model field is not editable.
+    timestamp = serializers.DateTimeField(required=False)
+
     class Meta:
         model = TaskAttemptTimepoint
         fields = ('message', 'detail', 'timestamp', 'is_error')
@@ -98,6 +102,8 @@ class TaskAttemptSerializer(serializers.HyperlinkedModelSerializer):
         many=True, allow_null=True, required=False)
     resources = serializers.JSONField(required=False)
     environment = serializers.JSONField(required=False)
+    last_heartbeat = serializers.DateTimeField(
+        source='get_last_heartbeat', read_only=True)
     
     class Meta:
         model = TaskAttempt
@@ -127,6 +133,67 @@ class TaskAttemptSerializer(serializers.HyperlinkedModelSerializer):
         return instance
 
 
+class TaskAttemptEventSerializer(serializers.Serializer):
+    """One event in a batch sent by the TaskRunner. Events are applied in
+    order to the TaskAttempt given as context['parent_instance']:
+
+    timepoint: data is a TaskAttemptTimepoint
+    update: data is a partial TaskAttempt update, or {} for a heartbeat,
+      which is recorded without saving the TaskAttempt
+    output: data is a TaskAttemptOutput update, including its "id"
+    fail, finish: no data
+    """
+
+    EVENT_TYPES = ('timepoint', 'update', 'output', 'fail', 'finish')
+
+    type = serializers.ChoiceField(choices=EVENT_TYPES)
+    data = serializers.JSONField(required=False)
+
+    def create(self, validated_data):
+        # Reload for each event, since earlier events may have saved
+        # the TaskAttempt
+        task_attempt = TaskAttempt.objects.get(
+            uuid=self.context['parent_instance'].uuid)
+        event_type = validated_data.get('type')
+        data = validated_data.get('data') or {}
+        result = {}
+
+        if event_type == 'timepoint':
+            s = TaskAttemptTimepointSerializer(
+                data=data,
+                context={'parent_field': 'task_attempt',
+                         'parent_instance': task_attempt})
+            s.is_valid(raise_exception=True)
+            s.save()
+        elif event_type == 'update' and not data:
+            # Heartbeat from a TaskRunner that does not use the heartbeats
+            # endpoint
+            task_attempt.heartbeat()
+        elif event_type == 'update':
+            s = TaskAttemptSerializer(
+                task_attempt, data=data, partial=True, context=self.context)
+            s.is_valid(raise_exception=True)
+            s.save()
+        elif event_type == 'output':
+            output = task_attempt.outputs.filter(id=data.get('id')).first()
+            if output is None:
+                raise serializers.ValidationError(
+                    'TaskAttempt has no output with id "%s"' % data.get('id'))
+            s = TaskAttemptOutputSerializer(
+                output, data=data, partial=True, context=self.context)
+            s.is_valid(raise_exception=True)
+            s.save()
+            result = s.data
+        elif event_type == 'fail':
+            task_attempt.fail()
+        elif event_type == 'finish':
+            task_attempt.finish()
+        return result
+
+    def to_representation(self, instance):
+        return instance
+
+
 class ExpandableTaskAttemptSerializer(TaskAttemptSerializer):
     # This serializer is used for display only
     uuid = serializers.UUIDField(required=False)
@@ -180,6 +247,7 @@ class TaskSerializer(serializers.HyperlinkedModelSerializer):
         lookup_field='uuid')
     resources = serializers.JSONField(required=False)
     environment = serializers.JSONField(required=False)
+    data_path = serializers.JSONField(read_only=True)
     inputs = TaskInputSerializer(many=True, read_only=True)
     outputs = TaskOutputSerializer(many=True, read_only=True)
     task_attempts = ExpandableTaskAttemptSerializer(many=True, read_only=True)
@@ -195,6 +263,7 @@ class TaskSerializer(serializers.HyperlinkedModelSerializer):
     status_is_failed = serializers.BooleanField(read_only=True)
     status_is_killed = serializers.BooleanField(read_only=True)
     status_is_running = serializers.BooleanField(read_only=True)
+    status_is_waiting = serializers.BooleanField(read_only=True)
     attempt_number = serializers.IntegerField(read_only=True)
     timepoints = TaskTimepointSerializer(
         many=True, allow_null=True, required=False)
@@ -206,6 +275,7 @@ class TaskSerializer(serializers.HyperlinkedModelSerializer):
             'url',
             'resources',
             'environment',
+            'data_path',
             'inputs', 
             'outputs',
             'task_attempts',
@@ -221,6 +291,7 @@ class TaskSerializer(serializers.HyperlinkedModelSerializer):
             'status_is_failed',
             'status_is_killed',
             'status_is_running',
+            'status_is_waiting',
             'attempt_number',
             'timepoints',
         )
@@ -157,6 +157,34 @@ class StepSerializer(serializers.HyperlinkedModelSerializer):
 
         return step
 
+    def validate_inputs(self, inputs):
+        for input in inputs or []:
+            options = input.get('gather')
+            if options is None:
+                continue
+            if not isinstance(options, dict):
+                raise serializers.ValidationError(
+                    'gather options for input "%s" must be a dict'
+                    % input.get('channel'))
+            if 'min_count' in options or 'min_fraction' in options:
+                # A branch gathered early would not be gathered again,
+                # so leaves that arrive later would be lost
+                raise serializers.ValidationError(
+                    'gather options "min_count" and "min_fraction" are not '\
+                    'supported for input "%s". Use "batch_size" to gather '\
+                    'leaves as they arrive.' % input.get('channel'))
+            unknown = set(options.keys()).difference(['batch_size'])
+            if unknown:
+                raise serializers.ValidationError(
+                    'Unknown gather options for input "%s": %s'
+                    % (input.get('channel'), ', '.join(sorted(unknown))))
+            for (key, value) in options.items():
+                if not isinstance(value, (int, float)) or value <= 0:
+                    raise serializers.ValidationError(
+                        'Invalid value for gather option "%s" on input '\
+                        '"%s": %s' % (key, input.get('channel'), value))
+        return inputs
+
     def _set_input_defaults(self, input):
         input.setdefault('group', DEFAULT_INPUT_GROUP)
         input.setdefault('mode', DEFAULT_INPUT_MODE)
@@ -3,15 +3,16 @@ from celery import shared_task
 from celery.decorators import periodic_task
 import copy
 import datetime
+import hashlib
 from django import db
-from django.utils import timezone
+from django.core.cache import caches
+from django.db.models import F
 from api import get_setting
 import kombu.exceptions
 import os
-import subprocess
 import sys
-import threading
-import time
+
+from api.launch_supervisor import LaunchSupervisor
 
 def _run_with_delay(task_function, args, kwargs):
     if get_setting('TEST_DISABLE_TASK_DELAY'):
@@ -76,7 +77,17 @@ def postprocess_workflow_run(*args, **kwargs):
         return
     return _run_with_delay(_postprocess_workflow_run, args, kwargs)
 
-@periodic_task(run_every=datetime.timedelta(seconds=30))
+def _run_on_commit(task_function, args, kwargs):
+    # Queue the task only once the data that triggered it is committed,
+    # so the worker does not read stale data.
+    db.transaction.on_commit(
+        lambda: _run_with_delay(task_function, args, kwargs))
+
+# Tasks are normally created as soon as their inputs are ready, by
+# create_tasks_from_step_run and create_tasks_for_data_root. This sweep
+# is only a safety net for any signal that was missed.
+@periodic_task(run_every=datetime.timedelta(
+    seconds=int(get_setting('STEP_RUN_SWEEP_INTERVAL_SECONDS'))))
 def process_active_step_runs():
     from api.models.runs import StepRun
     if get_setting('TEST_NO_AUTOSTART_RUNS'):
@@ -89,11 +100,55 @@ def process_active_step_runs():
 @shared_task
 def _create_tasks_from_step_run(step_run_uuid):
     from api.models.runs import StepRun
-    step_run = StepRun.objects.get(uuid=step_run_uuid)
-    for task in step_run.create_ready_tasks():
-        args = [task.uuid]
-        kwargs = {}
-        _run_with_delay(_run_task, args, kwargs)
+    # Lock the StepRun so that concurrent triggers do not
+    # create the same tasks twice
+    with db.transaction.atomic():
+        step_run = StepRun.objects.select_for_update().get(uuid=step_run_uuid)
+        new_tasks = list(step_run.create_ready_tasks())
+    if new_tasks:
+        _queue_tasks([task.uuid for task in new_tasks])
+        schedule_tasks()
+    else:
+        # Complete inputs may have no data paths, e.g. an empty
+        # scattered array. No Task will finish the run in that case.
+        step_run.update_status()
+
+def create_tasks_from_step_run(*args, **kwargs):
+    if get_setting('TEST_NO_AUTOSTART_RUNS'):
+        return
+    return _run_on_commit(_create_tasks_from_step_run, args, kwargs)
+
+@shared_task
+def _create_tasks_for_data_root(data_root_id):
+    from api.models.runs import StepRun
+    for step_run in StepRun.objects.filter(
+            status_is_running=True,
+            inputs__data_root_id=data_root_id).distinct():
+        _create_tasks_from_step_run(step_run.uuid)
+
+def create_tasks_for_data_root(*args, **kwargs):
+    """Create ready tasks on any running StepRun with an input
+    that uses this data tree. Call when data is added to the tree.
+    """
+    if get_setting('TEST_NO_AUTOSTART_RUNS'):
+        return
+    return _run_on_commit(_create_tasks_for_data_root, args, kwargs)
+
+@shared_task
+def _create_tasks_for_file_resource(file_resource_id):
+    from api.models.runs import StepRun
+    for step_run in StepRun.objects.filter(
+            status_is_running=True,
+            inputs__data_root__descendants__data_object__filedataobject__file_resource_id=file_resource_id).distinct():
+        _create_tasks_from_step_run(step_run.uuid)
+
+def create_tasks_for_file_resource(*args, **kwargs):
+    """Create ready tasks on any running StepRun with an input file
+    that uses this FileResource. Call when its upload completes.
+    """
+    if get_setting('TEST_NO_AUTOSTART_RUNS'):
+        return
+    return _run_on_commit(_create_tasks_for_file_resource, args, kwargs)
 
 @periodic_task(run_every=datetime.timedelta(seconds=60))
 def process_active_tasks():
@@ -101,41 +156,159 @@ def process_active_tasks():
     if get_setting('TEST_NO_AUTOSTART_RUNS'):
         return
     for task in Task.objects.filter(status_is_running=True):
-        if not task.has_been_run():
-            args = [task.uuid]
-            kwargs = {}
-            _run_with_delay(_run_task, args, kwargs)
+        if task.status_is_waiting:
+            # The scheduler will start it when there is capacity
+            continue
+        elif not task.has_been_run():
+            run_task(task.uuid)
         elif task.is_unresponsive():
             task.restart()
         # Else task is running ok. Nothing to do.
         # State changes will be driven by the active TaskAttempt
+    schedule_tasks()
 
-@shared_task
-def _run_task(task_uuid):
-    # If task has been run before, old TaskAttempt will be rendered inactive
+def run_task(task_uuid):
+    """Queue a Task. A new TaskAttempt is started by the scheduler
+    once there is capacity for it.
+    If task has been run before, old TaskAttempt will be rendered inactive
+    """
+    _queue_tasks([task_uuid])
+    schedule_tasks()
+
+def _queue_tasks(task_uuids):
     from api.models.tasks import Task
-    task = Task.objects.get(uuid=task_uuid)
-    task_attempt = task.create_and_activate_attempt()
-    _run_with_heartbeats(task_attempt, _run_task_runner_playbook, args=[task_attempt])
+    # _change is incremented so that a stale copy of the Task cannot be
+    # saved over this
+    Task.objects.filter(uuid__in=task_uuids, status_is_running=True).update(
+        status_is_waiting=True, _change=F('_change')+1)
+
+@shared_task
+def _schedule_tasks():
+    from api.models.tasks import SchedulerLease
+    # Capacity is found before taking the lease, since asking Docker
+    # for it may be slow
+    try:
+        scheduler = _get_scheduler()
+    except Exception as e:
+        # e.g. Docker is not reachable. Tasks stay queued, and
+        # process_active_tasks will try again.
+        print 'Failed to get worker capacity: %s' % str(e)
+        return
+    # Only one scheduling pass runs at a time, on any host, so that two
+    # don't start the same waiting Tasks or claim the same free capacity.
+    if not SchedulerLease.acquire():
+        # The pass that holds the lease will run again for us
+        return
+    task_attempts = []
+    try:
+        task_attempts.extend(_select_and_start_tasks(scheduler))
+        while not SchedulerLease.release():
+            task_attempts.extend(_select_and_start_tasks(scheduler))
+    except:
+        # Queued Tasks are picked up again by process_active_tasks
+        SchedulerLease.abandon()
+        raise
+    # Launched after the lease is released, since a launch that fails
+    # starts another scheduling pass
+    for task_attempt in task_attempts:
+        _run_on_commit(_launch_task_attempt, [task_attempt.uuid], {})
+
+def _select_and_start_tasks(scheduler):
+    from api.models.tasks import Task, TaskAttempt
+    root_run_ids = {}
+    running = [
+        (_get_root_run_id(task_attempt.task.step_run, root_run_ids),
+         task_attempt.task.resources)
+        for task_attempt in TaskAttempt.objects.filter(
+                status_is_running=True,
+                task_as_selected__isnull=False).select_related(
+                    'task__step_run')]
+    waiting = [
+        (_get_root_run_id(task.step_run, root_run_ids),
+         task.resources, task)
+        for task in Task.objects.filter(
+                status_is_waiting=True,
+                status_is_running=True).select_related(
+                    'step_run').order_by('datetime_created', 'id')]
+    task_attempts = []
+    for task in scheduler.select(running, waiting):
+        if not Task.objects.filter(
+                id=task.id, status_is_waiting=True).update(
+                    status_is_waiting=False, _change=F('_change')+1):
+            # Killed or started since it was read
+            continue
+        task = Task.objects.get(id=task.id)
+        # Counts as running from now on, even before it is launched
+        task_attempts.append(task.create_and_activate_attempt())
+    return task_attempts
 
-def run_task(*args, **kwargs):
-    return _run_with_delay(_run_task, args, kwargs)
+def schedule_tasks():
+    """Start as many queued Tasks as there is capacity for.
+    Call when a Task is queued or a TaskAttempt stops running.
+    """
+    if get_setting('TEST_NO_AUTOSTART_RUNS'):
+        return
+    return _run_on_commit(_schedule_tasks, [], {})
 
-def _run_with_heartbeats(task_attempt, function, args=None, kwargs=None):
-        heartbeat_interval = int(get_setting('TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS'))
-        polling_interval = 1
+def _get_scheduler():
+    from api.scheduler import TaskScheduler
+    max_cores = get_setting('SCHEDULER_MAX_CORES', required=False)
+    max_memory_gb = get_setting('SCHEDULER_MAX_MEMORY_GB', required=False)
+    if _uses_local_worker_pool() and not (max_cores and max_memory_gb):
+        from api.local_worker_pool import LocalWorkerPool
+        (pool_cores, pool_memory_gb) = LocalWorkerPool().get_capacity()
+        max_cores = max_cores or pool_cores
+        max_memory_gb = max_memory_gb or pool_memory_gb
+    return TaskScheduler(
+        max_cores=max_cores,
+        max_memory_gb=max_memory_gb,
+        max_disk_gb=get_setting('SCHEDULER_MAX_DISK_GB', required=False),
+        max_tasks=get_setting('SCHEDULER_MAX_TASKS', required=False),
+        max_tasks_per_run=get_setting('SCHEDULER_MAX_TASKS_PER_RUN',
+                                      required=False))
 
-	t = threading.Thread(target=function, args=args, kwargs=kwargs)
-        t.start()
+def _get_root_run_id(step_run, root_run_ids):
+    # Tasks are shared out between the runs that were requested, so
+    # a StepRun is counted under its topmost WorkflowRun. Cached by
+    # parent, since sibling StepRuns have the same one.
+    if step_run is None or step_run.parent_id is None:
+        return getattr(step_run, 'id', None)
+    if step_run.parent_id not in root_run_ids:
+        run = step_run.parent
+        while run.parent_id is not None:
+            run = run.parent
+        root_run_ids[step_run.parent_id] = run.id
+    return root_run_ids[step_run.parent_id]
 
-        task_attempt.heartbeat()
-        last_heartbeat = timezone.now()
+@shared_task
+def _launch_task_attempt(task_attempt_uuid):
+    from api.models.tasks import TaskAttempt
+    task_attempt = TaskAttempt.objects.get(uuid=task_attempt_uuid)
+    if _uses_local_worker_pool():
+        return _launch_in_local_worker_pool(task_attempt)
+    try:
+        _run_task_runner_playbook(task_attempt)
+    except Exception as e:
+        # No heartbeats are sent, so the TaskAttempt will be restarted
+        # once it is found to be unresponsive
+        print 'Failed to launch TaskAttempt %s: %s' \
+            % (task_attempt_uuid, str(e))
 
-	while t.is_alive():
-            time.sleep(polling_interval)
-            if (timezone.now() - last_heartbeat).total_seconds() > heartbeat_interval:
-                task_attempt.heartbeat()
-                last_heartbeat = timezone.now()
+def _uses_local_worker_pool():
+    return get_setting('WORKER_TYPE') == 'LOCAL' \
+        and not get_setting('LOCAL_WORKER_USE_PLAYBOOK')
+
+def _launch_in_local_worker_pool(task_attempt):
+    from api.local_worker_pool import LocalWorkerPool
+    try:
+        LocalWorkerPool().start(task_attempt)
+    except Exception as e:
+        task_attempt.add_timepoint(
+            "Failed to launch worker process for TaskAttempt %s" \
+            % task_attempt.uuid,
+            detail=str(e),
+            is_error=True)
+        task_attempt.fail()
 
 def _run_task_runner_playbook(task_attempt):
     env = copy.copy(os.environ)
@@ -168,24 +341,68 @@ def _run_task_runner_playbook(task_attempt):
                 }
     env.update(new_vars)
 
-    p = subprocess.Popen(cmd_list, env=env,
-                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    terminal_output = ''
-    for line in iter(p.stdout.readline, ''):
-        terminal_output += line
-        print line.strip()
-    p.wait()
-    if p.returncode != 0:
-        task_attempt.add_timepoint(
-            "Failed to launch worker process for TaskAttempt %s" \
-            % task_attempt.uuid,
-            detail=terminal_output,
-            is_error=True)
-        task_attempt.fail()
+    # Returns without waiting. The supervisor sends heartbeats while the
+    # playbook runs and fails the TaskAttempt if it exits with an error.
+    LaunchSupervisor.get().launch(
+        cmd_list, env, task_attempt_uuid=task_attempt.uuid)
+
+# Images are pre-warmed at most once in this interval, by any server
+# process. The cache is shared, so gunicorn and celery processes see
+# each other's requests.
+PREWARM_IMAGE_INTERVAL_SECONDS = 300
+
+@shared_task
+def _prewarm_image(docker_image):
+    _run_prewarm_image_playbook(docker_image)
+
+def prewarm_image(docker_image):
+    """Start pulling an image on the worker host before any task needs it.
+    Only used if LOOM_PREWARM_IMAGE_PLAYBOOK is set, e.g. on a local
+    deployment where task runners share one host.
+    """
+    if get_setting('TEST_NO_AUTOSTART_RUNS') \
+       or not get_setting('LOOM_PREWARM_IMAGE_PLAYBOOK', required=False) \
+       or not docker_image:
+        return
+    if not caches['shared'].add(_get_prewarm_cache_key(docker_image), True,
+                                PREWARM_IMAGE_INTERVAL_SECONDS):
+        # Recently requested
+        return
+    return _run_on_commit(_prewarm_image, [docker_image], {})
+
+def _get_prewarm_cache_key(docker_image):
+    return 'prewarm-image-%s' % hashlib.sha1(docker_image).hexdigest()
+
+def _run_prewarm_image_playbook(docker_image):
+    env = copy.copy(os.environ)
+    playbook = os.path.join(
+        get_setting('PLAYBOOK_PATH'),
+        get_setting('LOOM_PREWARM_IMAGE_PLAYBOOK'))
+    cmd_list = ['ansible-playbook',
+                '-i', get_setting('ANSIBLE_INVENTORY'),
+                playbook,
+                # Without this, ansible uses /usr/bin/python,
+                # which may be missing needed modules
+                '-e', 'ansible_python_interpreter="/usr/bin/env python"',
+    ]
+
+    if get_setting('DEBUG'):
+        cmd_list.append('-vvvv')
+
+    new_vars = {'LOOM_PREWARM_IMAGE': docker_image,
+                'LOOM_PREWARM_ID': hashlib.sha1(docker_image).hexdigest()[:12],
+                }
+    env.update(new_vars)
+
+    return LaunchSupervisor.get().launch(cmd_list, env)
 
 @shared_task
 def _cleanup_task_attempt(task_attempt_uuid):
     from api.models.tasks import TaskAttempt
+    if _uses_local_worker_pool():
+        from api.local_worker_pool import LocalWorkerPool
+        LocalWorkerPool().remove(task_attempt_uuid)
+        return
     task_attempt = TaskAttempt.objects.get(uuid=task_attempt_uuid)
     _run_cleanup_task_playbook(task_attempt)
 
@@ -214,4 +431,4 @@ def _run_cleanup_task_playbook(task_attempt):
                 }
     env.update(new_vars)
 
-    return subprocess.Popen(cmd_list, env=env, stderr=subprocess.STDOUT)
+    return LaunchSupervisor.get().launch(cmd_list, env)
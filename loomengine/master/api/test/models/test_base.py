@@ -1,4 +1,5 @@
 from django.test import TestCase
+from api.models.base import FilterHelper, LRUCache
 from api.models.data_objects import *
 from api import exceptions
 
@@ -26,3 +27,47 @@ class TestBase(TestCase):
         file1.save()
         with self.assertRaises(exceptions.ConcurrentModificationError):
             file2.save()
+
+
+class TestFilterHelper(TestCase):
+
+    def setUp(self):
+        self.file_data_object = FileDataObject.objects.create(
+            type='file',
+            filename='myfile.dat',
+            source_type='imported',
+            md5='d8e8fca2dc0f896fd7cb4cb0031ba249'
+        )
+
+    def testFilterByPrefix(self):
+        uuid = self.file_data_object.uuid
+        for query in ['myfile.dat',
+                      'myfile.dat@%s' % uuid[:5].upper(),
+                      '@%s' % uuid,
+                      '$d8e8',
+                      'myfile.dat$%s@%s' % (self.file_data_object.md5, uuid)]:
+            matches = FileDataObject.filter_by_name_or_id_or_hash(query)
+            self.assertEqual(matches.count(), 1, query)
+        for query in ['otherfile.dat', '$d8e9', '@%s' % uuid[:-1]+'_']:
+            matches = FileDataObject.filter_by_name_or_id_or_hash(query)
+            self.assertEqual(matches.count(), 0, query)
+
+    def testIsUniqueIdentifier(self):
+        helper = FilterHelper(FileDataObject)
+        self.assertTrue(helper.is_unique_identifier(
+            'myfile.dat@%s' % self.file_data_object.uuid))
+        self.assertFalse(helper.is_unique_identifier(
+            'myfile.dat@%s' % self.file_data_object.uuid[:8]))
+
+
+class TestLRUCache(TestCase):
+
+    def testEvictsLeastRecentlyUsed(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
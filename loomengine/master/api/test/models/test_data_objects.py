@@ -1,6 +1,7 @@
 import os
 from django.test import TestCase
 from api.models.data_objects import *
+from api.exceptions import ConcurrentModificationError
 
 
 class TestFileDataObject(TestCase):
@@ -155,6 +156,48 @@ class TestFileDataObject(TestCase):
         self.assertEqual(self.file.file_resource.uuid,
                          self.file_copy.file_resource.uuid)
 
+    def testFinalizeSetsBlankMd5(self):
+        file = FileDataObject.objects.create(
+            type='file',
+            filename=self.filename,
+            source_type='imported')
+        with self.settings(
+                KEEP_DUPLICATE_FILES=True):
+            file.initialize()
+        file.file_resource.finalize('abcde')
+
+        file = FileDataObject.objects.get(uuid=file.uuid)
+        self.assertEqual(file.md5, 'abcde')
+        self.assertEqual(file.file_resource.md5, 'abcde')
+        self.assertTrue(file.is_ready())
+
+    def testFinalizeMD5MismatchError(self):
+        with self.settings(
+                KEEP_DUPLICATE_FILES=True):
+            self.file.initialize()
+        with self.assertRaises(MD5MismatchError):
+            self.file.file_resource.finalize('fghij')
+
+    def testFilterByMd5List(self):
+        matches = FileDataObject.filter_by_md5_list(['abcde', 'xyz', ''])
+        self.assertEqual(
+            set([file.uuid for file in matches]),
+            set([self.file.uuid, self.file_copy.uuid]))
+
+    def testSetUploadStatusInBulk(self):
+        self.file.initialize()
+        self.file2.initialize()
+        resource = FileResource.objects.get(uuid=self.file.file_resource.uuid)
+        count = FileResource.set_upload_status_in_bulk(
+            [self.file.file_resource.uuid, self.file2.file_resource.uuid],
+            'complete')
+        self.assertEqual(count, 2)
+        self.assertTrue(
+            FileDataObject.objects.get(uuid=self.file2.uuid).is_ready())
+        # A copy loaded before the update is now stale
+        with self.assertRaises(ConcurrentModificationError):
+            resource.save()
+
     def testAddUrlPrefixLocal(self):
         path = '/my/path'
         with self.settings(
@@ -171,6 +214,15 @@ class TestFileDataObject(TestCase):
             url = FileResource._add_url_prefix(path)
         self.assertEqual(url, 'gs://'+bucket_id+path)
 
+    def testAddUrlPrefixS3(self):
+        path = '/my/path'
+        bucket_id = 'mybucket'
+        with self.settings(
+                LOOM_STORAGE_TYPE='S3',
+                S3_BUCKET=bucket_id):
+            url = FileResource._add_url_prefix(path)
+        self.assertEqual(url, 's3://'+bucket_id+path)
+
     def testAddUrlPrefixRelativePathError(self):
         path = 'relative/path'
         with self.settings(
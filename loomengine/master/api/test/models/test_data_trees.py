@@ -133,3 +133,89 @@ class TestDataNode(TestCase):
         root = DataNode.objects.create()
         with self.assertRaises(UnknownDegreeError):
             root.add_leaf(0, data_object)
+
+    def testGetReadyLeaves(self):
+        root = DataNode.objects.create()
+        root.add_data_object([(0,2),(1,2)], _get_string_data_object('b'))
+        root.add_data_object([(1,2),(0,1)], _get_string_data_object('c'))
+        leaves = root.get_ready_leaves()
+        self.assertEqual(
+            [(path, data_object.substitution_value)
+             for (path, data_object) in leaves],
+            [([(0,2),(1,2)], 'b'), ([(1,2),(0,1)], 'c')])
+        self.assertFalse(root.is_complete())
+
+    def testGetReadyBranches(self):
+        root = DataNode.objects.create()
+        root.add_data_object([(0,2),(1,2)], _get_string_data_object('b'))
+        root.add_data_object([(1,2),(0,1)], _get_string_data_object('c'))
+        branches = root.get_ready_branches()
+        # Branch 0 is still missing a leaf
+        self.assertEqual(len(branches), 1)
+        self.assertEqual(branches[0][0], [(1,2)])
+        root.add_data_object([(0,2),(0,2)], _get_string_data_object('a'))
+        branches = root.get_ready_branches()
+        self.assertEqual(
+            [[data_object.substitution_value for data_object in data]
+             for (path, data) in branches],
+            [['a', 'b'], ['c']])
+        self.assertTrue(root.is_complete())
+
+    def testIsReady(self):
+        root = DataNode.objects.create()
+        file = FileDataObject.objects.create(
+            type='file', filename='a.txt', md5='abcde',
+            source_type='imported')
+        file.initialize()
+        root.add_data_object([(0,2)], _get_string_data_object('a'))
+        root.add_data_object([(1,2)], file)
+        # The file has not been uploaded
+        self.assertTrue(root.is_complete())
+        self.assertFalse(root.is_ready())
+        file.file_resource.upload_status = 'complete'
+        file.file_resource.save()
+        self.assertTrue(root.is_ready())
+
+    def testGetReadyBatches(self):
+        root = DataNode.objects.create()
+        for index in [0, 1, 4]:
+            root.add_data_object([(index,5)], _get_string_data_object(
+                str(index)))
+        batches = root.get_ready_batches(2)
+        self.assertEqual(
+            [(path, [data_object.substitution_value for data_object in data])
+             for (path, data) in batches],
+            [([(0,3)], ['0', '1']), ([(2,3)], ['4'])])
+
+    def testGetReadyBatchesAfterLateLeaf(self):
+        root = DataNode.objects.create()
+        for index in [0, 1, 2]:
+            root.add_data_object([(index,4)], _get_string_data_object(
+                str(index)))
+        self.assertEqual([path for (path, data)
+                          in root.get_ready_batches(2)], [[(0,2)]])
+        # A leaf that arrives after the first batch was gathered
+        # completes the next batch
+        root.add_data_object([(3,4)], _get_string_data_object('3'))
+        batches = root.get_ready_batches(2)
+        self.assertEqual(
+            [(path, [data_object.substitution_value for data_object in data])
+             for (path, data) in batches],
+            [([(0,2)], ['0', '1']), ([(1,2)], ['2', '3'])])
+
+    def testAddDataObjectsInBulk(self):
+        letters = [[_get_string_data_object(letter) for letter in word]
+                   for word in ['i', 'am', 'robot']]
+        letters.append(None)
+        root = DataNode.objects.create()
+        root.root_node = root
+        root.save()
+        # Saving the root, one insert per level, one id lookup
+        # per level of branches, and clearing the shared cache
+        with self.assertNumQueries(6):
+            root.add_data_objects_in_bulk(letters)
+        self.assertEqual(root.get_data_object([1,1]).substitution_value, 'm')
+        self.assertEqual(root.get_data_object([2,4]).substitution_value, 't')
+        with self.assertRaises(MissingBranchError):
+            root.get_data_object([3,])
+        self.assertEqual(root.descendants.count(), 12)
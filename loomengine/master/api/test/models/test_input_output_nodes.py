@@ -2,7 +2,7 @@ from django.test import TestCase
 
 from api.models.data_objects import *
 from api.models.input_output_nodes import *
-from api.models.data_trees import MissingBranchError
+from api.models.data_trees import DataNode, MissingBranchError
 from api.models.runs import StepRunOutput
 
 
@@ -53,3 +53,57 @@ class TestInputOutputNode(TestCase):
 
         with self.assertRaises(ConnectError):
             io_node1.connect(io_node2)
+
+
+class MockInputNode(object):
+
+    def __init__(self, channel, group, data_root):
+        self.channel = channel
+        self.group = group
+        self.type = 'string'
+        self.data_root = data_root
+
+    def get_ready_data(self):
+        return self.data_root.get_ready_leaves()
+
+
+class TestInputNodeSet(TestCase):
+
+    def _get_node(self, channel, group, data):
+        root = DataNode.objects.create()
+        if isinstance(data, list):
+            for i, text in enumerate(data):
+                if text is not None:
+                    root.add_data_object(
+                        [(i, len(data))], _get_string_data_object(text))
+        else:
+            root.add_data_object([], _get_string_data_object(data))
+        return MockInputNode(channel, group, root)
+
+    def _get_values(self, input_sets):
+        return [(input_set.data_path,
+                 [item.data.substitution_value for item in input_set])
+                for input_set in input_sets]
+
+    def testDotProductWithScalar(self):
+        input_nodes = [self._get_node('a', 0, ['a0', None, 'a2']),
+                       self._get_node('b', 0, ['b0', 'b1', 'b2']),
+                       self._get_node('c', 0, 'c')]
+        input_sets = InputNodeSet(input_nodes).get_ready_input_sets()
+        self.assertEqual(self._get_values(input_sets),
+                         [([(0,3)], ['a0', 'b0', 'c']),
+                          ([(2,3)], ['a2', 'b2', 'c'])])
+
+    def testCrossProduct(self):
+        input_nodes = [self._get_node('a', 0, ['a0', 'a1']),
+                       self._get_node('b', 1, ['b0', 'b1'])]
+        input_sets = InputNodeSet(input_nodes).get_ready_input_sets()
+        self.assertEqual(len(input_sets), 4)
+        self.assertEqual(self._get_values(input_sets)[1],
+                         ([(0,2),(1,2)], ['a0', 'b1']))
+
+    def testNotReady(self):
+        input_nodes = [self._get_node('a', 0, ['a0', 'a1']),
+                       MockInputNode('b', 1, DataNode.objects.create())]
+        self.assertEqual(
+            InputNodeSet(input_nodes).get_ready_input_sets(), [])
@@ -4,7 +4,7 @@ from api import tasks
 from api.models import *
 from .test_templates import get_workflow
 
-@override_settings(TEST_DISABLE_TASK_DELAY=True)
+@override_settings(TEST_DISABLE_TASK_DELAY=True, TEST_NO_AUTOSTART_RUNS=True)
 class TestRunRequest(TransactionTestCase):
 
     def _get_run_request(self):
@@ -1,6 +1,7 @@
 from django.test import TestCase
 from api.models.data_objects import *
 from api.models.runs import *
+from api.models.templates import Workflow
 from api.test.models.test_templates import get_workflow
 
 def get_workflow_run():
@@ -19,3 +20,52 @@ class TestWorkflowRun(TestCase):
             .is_connected(
                 workflow_run.inputs.get(channel='one')))
         
+
+    def testFinishWhenAllStepsFinish(self):
+        with self.settings(TEST_DISABLE_TASK_DELAY=True):
+            workflow_run = get_workflow_run()
+        workflow_run = WorkflowRun.objects.get(id=workflow_run.id)
+        steps = list(workflow_run.steps.all())
+        self.assertEqual(workflow_run.status_steps_total, len(steps))
+        for step in steps:
+            self.assertTrue(WorkflowRun.objects.get(
+                id=workflow_run.id).status_is_running)
+            workflow_run.child_finished(step)
+        workflow_run = WorkflowRun.objects.get(id=workflow_run.id)
+        self.assertEqual(workflow_run.status_steps_finished, len(steps))
+        self.assertTrue(workflow_run.status_is_finished)
+        self.assertFalse(workflow_run.status_is_running)
+
+    def testFinishWithNoSteps(self):
+        workflow = Workflow.objects.create(
+            type='workflow',
+            name='empty',
+            inputs=[],
+            outputs=[],
+            postprocessing_status='complete')
+        with self.settings(TEST_DISABLE_TASK_DELAY=True):
+            workflow_run = Run.create_from_template(workflow)
+        workflow_run = WorkflowRun.objects.get(id=workflow_run.id)
+        self.assertEqual(workflow_run.status_steps_total, 0)
+        self.assertTrue(workflow_run.status_is_finished)
+        self.assertFalse(workflow_run.status_is_running)
+
+    def testSaveKeepsCounters(self):
+        with self.settings(TEST_DISABLE_TASK_DELAY=True):
+            workflow_run = get_workflow_run()
+        stale_copy = WorkflowRun.objects.get(id=workflow_run.id)
+        workflow_run.child_finished(workflow_run.steps.first())
+        stale_copy.save()
+        self.assertEqual(WorkflowRun.objects.get(
+            id=workflow_run.id).status_steps_finished, 1)
+
+
+class TestStepRun(TestCase):
+
+    def testUnfinishedTasks(self):
+        with self.settings(TEST_DISABLE_TASK_DELAY=True):
+            workflow_run = get_workflow_run()
+        step_run = workflow_run.steps.first().downcast()
+        StepRun.objects.filter(id=step_run.id).update(
+            status_tasks_created=2, status_tasks_finished=1)
+        self.assertFalse(step_run.are_all_tasks_finished())
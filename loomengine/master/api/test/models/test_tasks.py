@@ -1,4 +1,6 @@
-from django.test import TestCase
+import datetime
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from api.models.data_objects import *
 from api.models.tasks import *
 
@@ -63,3 +65,55 @@ class TestTaskAttempt(TestCase):
                          self.task.outputs.first().source.get('stream'))
         self.assertEqual(self.task_attempt.outputs.first().source.get('filename'),
                          'mydata.txt')
+
+    def testHeartbeat(self):
+        last_saved = self.task_attempt.last_heartbeat
+        self.task_attempt.heartbeat()
+        self.assertGreater(self.task_attempt.get_last_heartbeat(), last_saved)
+        # Recorded without saving the TaskAttempt
+        self.assertEqual(
+            TaskAttempt.objects.get(id=self.task_attempt.id).last_heartbeat,
+            last_saved)
+
+    def testRecordHeartbeatsInBulk(self):
+        other_attempt = self.task.create_and_activate_attempt()
+        TaskAttempt.record_heartbeats_in_bulk(
+            [self.task_attempt.uuid, other_attempt.uuid])
+        self.assertGreater(self.task_attempt.get_last_heartbeat(),
+                           self.task_attempt.last_heartbeat)
+        self.assertGreater(other_attempt.get_last_heartbeat(),
+                           other_attempt.last_heartbeat)
+
+    @override_settings(TASKRUNNER_HEARTBEAT_TIMEOUT_SECONDS='300')
+    def testIsUnresponsive(self):
+        self.assertFalse(self.task.is_unresponsive())
+        TaskAttempt.objects.filter(id=self.task_attempt.id).update(
+            last_heartbeat=timezone.now() - datetime.timedelta(seconds=600))
+        task = Task.objects.get(id=self.task.id)
+        self.assertTrue(task.is_unresponsive())
+        task.selected_task_attempt.heartbeat()
+        self.assertFalse(task.is_unresponsive())
+
+
+class TestSchedulerLease(TestCase):
+
+    def testOnlyOneHolder(self):
+        self.assertTrue(SchedulerLease.acquire())
+        self.assertFalse(SchedulerLease.acquire())
+        # The holder is asked to make another pass before letting go
+        self.assertFalse(SchedulerLease.release())
+        self.assertTrue(SchedulerLease.release())
+        self.assertTrue(SchedulerLease.acquire())
+
+    def testExpiredLeaseIsTaken(self):
+        self.assertTrue(SchedulerLease.acquire())
+        SchedulerLease.objects.update(
+            expires=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertTrue(SchedulerLease.acquire())
+
+    def testAbandon(self):
+        self.assertTrue(SchedulerLease.acquire())
+        self.assertFalse(SchedulerLease.acquire())
+        SchedulerLease.abandon()
+        self.assertTrue(SchedulerLease.acquire())
+        self.assertTrue(SchedulerLease.release())
@@ -67,7 +67,7 @@ class AbstractRunTest(object):
         return run_request
 
 
-@override_settings(TEST_DISABLE_TASK_DELAY=True)
+@override_settings(TEST_DISABLE_TASK_DELAY=True, TEST_NO_AUTOSTART_RUNS=True)
 class TestHelloWorld(TransactionTestCase, AbstractRunTest):
 
     def setUp(self):
@@ -99,7 +99,7 @@ class TestHelloWorld(TransactionTestCase, AbstractRunTest):
         #    self.run_request.outputs.first()\
         #    .indexed_data_objects.first().data_object)
 
-@override_settings(TEST_DISABLE_TASK_DELAY=True)
+@override_settings(TEST_DISABLE_TASK_DELAY=True, TEST_NO_AUTOSTART_RUNS=True)
 class TestManySteps(TransactionTestCase, AbstractRunTest):
 
     def setUp(self):
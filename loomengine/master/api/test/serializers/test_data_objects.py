@@ -3,6 +3,7 @@ from django.db import IntegrityError
 from django.test import TestCase
 from rest_framework import serializers
 
+from api.serializers.base import project_fields
 from api.serializers.data_objects import *
 from . import fixtures
 from . import get_mock_context
@@ -156,6 +157,16 @@ class TestDataObjectSerializer(TestCase):
             d['md5'],
             fixtures.data_objects.file_data_object['md5'])
 
+    def testProjectFields(self):
+        s1 = FileDataObjectSerializer(
+            data=fixtures.data_objects.file_data_object)
+        s1.is_valid(raise_exception=True)
+        m = s1.save()
+
+        s2 = DataObjectSerializer([m], many=True, context=get_mock_context())
+        project_fields(s2, set(['uuid', 'md5']))
+        self.assertEqual(set(s2.data[0].keys()), set(['uuid', 'md5']))
+
     def testGetDataFromData(self):
         s = FileDataObjectSerializer(data=fixtures.data_objects.file_data_object,
                                      context=get_mock_context())
@@ -1,3 +1,4 @@
+from django.core.cache import caches
 from django.test import TestCase
 from rest_framework import serializers
 
@@ -198,3 +199,29 @@ class TestDataNodeSerializer(TestCase):
         s.is_valid(raise_exception=True)
         s.save()
         self.assertEqual(s.data['contents']['value'], raw_data)
+
+    def testRenderIncompleteTreeNotCached(self):
+        m = DataNode.objects.create()
+        m.root_node = m
+        m.save()
+        m.add_data_object([(0,2),(0,1)], StringDataObject.objects.create(
+            type='string', value='a'))
+        data = DataNodeSerializer(m, context=get_mock_context()).data
+        self.assertEqual(data['contents'][0][0]['value'], 'a')
+        self.assertIsNone(data['contents'][1])
+        self.assertIsNone(caches['shared'].get(m.get_contents_cache_key()))
+        m.add_data_object([(1,2),(0,1)], StringDataObject.objects.create(
+            type='string', value='b'))
+        data = DataNodeSerializer(m, context=get_mock_context()).data
+        self.assertEqual(data['contents'][1][0]['value'], 'b')
+
+    def testRenderCompleteTreeCached(self):
+        m = DataNode.objects.create()
+        m.root_node = m
+        m.save()
+        m.add_data_object([(0,1),(0,1)], StringDataObject.objects.create(
+            type='string', value='a'))
+        DataNodeSerializer(m, context=get_mock_context()).data
+        self.assertIsNotNone(caches['shared'].get(m.get_contents_cache_key()))
+        m.invalidate_cached_contents()
+        self.assertIsNone(caches['shared'].get(m.get_contents_cache_key()))
@@ -84,5 +84,74 @@ class TestExpandableTaskSerializer(TestCase):
         self.assertEqual(task_data['uuid'],
                          task.uuid)
 
-    
-    
+
+class TestTaskAttemptEventSerializer(TestCase):
+
+    def _apply(self, task_attempt, events):
+        context = get_mock_context()
+        context['parent_instance'] = task_attempt
+        s = TaskAttemptEventSerializer(data=events, many=True, context=context)
+        s.is_valid(raise_exception=True)
+        return s.save()
+
+    def testTimepoints(self):
+        task_attempt = get_task().task_attempts.first()
+        self._apply(task_attempt, [
+            {'type': 'timepoint', 'data': {'message': 'first'}},
+            {'type': 'update', 'data': {}},
+            {'type': 'timepoint', 'data': {'message': 'second'}},
+        ])
+        messages = [timepoint.message for timepoint
+                    in task_attempt.timepoints.order_by('id')]
+        self.assertEqual(messages, ['oops', 'first', 'second'])
+
+    def testTimepointKeepsTimestamp(self):
+        task_attempt = get_task().task_attempts.first()
+        self._apply(task_attempt, [
+            {'type': 'timepoint',
+             'data': {'message': 'buffered',
+                      'timestamp': '2017-01-02T03:04:05Z'}},
+        ])
+        timepoint = task_attempt.timepoints.get(message='buffered')
+        self.assertEqual(timepoint.timestamp.isoformat(),
+                         '2017-01-02T03:04:05+00:00')
+        data = TaskAttemptTimepointSerializer(timepoint).data
+        self.assertEqual(data['timestamp'], '2017-01-02T03:04:05Z')
+
+    def testOutput(self):
+        task_attempt = get_task().task_attempts.first()
+        output = TaskAttemptOutput.objects.create(
+            task_attempt=task_attempt,
+            channel='output2',
+            type='string')
+        results = self._apply(task_attempt, [
+            {'type': 'output',
+             'data': {'id': output.id,
+                      'data_object': {'type': 'string', 'value': 'hello'}}},
+        ])
+        output = TaskAttemptOutput.objects.get(id=output.id)
+        self.assertEqual(output.data_object.substitution_value, 'hello')
+        self.assertEqual(results[0]['id'], output.id)
+
+    def testUnknownOutput(self):
+        task_attempt = get_task().task_attempts.first()
+        with self.assertRaises(serializers.ValidationError):
+            self._apply(task_attempt, [
+                {'type': 'output',
+                 'data': {'id': 0,
+                          'data_object': {'type': 'string',
+                                          'value': 'hello'}}},
+            ])
+
+    def testFail(self):
+        task_attempt = get_task().task_attempts.first()
+        self._apply(task_attempt, [{'type': 'fail'}])
+        task_attempt = TaskAttempt.objects.get(uuid=task_attempt.uuid)
+        self.assertTrue(task_attempt.status_is_failed)
+
+    def testInvalidType(self):
+        task_attempt = get_task().task_attempts.first()
+        s = TaskAttemptEventSerializer(
+            data=[{'type': 'explode'}], many=True,
+            context={'parent_instance': task_attempt})
+        self.assertFalse(s.is_valid())
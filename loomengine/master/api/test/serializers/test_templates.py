@@ -1,4 +1,5 @@
 from rest_framework.test import RequestsClient
+import copy
 import datetime
 from django.test import TestCase, TransactionTestCase, override_settings
 import loomengine.utils.helper
@@ -70,6 +71,23 @@ class TestStepSerializer(TransactionTestCase):
 
         self.assertEqual(m.command, s.data['command'])
 
+    def testValidateGatherOptions(self):
+        step_data = copy.deepcopy(fixtures.templates.step_a)
+        step_data['inputs'][0].update({'mode': 'gather',
+                                       'gather': {'batch_size': 0}})
+        s = StepSerializer(data=step_data)
+        self.assertFalse(s.is_valid())
+        # Leaves that arrive after an early gather would be lost
+        step_data['inputs'][0]['gather'] = {'min_count': 2}
+        s = StepSerializer(data=step_data)
+        self.assertFalse(s.is_valid())
+        step_data['inputs'][0]['gather'] = {'min_fraction': 0.5}
+        s = StepSerializer(data=step_data)
+        self.assertFalse(s.is_valid())
+        step_data['inputs'][0]['gather'] = {'batch_size': 10}
+        s = StepSerializer(data=step_data)
+        self.assertTrue(s.is_valid())
+
 
 @override_settings(TEST_DISABLE_TASK_DELAY=True)
 class TestWorkflowSerializer(TransactionTestCase):
@@ -0,0 +1,45 @@
+import os
+
+from django.test import TestCase
+
+from api.launch_supervisor import LaunchSupervisor
+from api.models.tasks import TaskAttempt
+from api.test.models.test_tasks import get_task
+
+
+class TestLaunchSupervisor(TestCase):
+
+    def setUp(self):
+        # Not started, so that the test can run the loop itself
+        self.supervisor = LaunchSupervisor()
+        self.task_attempt = get_task().create_and_activate_attempt()
+
+    def _run_until_done(self):
+        while self.supervisor.children:
+            for fd in self.supervisor._wait_for_output(
+                    self.supervisor.children.keys(), 10):
+                self.supervisor._read_output(fd)
+
+    def testLaunch(self):
+        self.supervisor.launch(
+            ['sh', '-c', 'echo ok'], dict(os.environ),
+            task_attempt_uuid=self.task_attempt.uuid)
+        self.assertEqual(len(self.supervisor.children), 1)
+        self.supervisor._send_heartbeats()
+        self.assertGreater(self.task_attempt.get_last_heartbeat(),
+                           self.task_attempt.last_heartbeat)
+        self._run_until_done()
+        task_attempt = TaskAttempt.objects.get(id=self.task_attempt.id)
+        self.assertFalse(task_attempt.status_is_failed)
+
+    def testFailedLaunch(self):
+        self.supervisor.launch(
+            ['sh', '-c', 'echo launch error; exit 1'], dict(os.environ),
+            task_attempt_uuid=self.task_attempt.uuid)
+        self._run_until_done()
+        task_attempt = TaskAttempt.objects.get(id=self.task_attempt.id)
+        self.assertTrue(task_attempt.status_is_failed)
+        self.assertIn('launch error',
+                      task_attempt.timepoints.get(is_error=True,
+                                                  detail__contains='launch')
+                      .detail)
@@ -0,0 +1,22 @@
+from django.test import TestCase, override_settings
+
+from api.local_worker_pool import LocalWorkerPool
+
+
+class MockDockerClient(object):
+
+    def info(self):
+        return {'NCPU': 4, 'MemTotal': 8*1024**3}
+
+
+class TestLocalWorkerPool(TestCase):
+
+    def testCapacityFromHost(self):
+        pool = LocalWorkerPool(MockDockerClient())
+        self.assertEqual(pool.get_capacity(), (4.0, 8.0))
+
+    @override_settings(LOCAL_WORKER_MAX_CORES='2',
+                       LOCAL_WORKER_MAX_MEMORY_GB='2')
+    def testCapacityFromSettings(self):
+        pool = LocalWorkerPool(MockDockerClient())
+        self.assertEqual(pool.get_capacity(), (2.0, 2.0))
@@ -0,0 +1,103 @@
+from django.test import TestCase, override_settings
+
+from api import tasks
+from api.models.tasks import SchedulerLease, Task
+from api.scheduler import TaskScheduler, parse_resources
+from api.test.models.test_tasks import get_task
+
+
+def resources(cores, memory_gb=0, disk_gb=0):
+    return {'cores': str(cores), 'memory': str(memory_gb),
+            'disk_size': str(disk_gb)}
+
+
+class TestParseResources(TestCase):
+
+    def testParse(self):
+        self.assertEqual(parse_resources(resources(2, '4G', '10GB')),
+                         (2.0, 4.0, 10.0))
+
+    def testDefaults(self):
+        self.assertEqual(parse_resources(None), (1.0, 0.0, 0.0))
+
+
+class TestTaskScheduler(TestCase):
+
+    def testUnlimited(self):
+        scheduler = TaskScheduler()
+        waiting = [('run1', resources(8), 'a'), ('run1', resources(8), 'b')]
+        self.assertEqual(scheduler.select([], waiting), ['a', 'b'])
+
+    def testBinPacking(self):
+        scheduler = TaskScheduler(max_cores=4, max_memory_gb=8, max_disk_gb=20)
+        running = [('run1', resources(2, 2, 10))]
+        waiting = [('run1', resources(1, 8), 'too-much-memory'),
+                   ('run1', resources(1, 1, 20), 'too-much-disk'),
+                   ('run1', resources(1, 1, 5), 'fits'),
+                   ('run1', resources(2, 1), 'too-many-cores')]
+        self.assertEqual(scheduler.select(running, waiting), ['fits'])
+
+    def testLargeTaskRunsAlone(self):
+        scheduler = TaskScheduler(max_cores=4)
+        waiting = [('run1', resources(16), 'a'), ('run1', resources(1), 'b')]
+        self.assertEqual(scheduler.select([], waiting), ['a'])
+        self.assertEqual(
+            scheduler.select([('run1', resources(1))], waiting), ['b'])
+
+    def testGlobalLimit(self):
+        scheduler = TaskScheduler(max_tasks=3)
+        running = [('run1', None)]
+        waiting = [('run1', None, 'a'), ('run1', None, 'b'),
+                   ('run1', None, 'c')]
+        self.assertEqual(scheduler.select(running, waiting), ['a', 'b'])
+
+    def testLimitPerRun(self):
+        scheduler = TaskScheduler(max_tasks_per_run=2)
+        running = [('run1', None)]
+        waiting = [('run1', None, 'a'), ('run1', None, 'b'),
+                   ('run2', None, 'c')]
+        self.assertEqual(scheduler.select(running, waiting), ['c', 'a'])
+
+    def testFairShare(self):
+        scheduler = TaskScheduler(max_tasks=5)
+        running = [('run1', None), ('run1', None)]
+        waiting = [('run1', None, 'a1'), ('run1', None, 'a2'),
+                   ('run2', None, 'b1'), ('run2', None, 'b2'),
+                   ('run2', None, 'b3'), ('run3', None, 'c1')]
+        self.assertEqual(scheduler.select(running, waiting),
+                         ['b1', 'c1', 'b2'])
+
+
+@override_settings(WORKER_TYPE='GCLOUD', SCHEDULER_MAX_TASKS='1')
+class TestScheduleTasks(TestCase):
+
+    def testStartsQueuedTasks(self):
+        task1 = get_task()
+        task2 = get_task()
+        tasks._queue_tasks([task1.uuid, task2.uuid])
+        tasks._schedule_tasks()
+
+        task1 = Task.objects.get(id=task1.id)
+        task2 = Task.objects.get(id=task2.id)
+        self.assertFalse(task1.status_is_waiting)
+        self.assertEqual(task1.attempt_number, 1)
+        self.assertTrue(task2.status_is_waiting)
+        self.assertEqual(task2.attempt_number, 0)
+
+    def testSkipsStoppedTasks(self):
+        task = get_task()
+        tasks._queue_tasks([task.uuid])
+        task = Task.objects.get(id=task.id)
+        task.status_is_running = False
+        task.save()
+        tasks._schedule_tasks()
+        self.assertEqual(Task.objects.get(id=task.id).attempt_number, 0)
+
+    def testLeaseHeldElsewhere(self):
+        task = get_task()
+        tasks._queue_tasks([task.uuid])
+        self.assertTrue(SchedulerLease.acquire())
+        tasks._schedule_tasks()
+        # Left for the holder, which was asked to make another pass
+        self.assertTrue(Task.objects.get(id=task.id).status_is_waiting)
+        self.assertFalse(SchedulerLease.release())
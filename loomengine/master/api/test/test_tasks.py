@@ -0,0 +1,175 @@
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from api import tasks
+from api.models.data_objects import FileDataObject, FileResource
+from api.models.runs import Run, StepRun
+from api.models.tasks import Task
+from api.models.templates import Step, Workflow
+
+
+def get_file_step():
+    return Step.objects.create(
+        name='count_lines',
+        command='wc -l {{infile}}',
+        environment={'docker_image': 'ubuntu'},
+        resources={'memory': 1, 'cores': 1},
+        inputs=[{'channel': 'infile', 'type': 'file',
+                 'mode': 'no_scatter', 'group': 0}],
+        outputs=[{'channel': 'count', 'type': 'string',
+                  'source': {'stream': 'stdout'}}],
+        type='step',
+        postprocessing_status='complete')
+
+def get_file_workflow():
+    # 'make_file' writes the file that 'count_lines' reads
+    make_file = Step.objects.create(
+        name='make_file',
+        command='echo {{text}} > {{infile}}',
+        environment={'docker_image': 'ubuntu'},
+        resources={'memory': 1, 'cores': 1},
+        inputs=[{'channel': 'text', 'type': 'string',
+                 'mode': 'no_scatter', 'group': 0}],
+        outputs=[{'channel': 'infile', 'type': 'file',
+                  'source': {'filename': 'infile.txt'}}],
+        type='step',
+        postprocessing_status='complete')
+    workflow = Workflow.objects.create(
+        type='workflow',
+        name='make_and_count',
+        inputs=[{'channel': 'text', 'type': 'string'}],
+        outputs=[{'channel': 'count', 'type': 'string'}],
+        postprocessing_status='complete')
+    workflow.add_steps([make_file, get_file_step()])
+    return workflow
+
+def get_file(filename='infile.txt'):
+    file = FileDataObject.objects.create(
+        type='file',
+        filename=filename,
+        md5='abcde',
+        source_type='imported')
+    file.initialize()
+    return file
+
+
+# Tasks are queued but not started, since no more than 0 may run
+@override_settings(TEST_DISABLE_TASK_DELAY=True,
+                   TEST_NO_AUTOSTART_RUNS=False,
+                   WORKER_TYPE='MOCK',
+                   SCHEDULER_MAX_TASKS='0',
+                   KEEP_DUPLICATE_FILES=True)
+class TestCreateTasksForFileResource(TransactionTestCase):
+
+    def setUp(self):
+        self.file = get_file()
+        self.step_run = Run.create_from_template(get_file_step()).steprun
+        self.step_run.inputs.get(channel='infile').add_data_as_scalar(
+            self.file)
+        self.assertFalse(Task.objects.filter(
+            step_run=self.step_run).exists())
+
+    def testUploadComplete(self):
+        resource = FileResource.objects.get(id=self.file.file_resource.id)
+        resource.upload_status = 'complete'
+        resource.save()
+        self.assertTrue(Task.objects.get(
+            step_run=self.step_run).status_is_waiting)
+
+    def testOnlyTransitionToCompleteCreatesTasks(self):
+        resource = FileResource.objects.get(id=self.file.file_resource.id)
+        resource.upload_status = 'complete'
+        resource.save()
+        calls = []
+        create_tasks_for_file_resource = tasks.create_tasks_for_file_resource
+        tasks.create_tasks_for_file_resource = calls.append
+        try:
+            resource.save()
+            FileResource.objects.get(id=resource.id).save()
+        finally:
+            tasks.create_tasks_for_file_resource = \
+                create_tasks_for_file_resource
+        self.assertEqual(calls, [])
+
+    def testSetUploadStatusInBulk(self):
+        FileResource.set_upload_status_in_bulk(
+            [self.file.file_resource.uuid], 'complete')
+        self.assertTrue(Task.objects.get(
+            step_run=self.step_run).status_is_waiting)
+
+    def testUploadCompleteOnConnectedOutput(self):
+        # Data reaches count_lines through the output of make_file,
+        # as it does when a task result is uploaded
+        run = Run.create_from_template(get_file_workflow())
+        output = run.steps.get(name='make_file').outputs.get(
+            channel='infile')
+        step_run = run.steps.get(name='count_lines').steprun
+        self.assertTrue(output.is_connected(
+            step_run.inputs.get(channel='infile')))
+        file = get_file()
+        output.add_data_as_scalar(file)
+        self.assertEqual(output.data_root.root_node_id, output.data_root.id)
+        self.assertFalse(Task.objects.filter(step_run=step_run).exists())
+        resource = FileResource.objects.get(id=file.file_resource.id)
+        resource.upload_status = 'complete'
+        resource.save()
+        self.assertTrue(Task.objects.get(
+            step_run=step_run).status_is_waiting)
+
+
+@override_settings(TEST_DISABLE_TASK_DELAY=True,
+                   TEST_NO_AUTOSTART_RUNS=False,
+                   WORKER_TYPE='MOCK',
+                   SCHEDULER_MAX_TASKS='0',
+                   KEEP_DUPLICATE_FILES=True)
+class TestCreateTasksForDataRoot(TransactionTestCase):
+
+    def testAddReadyData(self):
+        step_run = Run.create_from_template(get_file_step()).steprun
+        self.assertFalse(Task.objects.filter(step_run=step_run).exists())
+        file = get_file()
+        file.file_resource.upload_status = 'complete'
+        file.file_resource.save()
+        step_run.inputs.get(channel='infile').add_data_as_scalar(file)
+        self.assertTrue(Task.objects.get(
+            step_run=step_run).status_is_waiting)
+
+    def testAddEmptyScatterInput(self):
+        step = Step.objects.create(
+            name='count_letters',
+            command='echo {{letter}}',
+            environment={'docker_image': 'ubuntu'},
+            resources={'memory': 1, 'cores': 1},
+            inputs=[{'channel': 'letter', 'type': 'string',
+                     'mode': 'scatter', 'group': 0}],
+            outputs=[{'channel': 'count', 'type': 'string',
+                      'source': {'stream': 'stdout'}}],
+            type='step',
+            postprocessing_status='complete')
+        workflow = Workflow.objects.create(
+            type='workflow',
+            name='count_letters',
+            inputs=[{'channel': 'letter', 'type': 'string'}],
+            outputs=[{'channel': 'count', 'type': 'string'}],
+            postprocessing_status='complete')
+        workflow.add_steps([step])
+        run = Run.create_from_template(workflow)
+        step_run = run.steps.get(name='count_letters').steprun
+        input = step_run.inputs.get(channel='letter')
+        input._initialize_data_root()
+        input.data_root.add_data_objects_in_bulk([])
+        tasks.create_tasks_for_data_root(input.data_root.id)
+        self.assertFalse(Task.objects.filter(step_run=step_run).exists())
+        self.assertTrue(StepRun.objects.get(id=step_run.id).status_is_finished)
+        self.assertTrue(Run.objects.get(id=run.id).status_is_finished)
+
+
+@override_settings(TEST_NO_AUTOSTART_RUNS=False,
+                   LOOM_PREWARM_IMAGE_PLAYBOOK='prewarm_image.yml')
+class TestPrewarmImage(TestCase):
+
+    def testRequestIsSharedByAllProcesses(self):
+        # A TestCase never commits, so no playbook is launched
+        tasks.prewarm_image('ubuntu')
+        self.assertTrue(caches['shared'].get(
+            tasks._get_prewarm_cache_key('ubuntu')))
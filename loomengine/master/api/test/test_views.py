@@ -0,0 +1,48 @@
+import json
+from django.test import TestCase
+
+from api.test.serializers.test_tasks import get_task
+
+
+class TestTaskAttemptHeartbeats(TestCase):
+
+    def _post(self, data):
+        return self.client.post('/api/task-attempts/heartbeats/',
+                                json.dumps(data),
+                                content_type='application/json')
+
+    def testHeartbeats(self):
+        task_attempt = get_task().task_attempts.first()
+        response = self._post({'uuids': [task_attempt.uuid]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['uuids'],
+                         [task_attempt.uuid])
+
+    def testInvalidUuid(self):
+        for uuids in [['not-a-uuid'], [None], [{'uuid': 'x'}], 'x']:
+            self.assertEqual(self._post({'uuids': uuids}).status_code, 400)
+
+    def testInvalidJson(self):
+        response = self.client.post('/api/task-attempts/heartbeats/',
+                                    '{"uuids": [',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestTaskAttemptEvents(TestCase):
+
+    def _post(self, task_attempt, events):
+        return self.client.post(
+            '/api/task-attempts/%s/events/' % task_attempt.uuid,
+            json.dumps(events),
+            content_type='application/json')
+
+    def testUnknownOutput(self):
+        task_attempt = get_task().task_attempts.first()
+        response = self._post(task_attempt, [
+            {'type': 'timepoint', 'data': {'message': 'rolled back'}},
+            {'type': 'output', 'data': {'id': 0}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(task_attempt.timepoints.filter(
+            message='rolled back').exists())
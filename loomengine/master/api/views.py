@@ -1,16 +1,19 @@
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
 import logging
 import os
+from uuid import UUID
 from rest_framework import viewsets
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 
 from api import get_setting
 from api import models
 from api import serializers
+from api.serializers.base import project_fields
 from loomengine.utils import version
 
 
@@ -22,16 +25,63 @@ DATA_CLASSES = {'file': models.FileDataObject,
                 'float': models.FloatDataObject,
                 'integer': models.IntegerDataObject}
 
-class ExpandableViewSet(viewsets.ModelViewSet):
+class FieldProjectionMixin(object):
+    """Supports 'fields=name1,name2' on GET requests to render only some
+    fields of each object. Prefetches used only by omitted fields are
+    skipped.
+    """
+
+    # Leading lookup components that select a subclass, e.g. 'steprun' in
+    # 'steprun__inputs', are ignored when matching lookups to fields.
+    subclass_lookup_prefixes = ()
+
+    def get_projected_fields(self):
+        if self.request.method != 'GET':
+            return None
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        return set([field.strip() for field in fields.split(',')
+                    if field.strip()])
+
+    def filter_queryset(self, queryset):
+        queryset = super(FieldProjectionMixin, self).filter_queryset(queryset)
+        fields = self.get_projected_fields()
+        if fields is None:
+            return queryset
+        lookups = [lookup for lookup in queryset._prefetch_related_lookups
+                   if self._is_lookup_needed(lookup, fields)]
+        return queryset.prefetch_related(None).prefetch_related(*lookups)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(FieldProjectionMixin, self).get_serializer(
+            *args, **kwargs)
+        fields = self.get_projected_fields()
+        if fields is not None:
+            project_fields(serializer, fields)
+        return serializer
+
+    def _is_lookup_needed(self, lookup, fields):
+        parts = lookup.split('__')
+        if parts[0] in self.subclass_lookup_prefixes:
+            parts = parts[1:]
+        name = parts[0]
+        if name.startswith('prefetch_'):
+            name = name[len('prefetch_'):]
+        return name in fields
+
+
+class ExpandableViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
 
     def get_serializer_context(self):
         return {'request': self.request,
                 'expand': 'expand' in self.request.query_params}
 
 
-class DataObjectViewSet(viewsets.ModelViewSet):
+class DataObjectViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     lookup_field = 'uuid'
     serializer_class = serializers.DataObjectSerializer
+    subclass_lookup_prefixes = ('dataobjectarray',)
 
     def get_queryset(self):
         queryset = models.DataObject.objects.all()
@@ -55,8 +105,30 @@ class DataObjectViewSet(viewsets.ModelViewSet):
                                'file_resource')
         return queryset.order_by('-datetime_created')
 
-
-class FileDataObjectViewSet(viewsets.ModelViewSet):
+    @list_route(methods=['post'], url_path='bulk-create')
+    def bulk_create(self, request):
+        """Create a list of data objects in one request. If any of them
+        is invalid, none are created.
+        """
+        data = json.loads(request.body)
+        if not isinstance(data, list):
+            return JsonResponse({"message": "Expected a list"}, status=400)
+        context = self.get_serializer_context()
+        data_objects = []
+        with transaction.atomic():
+            for data_object_data in data:
+                s = serializers.DataObjectSerializer(
+                    data=data_object_data, context=context)
+                s.is_valid(raise_exception=True)
+                data_objects.append(s.save())
+        return JsonResponse(
+            [serializers.DataObjectSerializer(
+                data_object, context=context).data
+             for data_object in data_objects],
+            status=201, safe=False)
+
+
+class FileDataObjectViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     lookup_field = 'uuid'
     serializer_class = serializers.FileDataObjectSerializer
 
@@ -72,23 +144,36 @@ class FileDataObjectViewSet(viewsets.ModelViewSet):
         queryset = queryset.select_related('file_resource')
         return queryset.order_by('-datetime_created')
 
+    @list_route(methods=['post'], url_path='find-by-md5')
+    def find_by_md5(self, request):
+        """Look up files for a list of md5s in one request. The response
+        maps each md5 to the list of files that have it.
+        """
+        data = json.loads(request.body)
+        md5_list = data.get('md5') if isinstance(data, dict) else None
+        if not isinstance(md5_list, list):
+            return JsonResponse({"message": "md5 list is required"}, status=400)
+        context = self.get_serializer_context()
+        matches = dict((md5, []) for md5 in md5_list)
+        for file_data_object in models.FileDataObject.filter_by_md5_list(
+                md5_list).select_related('file_resource'):
+            matches[file_data_object.md5].append(
+                serializers.FileDataObjectSerializer(
+                    file_data_object, context=context).data)
+        return JsonResponse(matches, status=200)
+
 
 class DataTreeViewSet(ExpandableViewSet):
     lookup_field = 'uuid'
     serializer_class = serializers.DataNodeSerializer
+    # DataNodes have no datetime_created to paginate on
+    pagination_class = None
 
     def get_queryset(self):
+        # Descendants are loaded by DataNodeSerializer in a single query
         queryset = models.DataNode.objects.filter(parent__isnull=True)
-        queryset = queryset\
-                   .select_related('data_object')\
-                   .prefetch_related('descendants__data_object')\
-                   .prefetch_related('descendants__data_object__stringdataobject')\
-                   .prefetch_related('descendants__data_object__filedataobject')\
-                   .prefetch_related(
-                       'descendants__data_object__filedataobject__file_resource')\
-                   .prefetch_related('descendants__data_object__booleandataobject')\
-                   .prefetch_related('descendants__data_object__integerdataobject')\
-                   .prefetch_related('descendants__data_object__floatdataobject')
+        queryset = queryset.select_related(
+            *serializers.DataNodeSerializer.RELATED_FIELDS)
         return queryset
 
 
@@ -99,6 +184,53 @@ class FileResourceViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return models.FileResource.objects.all().order_by('-datetime_created')
 
+    @detail_route(methods=['post'], url_path='finalize')
+    def finalize(self, request, uuid=None):
+        """Set the md5 calculated by the client during upload
+        and mark the upload complete.
+        """
+        data_json = request.body
+        data = json.loads(data_json)
+        try:
+            file_resource = models.FileResource.objects.get(uuid=uuid)
+        except ObjectDoesNotExist:
+            return JsonResponse({"message": "Not Found"}, status=404)
+        if not data.get('md5'):
+            return JsonResponse({"message": "md5 is required"}, status=400)
+        try:
+            with transaction.atomic():
+                file_resource.finalize(data['md5'])
+        except models.MD5MismatchError as e:
+            file_resource = models.FileResource.objects.get(uuid=uuid)
+            file_resource.upload_status = 'failed'
+            file_resource.save()
+            return JsonResponse({"message": e.message}, status=400)
+        s = serializers.FileResourceSerializer(
+            file_resource, context={'request': request})
+        return JsonResponse(s.data, status=201)
+
+    @list_route(methods=['post'], url_path='set-upload-status')
+    def set_upload_status(self, request):
+        """Set upload_status on a list of file resources at once, e.g.
+        to confirm a batch of finished uploads.
+        """
+        data = json.loads(request.body)
+        uuids = data.get('uuids') if isinstance(data, dict) else None
+        upload_status = data.get('upload_status') \
+                        if isinstance(data, dict) else None
+        if not isinstance(uuids, list):
+            return JsonResponse({"message": "uuids list is required"},
+                                status=400)
+        if upload_status not in dict(
+                models.FileResource._meta.get_field(
+                    'upload_status').choices):
+            return JsonResponse(
+                {"message": "Invalid upload_status \"%s\"" % upload_status},
+                status=400)
+        count = models.FileResource.set_upload_status_in_bulk(
+            uuids, upload_status)
+        return JsonResponse({"count": count}, status=200)
+
         
 class TaskViewSet(ExpandableViewSet):
     lookup_field = 'uuid'
@@ -238,6 +370,32 @@ class TaskAttemptViewSet(ExpandableViewSet):
                            .prefetch_related('timepoints')
         return queryset.order_by('-datetime_created')
 
+    @list_route(methods=['post'], url_path='heartbeats')
+    def heartbeats(self, request):
+        """Record a heartbeat for each running TaskAttempt in a list,
+        e.g. all those on one worker node.
+        """
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({"message": "Invalid JSON"}, status=400)
+        uuids = data.get('uuids') if isinstance(data, dict) else None
+        if not isinstance(uuids, list):
+            return JsonResponse({"message": "uuids list is required"},
+                                status=400)
+        for task_attempt_uuid in uuids:
+            try:
+                UUID(task_attempt_uuid)
+            except (TypeError, ValueError, AttributeError):
+                return JsonResponse(
+                    {"message": "Invalid uuid \"%s\"" % task_attempt_uuid},
+                    status=400)
+        running_uuids = list(models.TaskAttempt.objects.filter(
+            uuid__in=uuids, status_is_running=True).values_list(
+                'uuid', flat=True))
+        models.TaskAttempt.record_heartbeats_in_bulk(running_uuids)
+        return JsonResponse({"uuids": running_uuids}, status=200)
+
     @detail_route(methods=['post'], url_path='create-log-file')
     def create_log_file(self, request, uuid=None):
         data_json = request.body
@@ -295,6 +453,29 @@ class TaskAttemptViewSet(ExpandableViewSet):
 
         return JsonResponse(s.data, status=201)
 
+    @detail_route(methods=['post'], url_path='events')
+    def create_events(self, request, uuid=None):
+        """Apply an ordered list of TaskRunner events in one transaction.
+        See TaskAttemptEventSerializer for the event types.
+        """
+        data_json = request.body
+        data = json.loads(data_json)
+        try:
+            task_attempt = models.TaskAttempt.objects.get(uuid=uuid)
+        except ObjectDoesNotExist:
+            return JsonResponse({"message": "Not Found"}, status=404)
+        s = serializers.TaskAttemptEventSerializer(
+            data=data,
+            many=True,
+            context={
+                'parent_instance': task_attempt,
+                'request': request,
+            })
+        s.is_valid(raise_exception=True)
+        with transaction.atomic():
+            results = s.save()
+        return JsonResponse({'results': results}, status=201)
+
     @detail_route(methods=['get'], url_path='worker-settings')
     def get_worker_settings(self, request, uuid=None):
         try:
@@ -305,6 +486,15 @@ class TaskAttemptViewSet(ExpandableViewSet):
                 'STDERR_LOG_FILE': task_attempt.get_stderr_log_file(),
                 'HEARTBEAT_INTERVAL_SECONDS':
                 get_setting('TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS'),
+                'INPUT_COPY_CONCURRENCY':
+                get_setting('TASKRUNNER_INPUT_COPY_CONCURRENCY'),
+                'INPUT_CACHE_DIR': task_attempt.get_input_cache_dir(),
+                'INPUT_CACHE_SIZE_GB':
+                get_setting('TASKRUNNER_INPUT_CACHE_SIZE_GB'),
+                'MATERIALIZATION_POLICY':
+                get_setting('TASKRUNNER_MATERIALIZATION_POLICY'),
+                'IMAGE_LOCK_DIR': task_attempt.get_image_lock_dir(),
+                'HEARTBEAT_DIR': task_attempt.get_heartbeat_dir(),
             }, status=200)
         except ObjectDoesNotExist:
             return JsonResponse({"message": "Not Found"}, status=404)
@@ -336,6 +526,7 @@ class TemplateViewSet(ExpandableViewSet):
 class RunViewSet(ExpandableViewSet):
     lookup_field = 'uuid'
     serializer_class = serializers.RunSerializer
+    subclass_lookup_prefixes = ('workflowrun', 'steprun')
 
     def get_queryset(self):
         query_string = self.request.query_params.get('q', '')
@@ -451,6 +642,9 @@ def status(request):
 def filemanager_settings(request):
     return JsonResponse({
         'GCE_PROJECT': get_setting('GCE_PROJECT'),
+        'S3_ENDPOINT_URL': get_setting('S3_ENDPOINT_URL'),
+        'FINALIZE_MD5_AFTER_UPLOAD':
+        models.FileResource.can_finalize_md5_after_upload(),
     })
 
 @require_http_methods(["GET"])
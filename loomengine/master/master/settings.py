@@ -60,16 +60,34 @@ LOG_DIR = os.path.expanduser(os.getenv('LOOM_LOG_DIR', '/var/log/loom/'))
 LOOM_SETTINGS_PATH = os.path.expanduser(os.getenv('LOOM_SETTINGS_PATH','~/.loom/'))
 TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS = os.getenv('LOOM_TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS', '60')
 TASKRUNNER_HEARTBEAT_TIMEOUT_SECONDS = os.getenv('LOOM_TASKRUNNER_HEARTBEAT_TIMEOUT_SECONDS', '300')
+STEP_RUN_SWEEP_INTERVAL_SECONDS = os.getenv('LOOM_STEP_RUN_SWEEP_INTERVAL_SECONDS', '300')
+TASKRUNNER_INPUT_COPY_CONCURRENCY = os.getenv('LOOM_TASKRUNNER_INPUT_COPY_CONCURRENCY', '8')
+TASKRUNNER_INPUT_CACHE_SIZE_GB = os.getenv('LOOM_TASKRUNNER_INPUT_CACHE_SIZE_GB', '100')
+TASKRUNNER_MATERIALIZATION_POLICY = os.getenv('LOOM_TASKRUNNER_MATERIALIZATION_POLICY', 'reflink,copy')
 PRESERVE_ON_FAILURE = to_boolean(os.getenv('LOOM_PRESERVE_ON_FAILURE', 'False'))
 PRESERVE_ALL = to_boolean(os.getenv('LOOM_PRESERVE_ALL', 'False'))
 MAXIMUM_TASK_RETRIES = os.getenv('LOOM_MAXIMUM_TASK_RETRIES', '2')
 
+# Capacity of all workers together, used to decide when queued Tasks may
+# start. Blank means unlimited. With WORKER_TYPE LOCAL, cores and memory
+# default to the local worker pool's capacity.
+SCHEDULER_MAX_CORES = os.getenv('LOOM_SCHEDULER_MAX_CORES')
+SCHEDULER_MAX_MEMORY_GB = os.getenv('LOOM_SCHEDULER_MAX_MEMORY_GB')
+SCHEDULER_MAX_DISK_GB = os.getenv('LOOM_SCHEDULER_MAX_DISK_GB')
+SCHEDULER_MAX_TASKS = os.getenv('LOOM_SCHEDULER_MAX_TASKS')
+SCHEDULER_MAX_TASKS_PER_RUN = os.getenv('LOOM_SCHEDULER_MAX_TASKS_PER_RUN')
+
 # GCP settings
 GCE_EMAIL = os.getenv('GCE_EMAIL')
 GCE_PROJECT = os.getenv('GCE_PROJECT', '')
 GCE_PEM_FILE_PATH = os.getenv('GCE_PEM_FILE_PATH')
 GOOGLE_STORAGE_BUCKET = os.getenv('LOOM_GOOGLE_STORAGE_BUCKET', '')
 
+# S3 settings. S3_ENDPOINT_URL is only needed for S3-compatible
+# servers other than AWS, e.g. MinIO.
+S3_BUCKET = os.getenv('LOOM_S3_BUCKET', '')
+S3_ENDPOINT_URL = os.getenv('LOOM_S3_ENDPOINT_URL', '')
+
 WORKER_BOOT_DISK_TYPE = os.getenv('WORKER_BOOT_DISK_TYPE')
 WORKER_BOOT_DISK_SIZE = os.getenv('WORKER_BOOT_DISK_SIZE')
 WORKER_CUSTOM_SUBNET = os.getenv('WORKER_CUSTOM_SUBNET', '')
@@ -93,6 +111,23 @@ LOOM_SETTINGS_HOME = os.getenv('LOOM_SETTINGS_HOME', os.path.expanduser('~/.loom
 PLAYBOOK_PATH = os.path.join(LOOM_SETTINGS_HOME, os.getenv('LOOM_PLAYBOOK_DIR', 'playbooks'))
 LOOM_RUN_TASK_PLAYBOOK = os.getenv('LOOM_RUN_TASK_PLAYBOOK')
 LOOM_CLEANUP_TASK_PLAYBOOK = os.getenv('LOOM_CLEANUP_TASK_PLAYBOOK')
+LOOM_PREWARM_IMAGE_PLAYBOOK = os.getenv('LOOM_PREWARM_IMAGE_PLAYBOOK')
+
+# Settings for WORKER_TYPE LOCAL. Task runners are started directly
+# through Docker unless LOOM_LOCAL_WORKER_USE_PLAYBOOK is True. The
+# pool's capacity defaults to the host's cores and memory.
+LOCAL_WORKER_USE_PLAYBOOK = to_boolean(os.getenv('LOOM_LOCAL_WORKER_USE_PLAYBOOK', 'False'))
+LOCAL_WORKER_MAX_CORES = os.getenv('LOOM_LOCAL_WORKER_MAX_CORES')
+LOCAL_WORKER_MAX_MEMORY_GB = os.getenv('LOOM_LOCAL_WORKER_MAX_MEMORY_GB')
+LOCAL_WORKER_MASTER_URL = os.getenv(
+    'LOOM_LOCAL_WORKER_MASTER_URL',
+    'https://127.0.0.1:%s' % os.getenv('LOOM_HTTPS_PORT', '443')
+    if to_boolean(os.getenv('LOOM_HTTPS_PORT_ENABLED', 'False'))
+    else 'http://127.0.0.1:%s' % os.getenv('LOOM_HTTP_PORT', '80'))
+LOOM_SERVER_NAME = os.getenv('LOOM_SERVER_NAME')
+LOOM_DOCKER_IMAGE = os.getenv('LOOM_DOCKER_IMAGE')
+LOOM_TASKRUNNER_CONTAINER_NAME_SUFFIX = os.getenv('LOOM_TASKRUNNER_CONTAINER_NAME_SUFFIX', '-taskrunner')
+TASKRUNNER_LOG_LEVEL = os.getenv('LOOM_LOG_LEVEL', 'WARNING').upper()
 
 # Database settings
 LOOM_MYSQL_PASSWORD = os.getenv('LOOM_MYSQL_PASSWORD')
@@ -181,6 +216,8 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ),
+    # Applied only when the client requests a page. See api.pagination
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CursorPagination',
 }
 
 TEMPLATES = [
@@ -264,6 +301,31 @@ if LOOM_MYSQL_HOST:
 else:
     DATABASES = _get_sqlite_databases()
 
+# The "default" cache is local to each process. Anything that must be
+# seen by all server processes, e.g. invalidated by a celery worker, goes
+# in a cache table instead. The tables are created by
+# "manage.py createcachetable".
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    'heartbeats': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_heartbeats',
+        'OPTIONS': {
+            # One entry per recently running TaskAttempt
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
 # Logging
 if len(sys.argv) > 1 and sys.argv[1] == 'test':
     DISABLE_LOGGING = True
@@ -0,0 +1,63 @@
+import errno
+import hashlib
+import json
+import os
+
+
+class TransferCheckpoint(object):
+    """A small JSON file that records the progress of a file transfer,
+    so that a transfer interrupted by an error or a killed process can
+    be resumed instead of starting over.
+
+    The key identifies the transfer, e.g. source, destination and size.
+    A checkpoint saved with a different key is ignored, so a changed
+    source file is never resumed against stale progress.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.data = {}
+
+    @classmethod
+    def in_directory(cls, checkpoint_dir, key):
+        """Checkpoint for a transfer whose destination can't hold one,
+        e.g. an upload to a bucket. The filename is derived from the key.
+        """
+        key_hash = hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()
+        return cls(os.path.join(checkpoint_dir, key_hash + '.json'), key)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                contents = json.load(f)
+        except (IOError, ValueError):
+            contents = {}
+        if contents.get('key') == self.key:
+            self.data = contents.get('data', {})
+        else:
+            self.data = {}
+        return self.data
+
+    def save(self, **data):
+        self.data.update(data)
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Write then rename, so a crash never leaves a partial checkpoint
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'key': self.key, 'data': self.data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, self.path)
+
+    def delete(self):
+        self.data = {}
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -1,7 +1,7 @@
 import json
+import random
 import requests
 import time
-import datetime
 import urllib
 
 from loomengine.utils.exceptions import *
@@ -15,50 +15,68 @@ def disable_insecure_request_warning():
 class Connection(object):
     """Connection provides functions to create and work with objects in the 
     Loom database via the HTTP API
+
+    All requests go through one pooled requests.Session, so connections to
+    the server are kept alive and reused. A Connection may be shared by
+    several threads; set pool_size to at least the number of threads that
+    make requests concurrently.
+
+    Requests that fail to connect are retried with exponential backoff
+    and jitter until retry_deadline_seconds have passed.
     """
 
-    def __init__(self, master_url):
+    POOL_SIZE = 10
+    PAGE_SIZE = 100
+    RETRY_DEADLINE_SECONDS = 10
+    RETRY_INITIAL_DELAY_SECONDS = 0.2
+    RETRY_MAX_DELAY_SECONDS = 5
+
+    def __init__(self, master_url, pool_size=None, retry_deadline_seconds=None):
         self.api_root_url = master_url + '/api/'
+        if pool_size is None:
+            pool_size = self.POOL_SIZE
+        if retry_deadline_seconds is None:
+            retry_deadline_seconds = self.RETRY_DEADLINE_SECONDS
+        self.retry_deadline_seconds = float(retry_deadline_seconds)
+        disable_insecure_request_warning()
+        self.session = requests.Session()
+        self.session.verify = False # Don't fail on unrecognized SSL certificate
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=int(pool_size), pool_maxsize=int(pool_size))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     # ---- General methods ----
     
     def _post(self, data, relative_url):
         url = self.api_root_url + relative_url
-        disable_insecure_request_warning()
         return self._make_request_to_server(
-            lambda: requests.post(
+            lambda: self.session.post(
                 url,
                 data=json.dumps(data),
-                headers={'content-type': 'application/json'},
-                verify=False))
+                headers={'content-type': 'application/json'}))
 
     def _put(self, data, relative_url):
         url = self.api_root_url + relative_url
-        disable_insecure_request_warning()
         return self._make_request_to_server(
-            lambda: requests.put(
+            lambda: self.session.put(
                 url,
                 data=json.dumps(data),
-                headers={'content-type': 'application/json'},
-                verify=False))
+                headers={'content-type': 'application/json'}))
 
     def _patch(self, data, relative_url):
         url = self.api_root_url + relative_url
-        disable_insecure_request_warning()
         return self._make_request_to_server(
-            lambda: requests.patch(
+            lambda: self.session.patch(
                 url,
                 data=json.dumps(data),
-                headers={'content-type': 'application/json'},
-                verify=False))
+                headers={'content-type': 'application/json'}))
 
     def _get(self, relative_url, raise_for_status=True, params=None):
         url = self.api_root_url + relative_url
-        disable_insecure_request_warning()
         return self._make_request_to_server(
-            lambda: requests.get(
+            lambda: self.session.get(
                 url,
-                verify=False, # Don't fail on unrecognized SSL certificate
                 params=params), 
             raise_for_status=raise_for_status)
 
@@ -66,25 +84,24 @@ class Connection(object):
         """Verifies server connection and handles response errors
         for either get or post requests
         """
-        # Try to connect every {retry_delay_seconds} until {time_limit_seconds} or until
-        # the response returns without error.
-        start_time = datetime.datetime.now()
-        time_limit_seconds = 2
-        retry_delay_seconds = 0.2
-        while datetime.datetime.now() - start_time < datetime.timedelta(0, time_limit_seconds):
-            error = None
+        # Retry with exponential backoff and full jitter until
+        # retry_deadline_seconds or until the response returns without error.
+        deadline = time.time() + self.retry_deadline_seconds
+        max_delay_seconds = self.RETRY_INITIAL_DELAY_SECONDS
+        while True:
             try:
                 response = query_function()
                 if raise_for_status:
                     response.raise_for_status()
+                return response
             except requests.exceptions.ConnectionError as e:
                 error = ServerConnectionError("No response from server.\n%s" % e.message)
-            if error:
-                time.sleep(retry_delay_seconds)
-                continue
-            else:
-                return response
-        raise error
+            delay_seconds = random.uniform(0, max_delay_seconds)
+            if time.time() + delay_seconds > deadline:
+                raise error
+            time.sleep(delay_seconds)
+            max_delay_seconds = min(
+                max_delay_seconds * 2, self.RETRY_MAX_DELAY_SECONDS)
 
     def _post_object(self, object_data, relative_url):
         return self._post(object_data, relative_url).json()
@@ -105,9 +122,36 @@ class Connection(object):
         else:
             raise BadResponseError("Status code %s. %s" % (response.status_code, response.text))
 
-    def _get_object_index(self, relative_url, params=None):
+    def _get_object_index(self, relative_url, params=None, max=float('inf')):
+        # Stops reading pages once more than 'max' objects are found
+        objects = []
+        for item in self._iterate_object_index(relative_url, params=params):
+            objects.append(item)
+            if len(objects) > max:
+                break
+        return objects
+
+    def _iterate_object_index(self, relative_url, params=None):
+        """Yields objects one at a time, requesting the next page from
+        the server only when the current one is used up.
+        """
+        params = dict(params or {})
+        params.setdefault('page_size', self.PAGE_SIZE)
         response = self._get(relative_url, params=params)
-        return response.json()
+        while True:
+            data = response.json()
+            if not isinstance(data, dict):
+                # Server does not paginate
+                for item in data:
+                    yield item
+                return
+            for item in data['results']:
+                yield item
+            if not data.get('next'):
+                return
+            next_url = data['next']
+            response = self._make_request_to_server(
+                lambda: self.session.get(next_url))
 
     # ---- Post/Put/Get [object_type] methods ----
 
@@ -124,7 +168,7 @@ class Connection(object):
         url = 'data-objects/'
         if query_string:
             url += 'data-objects/?q='+urllib.quote(query_string)
-        data_objects =  self._get_object_index(url)
+        data_objects =  self._get_object_index(url, max=max)
         if len(data_objects) < min:
             raise IdMatchedTooFewDataObjectsError(
                 'Found %s DataObjects, expected at least %s' \
@@ -135,6 +179,11 @@ class Connection(object):
                 % (len(data_objects), max))
         return data_objects
 
+    def post_data_objects_in_bulk(self, data_objects):
+        return self._post_object(
+            data_objects,
+            'data-objects/bulk-create/')
+
     def update_data_object(self, data_object_id, data_update):
         return self._patch_object(
             data_update,
@@ -143,14 +192,17 @@ class Connection(object):
     
     def get_file_data_object_index(
             self, query_string=None, source_type='all',
-            min=0, max=float('inf')):
+            min=0, max=float('inf'), fields=None):
         url = 'files/'
         params = {}
         if query_string:
             params['q'] = query_string
         if source_type and source_type!='all':
             params['source_type'] = source_type
-        file_data_objects =  self._get_object_index(url, params=params)
+        if fields:
+            params['fields'] = ','.join(fields)
+        file_data_objects =  self._get_object_index(
+            url, params=params, max=max)
         if len(file_data_objects) < min:
             raise IdMatchedTooFewDataObjectsError(
                 'Found %s FileDataObjects, expected at least %s' \
@@ -161,15 +213,33 @@ class Connection(object):
                 % (len(file_data_objects), max))
         return file_data_objects
 
+    def get_file_data_objects_by_md5(self, md5_list):
+        """Returns a dict mapping each md5 to a list of matching files
+        """
+        return self._post_object(
+            {'md5': md5_list},
+            'files/find-by-md5/')
+
     def update_file_resource(self, file_resource_id, file_resource_update):
         return self._patch_object(
             file_resource_update,
             'file-resources/%s/' % file_resource_id)
 
+    def finalize_file_resource(self, file_resource_id, md5):
+        return self._post_object(
+            {'md5': md5},
+            'file-resources/%s/finalize/' % file_resource_id)
+
+    def set_upload_status_in_bulk(self, file_resource_ids, upload_status):
+        return self._post_object(
+            {'uuids': file_resource_ids,
+             'upload_status': upload_status},
+            'file-resources/set-upload-status/')
+
     def get_file_imports_by_file(self, file_id):
-        return self._get_object_index(
+        return self._get(
             'files/' + file_id + '/file-imports/'
-        )
+        ).json()
     
     def get_template(self, template_id):
         return self._get_object(
@@ -184,7 +254,7 @@ class Connection(object):
             params['q'] = query_string
         if imported:
             params['imported'] = '1'
-        templates = self._get_object_index(url, params=params)
+        templates = self._get_object_index(url, params=params, max=max)
         if len(templates) < min:
             raise Error('Found %s templates, expected at least %s' %(len(templates), min))
         if len(templates) > max:
@@ -209,7 +279,7 @@ class Connection(object):
             params['q'] = query_string
         if parent_only:
             params['parent_only'] = '1'
-        runs = self._get_object_index(url, params=params)
+        runs = self._get_object_index(url, params=params, max=max)
         if len(runs) < min:
             raise Error('Found %s template runs, expected at least %s' %(len(runs), min))
         if len(runs) > max:
@@ -231,7 +301,7 @@ class Connection(object):
             url = 'run-requests/?q='+urllib.quote(query_string)
         else:
             url = 'run-requests/'
-        run_requests = self._get_object_index(url)
+        run_requests = self._get_object_index(url, max=max)
         if len(run_requests) < min:
             raise Error('Found %s run requests, expected at least %s' %(len(run_requests), min))
         if len(run_requests) > max:
@@ -276,6 +346,16 @@ class Connection(object):
             'task-attempts/%s/create-timepoint/' % task_attempt_id
         )
 
+    def post_task_attempt_events(self, task_attempt_id, events):
+        return self._post_object(
+            events,
+            'task-attempts/%s/events/' % task_attempt_id)
+
+    def post_task_attempt_heartbeats(self, task_attempt_ids):
+        return self._post_object(
+            {'uuids': task_attempt_ids},
+            'task-attempts/heartbeats/')
+
     def post_task_attempt_fail(self, task_attempt_id):
         return self._post_object(
             {},
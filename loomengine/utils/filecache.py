@@ -0,0 +1,126 @@
+import errno
+import fcntl
+import logging
+import os
+import stat
+import uuid
+
+from loomengine.utils import materialize
+
+
+def _makedirs(directory):
+    # Tolerates other processes creating the same directory concurrently
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class FileCache(object):
+    """A node-local cache of files keyed by md5.
+
+    Cached files are stored read-only under <cache_dir>/files/<md5> and
+    materialized into their destination with the strategies in
+    materialization_policy, except hardlink. A task could make a hard
+    link writable and change the cached file for every later task.
+    When the total size of the cache exceeds max_bytes, least recently
+    used entries are evicted.
+
+    Several processes may share one cache_dir. Each entry is guarded by
+    an flock on <cache_dir>/locks/<md5>, held while the entry is fetched
+    or materialized, so that a file is only fetched once and is never
+    evicted while in use.
+    """
+
+    def __init__(self, cache_dir, max_bytes, materialization_policy=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.policy = tuple(
+            [name for name in materialize.parse_policy(materialization_policy)
+             if name != 'hardlink'])
+        self.files_dir = os.path.join(cache_dir, 'files')
+        self.locks_dir = os.path.join(cache_dir, 'locks')
+        self.tmp_dir = os.path.join(cache_dir, 'tmp')
+        self.logger = logging.getLogger(__name__)
+        for directory in (self.files_dir, self.locks_dir, self.tmp_dir):
+            _makedirs(directory)
+
+    def materialize(self, md5, destination_path, fetch):
+        """Place the file with the given md5 at destination_path.
+        If it is not already cached, fetch(path) is called to write it
+        into the cache first.
+        """
+        cached_path = self._get_cached_path(md5)
+        with open(self._get_lock_path(md5), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(cached_path):
+                    self.logger.info('Found %s in cache' % md5)
+                    # mtime marks the last use, for LRU eviction
+                    os.utime(cached_path, None)
+                else:
+                    self._add(md5, fetch)
+                self._link_or_copy(cached_path, destination_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in
+        max_bytes. Entries that are locked by another process are skipped.
+        """
+        entries = []
+        for md5 in os.listdir(self.files_dir):
+            try:
+                info = os.stat(self._get_cached_path(md5))
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            entries.append((info.st_mtime, info.st_size, md5))
+        total_bytes = sum(size for (mtime, size, md5) in entries)
+        for (mtime, size, md5) in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if self._try_to_remove(md5):
+                total_bytes -= size
+
+    def _add(self, md5, fetch):
+        tmp_path = os.path.join(self.tmp_dir, '%s.%s' % (md5, uuid.uuid4().hex))
+        try:
+            fetch(tmp_path)
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(tmp_path, self._get_cached_path(md5))
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _try_to_remove(self, md5):
+        with open(self._get_lock_path(md5), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+            try:
+                self.logger.info('Evicting %s from cache' % md5)
+                os.remove(self._get_cached_path(md5))
+                return True
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return False
+                raise
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _link_or_copy(self, cached_path, destination_path):
+        materialize.materialize(cached_path, destination_path, self.policy)
+
+    def _get_cached_path(self, md5):
+        return os.path.join(self.files_dir, md5)
+
+    def _get_lock_path(self, md5):
+        return os.path.join(self.locks_dir, md5)
@@ -0,0 +1,26 @@
+import errno
+import fcntl
+import os
+
+
+class FileLock(object):
+    """Exclusive lock on a file, held by one process on the host at a
+    time. Use as a context manager.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.f = open(self.path, 'a')
+        fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        self.f.close()
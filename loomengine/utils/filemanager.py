@@ -1,17 +1,44 @@
 import abc
+import boto
+import boto.s3.connection
 import copy
 import errno
+import fnmatch
 import glob
+import hashlib
+import httplib2
+import io
+import json
 import logging
+import mimetypes
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
+import re
 import shutil
+import socket
 import sys
 import tempfile
+import threading
+import time
 import urlparse
 import gcloud.storage
+from gcloud.storage.blob import _UploadConfig, _UrlBuilder
+from gcloud.streaming.exceptions import Error as StreamingError
+from gcloud.streaming.exceptions import HttpError
+from gcloud.streaming.http_wrapper import Request
+from gcloud.streaming.transfer import Download, Upload, RESUMABLE_UPLOAD
 import requests
-
+try:
+    import crcmod.predefined
+except ImportError:
+    # Optional. Without it, Google Storage objects that have no md5 are
+    # hashed but not verified against their crc32c.
+    crcmod = None
+
+from loomengine.utils import materialize
 from loomengine.utils import md5calc
+from loomengine.utils.checkpoint import TransferCheckpoint
 from loomengine.utils.exceptions import *
 from loomengine.utils.connection import Connection
 
@@ -21,6 +48,15 @@ from oauth2client.client import ApplicationDefaultCredentialsError
 import apiclient.discovery
 
 
+# Checkpoints for uploads are kept here. Downloads keep their
+# checkpoint next to the destination file.
+CHECKPOINT_DIR = os.path.join(
+    os.path.expanduser('~'), '.loom', 'transfer-checkpoints')
+
+# Errors after which a resumable transfer is retried from its checkpoint
+TRANSFER_ERRORS = (StreamingError, httplib2.HttpLib2Error, socket.error)
+
+
 def _urlparse(pattern):
     """Like urlparse except it assumes 'file://' if no scheme is specified
     """
@@ -30,24 +66,51 @@ def _urlparse(pattern):
     return url
 
 
+class StorageBackend(object):
+    """The Source, SourceSet and Destination classes that implement
+    one url scheme. Each backend must support copy (through a registered
+    Copier), ranged read, stat, list (via SourceSet) and delete.
+    """
+
+    def __init__(self, scheme, source_set_class, source_class,
+                 destination_class):
+        self.scheme = scheme
+        self.source_set_class = source_set_class
+        self.source_class = source_class
+        self.destination_class = destination_class
+
+
+_storage_backends = {}
+_copiers = {}
+
+
+def register_storage_backend(scheme, source_set_class, source_class,
+                             destination_class):
+    _storage_backends[scheme] = StorageBackend(
+        scheme, source_set_class, source_class, destination_class)
+
+
+def register_copier(source_type, destination_type, copier_class):
+    _copiers[(source_type, destination_type)] = copier_class
+
+
+def _get_storage_backend(url):
+    scheme = _urlparse(url).scheme
+    try:
+        return _storage_backends[scheme]
+    except KeyError:
+        raise Exception(
+            'Cannot recognize file scheme in "%s". Make sure the url starts '\
+            'with a supported protocol: %s' % (
+                url, ', '.join(['%s://' % scheme for scheme
+                                in sorted(_storage_backends.keys())])))
+
+
 def SourceSet(pattern, settings):
     """Factory Method that returns a set of Sources matching the given pattern.
     Each Source represents one source file to be copied.
     """
-
-    url = _urlparse(pattern)
-
-    if url.scheme == 'gs':
-        return GoogleStorageSourceSet(pattern, settings)
-    elif url.scheme == 'file':
-        if url.hostname == 'localhost' or url.hostname is None:
-            return LocalSourceSet(pattern, settings)
-        else:
-            raise Exception("Cannot process file pattern %s. Remote file hosts not supported." % pattern)
-    else:
-        raise Exception('Cannot recognize file scheme in "%s". '\
-                        'Make sure the pattern starts with a supported protocol like gs:// or file://'
-                        % pattern)
+    return _get_storage_backend(pattern).source_set_class(pattern, settings)
 
 
 class AbstractSourceSet:
@@ -72,6 +135,7 @@ class LocalSourceSet(AbstractSourceSet):
 
     def __init__(self, pattern, settings):
         url = _urlparse(pattern)
+        _check_local_host(url)
         matches = self._get_matching_files(url.path)
         self.sources = [LocalSource('file://' + path, settings) for path in matches]
 
@@ -86,34 +150,81 @@ class LocalSourceSet(AbstractSourceSet):
         return filter(lambda x: os.path.isfile(x), all_matches)
 
 
+_gcs_local = threading.local()
+
+
+def _get_gcs_client(settings):
+    """Clients are shared, since creating one loads credentials. There is
+    one per thread because their httplib2 connections are not thread-safe.
+    """
+    clients = _gcs_local.__dict__.setdefault('clients', {})
+    project = settings['GCE_PROJECT']
+    if project not in clients:
+        try:
+            clients[project] = gcloud.storage.client.Client(project)
+        except ApplicationDefaultCredentialsError as e:
+            raise SystemExit(
+                'ERROR! '\
+                'Google Cloud application default credentials are not set. '\
+                'Please run "gcloud auth application-default login"')
+    return clients[project]
+
+
+def _get_gcs_bucket(settings, bucket_id):
+    buckets = _gcs_local.__dict__.setdefault('buckets', {})
+    key = (settings['GCE_PROJECT'], bucket_id)
+    if key not in buckets:
+        try:
+            buckets[key] = _get_gcs_client(settings).get_bucket(bucket_id)
+        except HttpAccessTokenRefreshError:
+            raise Exception('Failed to access bucket "%s". Are you logged in? Try "gcloud auth login"' % bucket_id)
+    return buckets[key]
+
+
 class GoogleStorageSourceSet(AbstractSourceSet):
-    """A set of source files on Google Storage
+    """A set of source files on Google Storage. The blob name may include
+    shell-style wildcards, or end with "/" to select every blob under
+    that prefix.
+
+    Matches are found by listing the bucket, and each source keeps the
+    metadata from the listing, so no request is made per blob.
     """
 
     def __init__(self, pattern, settings):
         self.settings = settings
-        self.sources = [GoogleStorageSource(pattern, settings)]
+        url = _urlparse(pattern)
+        bucket_id = url.hostname
+        blob_pattern = url.path.lstrip('/')
+        if glob.has_magic(blob_pattern):
+            prefix = re.split(r'[*?[]', blob_pattern, 1)[0]
+            match = lambda name: fnmatch.fnmatchcase(name, blob_pattern)
+        elif blob_pattern.endswith('/'):
+            prefix = blob_pattern
+            match = lambda name: True
+        else:
+            self.sources = [GoogleStorageSource(pattern, settings)]
+            return
+        bucket = _get_gcs_bucket(settings, bucket_id)
+        self.sources = [
+            GoogleStorageSource('gs://%s/%s' % (bucket_id, blob.name),
+                                settings, properties=blob._properties)
+            for blob in bucket.list_blobs(prefix=prefix)
+            if match(blob.name) and not blob.name.endswith('/')]
 
     def __iter__(self):
         return self.sources.__iter__()
 
-    # TODO support wildcards with multiple matches
-
 
 def Source(url, settings):
     """Factory method
     """
-    parsed_url = _urlparse(url)
+    return _get_storage_backend(url).source_class(url, settings)
 
-    if parsed_url.scheme == 'gs':
-        return GoogleStorageSource(url, settings)
-    elif parsed_url.scheme == 'file':
-        if parsed_url.hostname == 'localhost' or parsed_url.hostname is None:
-            return LocalSource(url, settings)
-        else:
-            raise Exception("Cannot process file url %s. Remote file hosts not supported." % url)
-    else:
-        raise Exception('Unsupported scheme "%s" in file "%s"' % (parsed_url.scheme, url))
+
+def _check_local_host(url):
+    if url.hostname not in ('localhost', None):
+        raise Exception("Cannot process file url %s. Remote file hosts not supported."
+                        % url.geturl())
 
 
 class AbstractSource:
@@ -131,6 +242,10 @@ class AbstractSource:
         copier = Copier(self, destination)
         copier.copy()
 
+    def copy_to_and_calculate_md5(self, destination):
+        copier = Copier(self, destination)
+        return copier.copy_and_calculate_md5()
+
     def move_to(self, destination):
         copier = Copier(self, destination)
         copier.move()
@@ -147,6 +262,27 @@ class AbstractSource:
     def get_filename(self):
         pass
 
+    @abc.abstractmethod
+    def stat(self):
+        """Returns {'size': bytes, 'md5': md5 or None}. md5 is included
+        only if the storage already has it.
+        """
+        pass
+
+    @abc.abstractmethod
+    def read_range(self, start, end):
+        """Returns bytes start through end, inclusive
+        """
+        pass
+
+    @abc.abstractmethod
+    def read(self):
+        pass
+
+    @abc.abstractmethod
+    def delete(self):
+        pass
+
 
 class LocalSource(AbstractSource):
     """A source file on local storage.
@@ -156,6 +292,7 @@ class LocalSource(AbstractSource):
 
     def __init__(self, url, settings):
         self.url = _urlparse(url)
+        _check_local_host(self.url)
 
     def calculate_md5(self):
         return md5calc.calculate_md5sum(self.get_path())
@@ -169,6 +306,14 @@ class LocalSource(AbstractSource):
     def get_filename(self):
         return os.path.basename(self.get_path())
 
+    def stat(self):
+        return {'size': os.path.getsize(self.get_path()), 'md5': None}
+
+    def read_range(self, start, end):
+        with open(self.get_path(), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
     def read(self):
         with open(self.get_path()) as f:
             return f.read()
@@ -186,7 +331,10 @@ class GoogleStorageSource(AbstractSource):
     # 2016-08-30: With default 1024*1024, download is 20x slower than gsutil.
     CHUNK_SIZE = 1024*1024*100 
 
-    def __init__(self, url, settings):
+    def __init__(self, url, settings, properties=None):
+        """properties is the blob metadata, if already known from a
+        bucket listing. Otherwise it is fetched here.
+        """
         self.url = _urlparse(url)
         assert self.url.scheme == 'gs'
         self.bucket_id = self.url.hostname
@@ -196,63 +344,221 @@ class GoogleStorageSource(AbstractSource):
         
         self.settings = settings
 
-        try:
-            self.client = gcloud.storage.client.Client(self.settings['GCE_PROJECT'])
-        except ApplicationDefaultCredentialsError as e:
-            raise SystemExit(
-                'ERROR! '\
-                'Google Cloud application default credentials are not set. '\
-                'Please run "gcloud auth application-default login"')
-
-        try:
-            self.bucket = self.client.get_bucket(self.bucket_id)
-            self.blob = self.bucket.get_blob(self.blob_id)
-        except HttpAccessTokenRefreshError:
-            raise Exception('Failed to access bucket "%s". Are you logged in? Try "gcloud auth login"' % self.bucket_id)
-        if self.blob is None:
-            raise Exception('Could not find file %s'
-                            % (self.url.geturl()))
-        self.blob.chunk_size = self.CHUNK_SIZE
+        if properties is None:
+            try:
+                blob = self.bucket.get_blob(self.blob_id)
+            except HttpAccessTokenRefreshError:
+                raise Exception('Failed to access bucket "%s". Are you logged in? Try "gcloud auth login"' % self.bucket_id)
+            if blob is None:
+                raise Exception('Could not find file %s'
+                                % (self.url.geturl()))
+            properties = blob._properties
+        self.properties = properties
+
+    @property
+    def client(self):
+        return _get_gcs_client(self.settings)
+
+    @property
+    def bucket(self):
+        return _get_gcs_bucket(self.settings, self.bucket_id)
+
+    @property
+    def blob(self):
+        # Bound to the current thread's client, so that sources listed in
+        # one thread can be copied in others.
+        blob = gcloud.storage.blob.Blob(
+            self.blob_id, self.bucket, chunk_size=self.CHUNK_SIZE)
+        blob._set_properties(self.properties)
+        return blob
 
     def calculate_md5(self):
+        if not self.blob.md5_hash:
+            # Composite objects have a crc32c but no md5
+            return self._stream_md5()
         md5_base64 = self.blob.md5_hash
         md5_hex = md5_base64.decode('base64').encode('hex').strip()
         return md5_hex
 
+    def _stream_md5(self):
+        # Hash the content as it is downloaded, without writing it to disk
+        stream = _HashingStream()
+        if self.blob.size:
+            download = Download.from_stream(
+                stream, auto_transfer=False, total_size=self.blob.size)
+            download.chunksize = self.CHUNK_SIZE
+            download.initialize_download(
+                Request(self.blob.media_link, 'GET', {}),
+                self.client.connection.http)
+            download.stream_file(use_chunks=True)
+        crc32c = stream.get_crc32c()
+        if crc32c is not None and self.blob.crc32c \
+           and crc32c != self.blob.crc32c:
+            raise Exception(
+                'Failed integrity check while reading %s. Expected crc32c '\
+                '%s but found %s' % (self.get_url(), self.blob.crc32c, crc32c))
+        return stream.md5.hexdigest()
+
     def get_url(self):
         return self.url.geturl()
 
     def get_filename(self):
         return os.path.basename(self.blob_id)
 
+    def stat(self):
+        return {'size': self.blob.size,
+                'md5': self.calculate_md5() if self.blob.md5_hash else None}
+
+    def read_range(self, start, end):
+        stream = io.BytesIO()
+        download = Download.from_stream(
+            stream, auto_transfer=False, total_size=self.blob.size)
+        download.chunksize = self.CHUNK_SIZE
+        download.initialize_download(
+            Request(self.blob.media_link, 'GET', {}),
+            self.client.connection.http)
+        download.get_range(start, end)
+        return stream.getvalue()
+
     def read(self):
-        tempdir = tempfile.mkdtemp()
-        dest_file = os.path.join(tempdir, self.get_filename())
-        self.copy_to(Destination(dest_file, self.settings))
-        with open(dest_file) as f:
-            text = f.read()
-        os.remove(dest_file)
-        os.rmdir(tempdir)
-        return text
+        # In memory, not through a temp file
+        if not self.blob.size:
+            return ''
+        return self.read_range(0, self.blob.size - 1)
 
     def delete(self):
         self.blob.delete()
 
 
-def Destination(url, settings):
-    """Factory method
+class _HashingStream(object):
+    """A write-only stream that hashes what is written instead of
+    keeping it.
     """
-    parsed_url = _urlparse(url)
 
-    if parsed_url.scheme == 'gs':
-        return GoogleStorageDestination(url, settings)
-    elif parsed_url.scheme == 'file':
-        if parsed_url.hostname == 'localhost' or parsed_url.hostname is None:
-            return LocalDestination(url, settings)
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        if crcmod is not None:
+            self.crc32c = crcmod.predefined.Crc('crc-32c')
         else:
-            raise Exception("Cannot process file url %s. Remote file hosts not supported." % url)
-    else:
-        raise Exception('Unsupported scheme "%s" in file "%s"' % (parsed_url.scheme, url))
+            self.crc32c = None
+
+    def write(self, data):
+        self.md5.update(data)
+        if self.crc32c is not None:
+            self.crc32c.update(data)
+
+    def get_crc32c(self):
+        """Base64 of the big-endian crc32c, as in Google Storage metadata
+        """
+        if self.crc32c is None:
+            return None
+        return self.crc32c.digest().encode('base64').strip()
+
+
+def _get_s3_connection(settings):
+    # Credentials come from the environment or boto config, as for the
+    # aws cli. S3_ENDPOINT_URL selects an S3-compatible server, e.g. MinIO.
+    endpoint_url = settings.get('S3_ENDPOINT_URL')
+    if not endpoint_url:
+        return boto.connect_s3()
+    endpoint = urlparse.urlparse(endpoint_url)
+    return boto.connect_s3(
+        host=endpoint.hostname,
+        port=endpoint.port,
+        is_secure=(endpoint.scheme == 'https'),
+        calling_format=boto.s3.connection.OrdinaryCallingFormat())
+
+
+class S3SourceSet(AbstractSourceSet):
+    """A set of source files in an S3-compatible bucket. The key may
+    include shell-style wildcards.
+    """
+
+    def __init__(self, pattern, settings):
+        url = _urlparse(pattern)
+        bucket_id = url.hostname
+        key_pattern = url.path.lstrip('/')
+        if not glob.has_magic(key_pattern):
+            self.sources = [S3Source(pattern, settings)]
+            return
+        prefix = re.split(r'[*?[]', key_pattern, 1)[0]
+        bucket = _get_s3_connection(settings).get_bucket(
+            bucket_id, validate=False)
+        self.sources = [
+            S3Source('s3://%s/%s' % (bucket_id, key.name), settings, key=key)
+            for key in bucket.list(prefix=prefix)
+            if fnmatch.fnmatchcase(key.name, key_pattern)
+            and not key.name.endswith('/')]
+
+    def __iter__(self):
+        return self.sources.__iter__()
+
+
+class S3Source(AbstractSource):
+    """A source file in an S3-compatible bucket.
+    """
+
+    type = 's3'
+
+    def __init__(self, url, settings, key=None):
+        self.url = _urlparse(url)
+        assert self.url.scheme == 's3'
+        self.bucket_id = self.url.hostname
+        self.key_id = self.url.path.lstrip('/')
+        if not self.bucket_id or not self.key_id:
+            raise Exception('Could not parse url "%s". Be sure to use the format "s3://bucket/key".' % url)
+        self.settings = settings
+        self.connection = _get_s3_connection(settings)
+        self.bucket = self.connection.get_bucket(
+            self.bucket_id, validate=False)
+        self.key = key or self.bucket.get_key(self.key_id)
+        if self.key is None:
+            raise Exception('Could not find file %s' % self.url.geturl())
+
+    def calculate_md5(self):
+        md5 = self._get_md5_from_etag()
+        if md5:
+            return md5
+        # Multipart uploads have an etag that is not an md5
+        m = hashlib.md5()
+        self.key.open_read()
+        try:
+            for data in self.key:
+                m.update(data)
+        finally:
+            self.key.close()
+        return m.hexdigest()
+
+    def _get_md5_from_etag(self):
+        etag = (self.key.etag or '').strip('"')
+        if re.match('^[0-9a-f]{32}$', etag):
+            return etag
+        return None
+
+    def get_url(self):
+        return self.url.geturl()
+
+    def get_filename(self):
+        return os.path.basename(self.key_id)
+
+    def stat(self):
+        return {'size': self.key.size, 'md5': self._get_md5_from_etag()}
+
+    def read_range(self, start, end):
+        return self.bucket.get_key(self.key_id).get_contents_as_string(
+            headers={'Range': 'bytes=%s-%s' % (start, end)})
+
+    def read(self):
+        return self.key.get_contents_as_string()
+
+    def delete(self):
+        self.key.delete()
+
+
+def Destination(url, settings):
+    """Factory method
+    """
+    return _get_storage_backend(url).destination_class(url, settings)
 
 
 class AbstractDestination:
@@ -287,6 +593,7 @@ class LocalDestination(AbstractDestination):
 
     def __init__(self, url, settings):
         self.url = _urlparse(url)
+        _check_local_host(self.url)
         self.settings = settings
 
     def get_path(self):
@@ -318,9 +625,9 @@ class GoogleStorageDestination(AbstractDestination):
         assert self.url.scheme == 'gs'
         self.bucket_id = self.url.hostname
         self.blob_id = self.url.path.lstrip('/')
-        self.client = gcloud.storage.client.Client(self.settings['GCE_PROJECT'])
+        self.client = _get_gcs_client(self.settings)
+        self.bucket = _get_gcs_bucket(self.settings, self.bucket_id)
         try:
-            self.bucket = self.client.get_bucket(self.bucket_id)
             self.blob = self.bucket.get_blob(self.blob_id)
             if self.blob:
                 self.blob.chunk_size = self.CHUNK_SIZE
@@ -340,27 +647,48 @@ class GoogleStorageDestination(AbstractDestination):
         return False
 
     def write(self, content):
-        with tempfile.NamedTemporaryFile('w') as f:
-            f.write(content)
-            f.flush()
-            Source(f.name, self.settings).copy_to(self)
+        self.blob.upload_from_string(content)
+
+
+class S3Destination(AbstractDestination):
+
+    type = 's3'
+
+    def __init__(self, url, settings):
+        self.settings = settings
+        self.url = _urlparse(url)
+        assert self.url.scheme == 's3'
+        self.bucket_id = self.url.hostname
+        self.key_id = self.url.path.lstrip('/')
+        self.connection = _get_s3_connection(settings)
+        self.bucket = self.connection.get_bucket(
+            self.bucket_id, validate=False)
+
+    def get_url(self):
+        return self.url.geturl()
+
+    def exists(self):
+        return self.bucket.get_key(self.key_id) is not None
+
+    def is_dir(self):
+        # No dirs in S3, just keys
+        return False
+
+    def write(self, content):
+        self.bucket.new_key(self.key_id).set_contents_from_string(content)
 
 
 def Copier(source, destination):
     """Factory method to select the right copier for a given source and destination.
+    Pairs with no registered copier are copied through a local temp file.
     """
-
-    if source.type == 'local' and destination.type == 'local':
-        return LocalCopier(source, destination)
-    elif source.type == 'local' and destination.type == 'google_storage':
-        return Local2GoogleStorageCopier(source, destination)
-    elif source.type == 'google_storage' and destination.type == 'local':
-        return GoogleStorage2LocalCopier(source, destination)
-    elif source.type == 'google_storage' and destination.type == 'google_storage':
-        return GoogleStorageCopier(source, destination)
-    else:
-        raise Exception('Could not find method to copy from source "%s" to destination "%s".'
-                        % (source, destination))
+    copier_class = _copiers.get((source.type, destination.type))
+    if copier_class is not None:
+        return copier_class(source, destination)
+    if (source.type, 'local') in _copiers and ('local', destination.type) in _copiers:
+        return StagedCopier(source, destination)
+    raise Exception('Could not find method to copy from source "%s" to destination "%s".'
+                    % (source, destination))
 
 
 class AbstractCopier:
@@ -374,49 +702,199 @@ class AbstractCopier:
     def copy(self, hash_function):
         pass
 
+    def copy_and_calculate_md5(self):
+        # Copiers that can hash while copying override this
+        # to avoid reading the source twice.
+        self.copy()
+        return self.source.calculate_md5()
+
     @abc.abstractmethod
     def move(self):
         pass
 
 
 class LocalCopier(AbstractCopier):
+    """Places files with the strategies in the MATERIALIZATION_POLICY
+    setting, e.g. reflink or hard link before copy. See
+    loomengine.utils.materialize.
+    """
 
     def copy(self):
+        materialize.materialize(
+            self.source.get_path(), self.destination.get_path(),
+            self._get_policy())
+
+    def copy_and_calculate_md5(self):
+        # If the file can be linked, hashing the source is the only read.
+        # Otherwise hash while copying so the source is read only once.
+        policy = tuple([name for name in self._get_policy()
+                        if name != 'copy'])
         try:
-            os.makedirs(os.path.dirname(self.destination.get_path()))
-        except OSError as e:
-            if e.errno == errno.EEXIST:
-                pass
-            else:
-                raise e
-        shutil.copy(self.source.get_path(), self.destination.get_path())
+            materialize.materialize(
+                self.source.get_path(), self.destination.get_path(), policy)
+            return self.source.calculate_md5()
+        except materialize.MaterializationError:
+            return md5calc.copy_and_calculate_md5sum(
+                self.source.get_path(), self.destination.get_path())
 
     def move(self):
-        try:
-            os.makedirs(os.path.dirname(self.destination.get_path()))
-        except OSError as e:
-            if e.errno == errno.EEXIST:
-                pass
-            else:
-                raise e
-        shutil.move(self.source.get_path(), self.destination.get_path())
+        materialize.move(self.source.get_path(), self.destination.get_path())
+
+    def _get_policy(self):
+        return materialize.parse_policy(
+            self.destination.settings.get('MATERIALIZATION_POLICY'))
 
 
 class GoogleStorageCopier(AbstractCopier):
+    """Copies on the server with the rewrite API, which unlike copy works
+    for objects of any size and between locations and storage classes.
+    No data passes through this host.
+    """
 
     def copy(self):
-        self.source.bucket.copy_blob(self.source.blob, self.destination.bucket, self.destination.blob_id)
+        connection = self.source.client.connection
+        path = '%s/rewriteTo%s' % (self.source.blob.path,
+                                   self.destination.blob.path)
+        query_params = {}
+        # Large rewrites take several calls, each continuing from a token
+        while True:
+            response = connection.api_request(
+                method='POST', path=path, query_params=query_params, data={})
+            if response.get('done'):
+                break
+            query_params['rewriteToken'] = response['rewriteToken']
+        self.destination.blob._set_properties(response['resource'])
+        self._verify()
+
+    def _verify(self):
+        # Both checksums are computed by the server. crc32c is present
+        # even on composite objects, which have no md5.
+        source = self.source.blob
+        destination = self.destination.blob
+        if source.crc32c and source.crc32c != destination.crc32c:
+            raise Exception(
+                'Copy of %s to %s failed integrity check. Expected crc32c '\
+                '%s but found %s' % (
+                    self.source.get_url(), self.destination.get_url(),
+                    source.crc32c, destination.crc32c))
 
     def move(self):
-        if not self.source.bucket_id == self.destination.bucket_id:
-            raise Exception('"move" operation is not supported between buckets.')
-        self.source.bucket.rename_blob(self.source.blob, self.destination.blob_id)
+        self.copy()
+        self.source.delete()
 
 
 class Local2GoogleStorageCopier(AbstractCopier):
 
+    # Files larger than RESUMABLE_THRESHOLD are uploaded in a resumable
+    # session. The session URL is checkpointed, so a failed or interrupted
+    # upload continues from the last chunk the server confirmed, in this
+    # process or in a later one.
+    RESUMABLE_THRESHOLD = 1024*1024*100
+    TRANSFER_ATTEMPTS = 3
+
     def copy(self):
-        self.destination.blob.upload_from_filename(self.source.get_path())
+        if os.path.getsize(self.source.get_path()) > self.RESUMABLE_THRESHOLD:
+            self._resumable_upload()
+        else:
+            self.destination.blob.upload_from_filename(self.source.get_path())
+
+    def copy_and_calculate_md5(self):
+        if os.path.getsize(self.source.get_path()) > self.RESUMABLE_THRESHOLD:
+            return self._resumable_upload()
+        with open(self.source.get_path(), 'rb') as f:
+            reader = md5calc.MD5Reader(f)
+            content_type, _ = mimetypes.guess_type(self.source.get_path())
+            self.destination.blob.upload_from_file(
+                reader, size=os.fstat(f.fileno()).st_size,
+                content_type=content_type)
+            return reader.hexdigest()
+
+    def _resumable_upload(self):
+        path = self.source.get_path()
+        stat = os.stat(path)
+        checkpoint = TransferCheckpoint.in_directory(
+            CHECKPOINT_DIR,
+            {'source': path,
+             'destination': self.destination.get_url(),
+             'size': stat.st_size,
+             'mtime': stat.st_mtime})
+        checkpoint.load()
+        for attempt in range(self.TRANSFER_ATTEMPTS):
+            try:
+                return self._upload_from_checkpoint(
+                    path, stat.st_size, checkpoint)
+            except TRANSFER_ERRORS:
+                if attempt + 1 == self.TRANSFER_ATTEMPTS:
+                    raise
+
+    def _upload_from_checkpoint(self, path, size, checkpoint):
+        blob = self.destination.blob
+        connection = blob.bucket.client._connection
+        content_type = mimetypes.guess_type(path)[0] \
+                       or 'application/octet-stream'
+        with open(path, 'rb') as f:
+            reader = md5calc.MD5Reader(f)
+            upload = None
+            if checkpoint.data.get('session_url'):
+                upload = self._new_upload(reader, content_type, size)
+                upload._initialize(
+                    connection.http, checkpoint.data['session_url'])
+                try:
+                    upload.refresh_upload_state()
+                except HttpError:
+                    # Upload sessions expire after a week. Start over.
+                    upload = None
+                    reader.seek(0)
+            if upload is None:
+                upload = self._start_upload_session(
+                    reader, content_type, size, connection)
+                checkpoint.save(session_url=upload.url)
+            reader.hash_until(upload.progress)
+            response = upload.stream_file(use_chunks=True)
+            md5 = reader.hexdigest()
+        blob._set_properties(json.loads(response.content))
+
+        # Verify the server received the same bytes that were hashed here
+        remote_md5 = blob.md5_hash.decode('base64').encode('hex') \
+                     if blob.md5_hash else None
+        checkpoint.delete()
+        if remote_md5 is not None and remote_md5 != md5:
+            blob.delete()
+            raise Exception(
+                'Upload of %s failed integrity check. Local md5 is %s but '\
+                'uploaded md5 is %s' % (path, md5, remote_md5))
+        return md5
+
+    def _new_upload(self, reader, content_type, size):
+        upload = Upload(reader, content_type, size, auto_transfer=False,
+                        chunksize=self.destination.CHUNK_SIZE)
+        upload.strategy = RESUMABLE_UPLOAD
+        return upload
+
+    def _start_upload_session(self, reader, content_type, size, connection):
+        # Same request as gcloud Blob.upload_from_file, but the session is
+        # kept so that it can be resumed.
+        blob = self.destination.blob
+        upload = self._new_upload(reader, content_type, size)
+        headers = {
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'User-Agent': connection.USER_AGENT,
+        }
+        url_builder = _UrlBuilder(bucket_name=blob.bucket.name,
+                                  object_name=blob.name)
+        base_url = connection.API_BASE_URL + '/upload'
+        request = Request(
+            connection.build_api_url(api_base_url=base_url,
+                                     path=blob.bucket.path + '/o'),
+            'POST', headers)
+        upload.configure_request(_UploadConfig(), request, url_builder)
+        request.url = connection.build_api_url(
+            api_base_url=base_url,
+            path=blob.bucket.path + '/o',
+            query_params=url_builder.query_params)
+        upload.initialize_upload(request, connection.http)
+        return upload
 
     def move(self):
         raise Exception('"move" operation is not supported from local to Google Storage.')
@@ -424,6 +902,16 @@ class Local2GoogleStorageCopier(AbstractCopier):
 
 class GoogleStorage2LocalCopier(AbstractCopier):
 
+    # Blobs larger than PARALLEL_DOWNLOAD_THRESHOLD are fetched in
+    # DOWNLOAD_CHUNK_SIZE byte ranges, PARALLEL_DOWNLOAD_PARTS at a time,
+    # into a partial file. Finished chunks are recorded in a checkpoint
+    # next to the destination, so a retried download only fetches the
+    # chunks that are missing.
+    PARALLEL_DOWNLOAD_THRESHOLD = 1024*1024*256
+    PARALLEL_DOWNLOAD_PARTS = 8
+    DOWNLOAD_CHUNK_SIZE = 1024*1024*64
+    TRANSFER_ATTEMPTS = 3
+
     def copy(self):
         try:
             os.makedirs(os.path.dirname(self.destination.get_path()))
@@ -432,27 +920,261 @@ class GoogleStorage2LocalCopier(AbstractCopier):
                 pass
             else:
                 raise e
-        self.source.blob.download_to_filename(self.destination.get_path())
+        size = self.source.blob.size
+        if size is not None and size > self.PARALLEL_DOWNLOAD_THRESHOLD:
+            self._resumable_download(size)
+        else:
+            self.source.blob.download_to_filename(self.destination.get_path())
+
+    def _resumable_download(self, size):
+        path = self.destination.get_path()
+        partial_path = path + '.loom-partial'
+        checkpoint = TransferCheckpoint(
+            path + '.loom-checkpoint',
+            {'source': self.source.get_url(),
+             'generation': self.source.blob.generation,
+             'size': size,
+             'chunk_size': self.DOWNLOAD_CHUNK_SIZE})
+        completed = set(checkpoint.load().get('completed_chunks', []))
+        if not os.path.exists(partial_path) \
+           or os.path.getsize(partial_path) != size:
+            completed = set()
+        if not completed:
+            with open(partial_path, 'wb') as f:
+                f.truncate(size)
+            checkpoint.save(completed_chunks=[])
+
+        for attempt in range(self.TRANSFER_ATTEMPTS):
+            try:
+                self._download_chunks(partial_path, size, completed,
+                                      checkpoint)
+                break
+            except TRANSFER_ERRORS:
+                if attempt + 1 == self.TRANSFER_ATTEMPTS:
+                    raise
+
+        md5 = md5calc.calculate_md5sum(partial_path)
+        remote_md5 = self.source.calculate_md5() \
+                     if self.source.blob.md5_hash else None
+        if remote_md5 is not None and remote_md5 != md5:
+            os.remove(partial_path)
+            checkpoint.delete()
+            raise Exception(
+                'Download of %s failed integrity check. Expected md5 %s '\
+                'but found %s' % (self.source.get_url(), remote_md5, md5))
+        os.rename(partial_path, path)
+        checkpoint.delete()
+
+    def _download_chunks(self, path, size, completed, checkpoint):
+        chunks = [(index, start, min(start + self.DOWNLOAD_CHUNK_SIZE, size) - 1)
+                  for (index, start) in enumerate(
+                          range(0, size, self.DOWNLOAD_CHUNK_SIZE))
+                  if index not in completed]
+        if not chunks:
+            return
+        pool = ThreadPool(min(len(chunks), self.PARALLEL_DOWNLOAD_PARTS))
+        try:
+            for index in pool.imap_unordered(
+                    lambda chunk: self._download_chunk(path, *chunk), chunks):
+                completed.add(index)
+                checkpoint.save(completed_chunks=sorted(completed))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _download_chunk(self, path, index, start, end):
+        self._download_range(path, start, end)
+        return index
+
+    def _download_range(self, path, start, end):
+        # httplib2.Http is not thread-safe, so each range gets its own
+        http = self.source.client.connection.credentials.authorize(
+            httplib2.Http())
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            download = Download.from_stream(
+                f, auto_transfer=False, total_size=self.source.blob.size)
+            download.chunksize = self.source.CHUNK_SIZE
+            download.initialize_download(
+                Request(self.source.blob.media_link, 'GET', {}), http)
+            download.get_range(start, end)
+            if f.tell() != end + 1:
+                raise StreamingError(
+                    'Expected bytes %s-%s but received %s bytes'
+                    % (start, end, f.tell() - start))
+            # Data must be on disk before the chunk is checkpointed
+            f.flush()
+            os.fsync(f.fileno())
 
     def move(self):
         raise Exception('"move" operation is not supported from Google Storage to local.')
 
 
+class Local2S3Copier(AbstractCopier):
+
+    # Files larger than MULTIPART_THRESHOLD are sent in MULTIPART_CHUNK_SIZE
+    # parts. S3 does not accept single uploads over 5GB.
+    MULTIPART_THRESHOLD = 1024*1024*100
+    MULTIPART_CHUNK_SIZE = 1024*1024*64
+
+    def copy(self):
+        with open(self.source.get_path(), 'rb') as f:
+            self._upload(f, os.fstat(f.fileno()).st_size)
+
+    def copy_and_calculate_md5(self):
+        with open(self.source.get_path(), 'rb') as f:
+            reader = md5calc.MD5Reader(f)
+            self._upload(reader, os.fstat(f.fileno()).st_size)
+            return reader.hexdigest()
+
+    def _upload(self, f, size):
+        bucket = self.destination.bucket
+        key_id = self.destination.key_id
+        if size <= self.MULTIPART_THRESHOLD:
+            bucket.new_key(key_id).set_contents_from_file(
+                f, size=size, rewind=True)
+            return
+        upload = bucket.initiate_multipart_upload(key_id)
+        try:
+            for (part_number, start) in enumerate(
+                    range(0, size, self.MULTIPART_CHUNK_SIZE), 1):
+                f.seek(start)
+                upload.upload_part_from_file(
+                    f, part_number,
+                    size=min(self.MULTIPART_CHUNK_SIZE, size - start))
+            upload.complete_upload()
+        except:
+            upload.cancel_upload()
+            raise
+
+    def move(self):
+        raise Exception('"move" operation is not supported from local to S3.')
+
+
+class S32LocalCopier(AbstractCopier):
+
+    def copy(self):
+        try:
+            os.makedirs(os.path.dirname(self.destination.get_path()))
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                pass
+            else:
+                raise e
+        self.source.key.get_contents_to_filename(self.destination.get_path())
+
+    def move(self):
+        raise Exception('"move" operation is not supported from S3 to local.')
+
+
+class S3Copier(AbstractCopier):
+
+    # Server-side copies over 5GB must be done in parts
+    MULTIPART_THRESHOLD = 1024*1024*1024*5
+    MULTIPART_CHUNK_SIZE = 1024*1024*1024
+
+    def copy(self):
+        size = self.source.key.size
+        bucket = self.destination.bucket
+        key_id = self.destination.key_id
+        if size <= self.MULTIPART_THRESHOLD:
+            bucket.copy_key(key_id, self.source.bucket_id, self.source.key_id)
+            return
+        upload = bucket.initiate_multipart_upload(key_id)
+        try:
+            for (part_number, start) in enumerate(
+                    range(0, size, self.MULTIPART_CHUNK_SIZE), 1):
+                upload.copy_part_from_key(
+                    self.source.bucket_id, self.source.key_id, part_number,
+                    start=start,
+                    end=min(start + self.MULTIPART_CHUNK_SIZE, size) - 1)
+            upload.complete_upload()
+        except:
+            upload.cancel_upload()
+            raise
+
+    def move(self):
+        self.copy()
+        self.source.delete()
+
+
+class StagedCopier(AbstractCopier):
+    """Copies between backends that have no direct copier, e.g.
+    Google Storage to S3, through a local temp file.
+    """
+
+    def copy(self):
+        settings = self.destination.settings
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, self.source.get_filename())
+            self.source.copy_to(LocalDestination('file://' + path, settings))
+            LocalSource('file://' + path, settings).copy_to(self.destination)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def move(self):
+        self.copy()
+        self.source.delete()
+
+
+register_storage_backend(
+    'file', LocalSourceSet, LocalSource, LocalDestination)
+register_storage_backend(
+    'gs', GoogleStorageSourceSet, GoogleStorageSource, GoogleStorageDestination)
+register_storage_backend(
+    's3', S3SourceSet, S3Source, S3Destination)
+
+register_copier('local', 'local', LocalCopier)
+register_copier('local', 'google_storage', Local2GoogleStorageCopier)
+register_copier('google_storage', 'local', GoogleStorage2LocalCopier)
+register_copier('google_storage', 'google_storage', GoogleStorageCopier)
+register_copier('local', 's3', Local2S3Copier)
+register_copier('s3', 'local', S32LocalCopier)
+register_copier('s3', 's3', S3Copier)
+
+
 class FileManager:
     """Manages file import/export
     """
 
-    def __init__(self, master_url):
+    # Batch import settings. HASH_PROCESSES=None uses one process per CPU.
+    HASH_PROCESSES = None
+    UPLOAD_THREADS = 8
+    MD5_QUERY_BATCH_SIZE = 500
+    CREATE_BATCH_SIZE = 200
+    CONFIRM_BATCH_SIZE = 100
+    PROGRESS_INTERVAL = 100
+
+    def __init__(self, master_url, cache=None, materialization_policy=None):
+        """cache is an optional loomengine.utils.filecache.FileCache used
+        when exporting remote files to local destinations.
+        materialization_policy sets how local files are copied to local
+        destinations. See loomengine.utils.materialize.
+        """
         self.connection = Connection(master_url)
         self.settings = self.connection.get_filemanager_settings()
+        if materialization_policy:
+            self.settings['MATERIALIZATION_POLICY'] = materialization_policy
+        self.cache = cache
         self.logger = logging.getLogger(__name__)
 
     def import_from_patterns(self, patterns, note, force_duplicates=False):
-        files = []
+        # Sources are kept rather than recreated from their urls, so
+        # metadata from listing the storage is not fetched again.
+        sources = []
+        source_urls = set()
         for pattern in patterns:
-            files.extend(self.import_from_pattern(
-                pattern, note, force_duplicates=force_duplicates))
-        return files
+            for source in SourceSet(pattern, self.settings):
+                if source.get_url() not in source_urls:
+                    source_urls.add(source.get_url())
+                    sources.append(source)
+        if len(sources) > 1:
+            return self.import_sources_in_batch(
+                sources, note, force_duplicates=force_duplicates)
+        return [self.import_file(source.get_url(), note,
+                                 force_duplicates=force_duplicates)
+                for source in sources]
 
     def import_from_pattern(self, pattern, note, force_duplicates=False):
         files = []
@@ -476,12 +1198,17 @@ class FileManager:
         source = Source(source_url, self.settings)
         filename = source.get_filename()
 
-        self.logger.info('Calculating md5 on file "%s"...' % source_url)
-        md5 = source.calculate_md5()
+        if force_duplicates and self._can_calculate_md5_during_import(source):
+            # No md5 needed to check for duplicates. Leave it blank
+            # to be set when the upload is finalized.
+            md5 = ''
+        else:
+            self.logger.info('Calculating md5 on file "%s"...' % source_url)
+            md5 = source.calculate_md5()
 
         if not force_duplicates:
             files = self.connection.get_file_data_object_index(
-                query_string='%%%s' % md5)
+                query_string='$%s' % md5)
             if len(files) > 0:
                 md5 = files[0].get('md5')
                 matches = []
@@ -502,14 +1229,244 @@ class FileManager:
             'source_type': 'imported',
         })
 
-    def import_result_file(self, task_attempt_output, source_url):
-        self.logger.info('Calculating md5 on file "%s"...' % source_url)
+    def import_files_in_batch(self, source_urls, note, force_duplicates=False):
+        """Import many files with a few bulk requests instead of several
+        requests per file. Files are hashed in parallel, checked for
+        duplicates with one query per MD5_QUERY_BATCH_SIZE files, created
+        in bulk, uploaded concurrently, and confirmed in batches.
+
+        If an earlier import of the same files was interrupted, files
+        already imported from the same source_url are skipped and
+        incomplete uploads are retried with their existing data objects.
+        No files are created if any would be an unforced duplicate.
+        """
+        return self.import_sources_in_batch(
+            [Source(source_url, self.settings) for source_url in source_urls],
+            note, force_duplicates=force_duplicates)
+
+    def import_sources_in_batch(self, sources, note, force_duplicates=False):
+        """Like import_files_in_batch, for sources that have already been
+        created, e.g. from a SourceSet listing.
+        """
+        md5s = self._calculate_md5s_in_parallel(sources)
+        if force_duplicates:
+            # Every source gets a new file, even if it was imported before
+            matches = {}
+        else:
+            matches = self._get_files_by_md5(md5s)
+
+        completed = []
+        to_upload = []
+        to_create = []
+        duplicates = []
+        new_md5s = set()
+        for (source, md5) in zip(sources, md5s):
+            previous_import = self._get_previous_import(
+                source, md5, matches.get(md5, []))
+            if previous_import is None:
+                if not force_duplicates and (
+                        matches.get(md5) or md5 in new_md5s):
+                    duplicates.append((source, md5))
+                new_md5s.add(md5)
+                to_create.append((source, md5))
+            elif previous_import['file_resource']['upload_status'] \
+                 == 'complete':
+                completed.append(previous_import)
+            else:
+                to_upload.append((source, previous_import))
+
+        if duplicates:
+            raise DuplicateFileError(
+                'ERROR! %s file(s) have the same content as existing '\
+                'files or as other files being imported: "%s". '\
+                'Use "--force-duplicates" if you want to create '\
+                'another copy.' % (
+                    len(duplicates),
+                    '", "'.join(['%s$%s' % (source.get_url(), md5)
+                                 for (source, md5) in duplicates])))
+        if completed:
+            self.logger.info('Skipping %s file(s) already imported.'
+                             % len(completed))
+
+        for (i, batch) in enumerate(
+                self._get_batches(to_create, self.CREATE_BATCH_SIZE)):
+            file_data_objects = self.connection.post_data_objects_in_bulk(
+                [self._get_file_data_object_for_import(source, md5, note)
+                 for (source, md5) in batch])
+            for ((source, md5), file_data_object) in zip(
+                    batch, file_data_objects):
+                if file_data_object['file_resource']['upload_status'] \
+                   == 'complete':
+                    # Server already has a file with this content
+                    completed.append(file_data_object)
+                else:
+                    to_upload.append((source, file_data_object))
+            self._log_progress(
+                'Created', min((i+1)*self.CREATE_BATCH_SIZE, len(to_create)),
+                len(to_create))
+
+        completed.extend(self._upload_in_parallel(to_upload))
+        return completed
+
+    def _calculate_md5s_in_parallel(self, sources):
+        # Local files are hashed in separate processes to use all CPUs.
+        # Other sources report an md5 from metadata, so threads suffice.
+        md5s = [None] * len(sources)
+        local_indexes = [i for (i, source) in enumerate(sources)
+                         if source.type == 'local']
+        other_indexes = [i for (i, source) in enumerate(sources)
+                         if source.type != 'local']
+        self.logger.info('Calculating md5 on %s file(s)...' % len(sources))
+        count = 0
+        if local_indexes:
+            pool = multiprocessing.Pool(self.HASH_PROCESSES)
+            try:
+                for (i, md5) in zip(local_indexes, pool.imap(
+                        md5calc.calculate_md5sum,
+                        [sources[i].get_path() for i in local_indexes])):
+                    md5s[i] = md5
+                    count += 1
+                    self._log_progress('Hashed', count, len(sources))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        if other_indexes:
+            pool = ThreadPool(self.UPLOAD_THREADS)
+            try:
+                for (i, md5) in zip(other_indexes, pool.imap(
+                        lambda i: sources[i].calculate_md5(),
+                        other_indexes)):
+                    md5s[i] = md5
+                    count += 1
+                    self._log_progress('Hashed', count, len(sources))
+            finally:
+                pool.close()
+                pool.join()
+        return md5s
+
+    def _get_files_by_md5(self, md5s):
+        matches = {}
+        for batch in self._get_batches(
+                sorted(set(md5s)), self.MD5_QUERY_BATCH_SIZE):
+            matches.update(self.connection.get_file_data_objects_by_md5(batch))
+        return matches
+
+    def _get_previous_import(self, source, md5, files):
+        # A file imported earlier from the same source with the same
+        # content, e.g. by an interrupted batch import
+        for file in files:
+            file_import = file.get('file_import') or {}
+            if file.get('source_type') == 'imported' \
+               and file_import.get('source_url') == source.get_url() \
+               and file.get('filename') == source.get_filename() \
+               and file.get('file_resource'):
+                return file
+        return None
+
+    def _get_file_data_object_for_import(self, source, md5, note):
+        return {
+            'type': 'file',
+            'filename': source.get_filename(),
+            'md5': md5,
+            'file_import': {
+                'source_url': source.get_url(),
+                'note': note },
+            'source_type': 'imported',
+        }
+
+    def _upload_in_parallel(self, to_upload):
+        if not to_upload:
+            return []
+        self.logger.info('Uploading %s file(s)...' % len(to_upload))
+        completed = []
+        confirmed_count = 0
+        failures = []
+        pool = ThreadPool(self.UPLOAD_THREADS)
+        try:
+            for (i, (file_data_object, error)) in enumerate(
+                    pool.imap_unordered(self._upload, to_upload)):
+                if error is None:
+                    completed.append(file_data_object)
+                else:
+                    failures.append((file_data_object, error))
+                if len(completed) - confirmed_count \
+                   >= self.CONFIRM_BATCH_SIZE:
+                    self._confirm_uploads(completed[confirmed_count:])
+                    confirmed_count = len(completed)
+                self._log_progress('Uploaded', i+1, len(to_upload))
+        finally:
+            pool.close()
+            pool.join()
+            self._confirm_uploads(completed[confirmed_count:])
+            if failures:
+                self.connection.set_upload_status_in_bulk(
+                    [file_data_object['file_resource']['uuid']
+                     for (file_data_object, error) in failures],
+                    'failed')
+        if failures:
+            raise FileUploadError(
+                'ERROR! %s of %s upload(s) failed. Run the same import '\
+                'again to retry them.\n%s' % (
+                    len(failures), len(to_upload),
+                    '\n'.join(['%s: %s' % (
+                        file_data_object['file_import']['source_url'], error)
+                                for (file_data_object, error) in failures])))
+        return completed
+
+    def _upload(self, args):
+        # Runs in a worker thread. Errors are returned rather than
+        # raised so that other uploads can continue.
+        (source, file_data_object) = args
+        try:
+            destination = Destination(
+                file_data_object['file_resource']['file_url'],
+                self.settings)
+            source.copy_to(destination)
+        except ApplicationDefaultCredentialsError:
+            return (file_data_object,
+                    'Google Cloud application default credentials are '\
+                    'not set. Please run "gcloud auth application-default '\
+                    'login"')
+        except Exception as e:
+            return (file_data_object, str(e) or e.__class__.__name__)
+        return (file_data_object, None)
+
+    def _confirm_uploads(self, file_data_objects):
+        if not file_data_objects:
+            return
+        self.connection.set_upload_status_in_bulk(
+            [file_data_object['file_resource']['uuid']
+             for file_data_object in file_data_objects],
+            'complete')
+        for file_data_object in file_data_objects:
+            file_data_object['file_resource']['upload_status'] = 'complete'
+
+    def _get_batches(self, items, batch_size):
+        for i in range(0, len(items), batch_size):
+            yield items[i:i+batch_size]
+
+    def _log_progress(self, action, count, total):
+        if count == total or count % self.PROGRESS_INTERVAL == 0:
+            self.logger.info('   %s %s/%s files' % (action, count, total))
+
+    def import_result_file(self, task_attempt_output, source_url, move=False):
+        """If move is True, a local result file is moved into local
+        storage rather than copied.
+        """
         source = Source(source_url, self.settings)
-        md5 = source.calculate_md5()
+        if self._can_calculate_md5_during_import(source):
+            md5 = ''
+        else:
+            self.logger.info('Calculating md5 on file "%s"...' % source_url)
+            md5 = source.calculate_md5()
 
         file_data_object = self._execute_file_import(
             self._create_task_attempt_output_file(task_attempt_output, md5),
-            source_url
+            source_url,
+            move=move,
         )
         return file_data_object
 
@@ -531,13 +1488,15 @@ class FileManager:
         log_file = self.connection.post_task_attempt_log_file(
             task_attempt['uuid'], {'log_name': log_name})
 
-        self.logger.info('Calculating md5 on file "%s"...' % source_url)
         source = Source(source_url, self.settings)
-        md5 = source.calculate_md5()
-
         file_data_object = self.connection.get_data_object(log_file['file']['uuid'])
 
         assert not file_data_object.get('md5')
+        if self._can_calculate_md5_during_import(source):
+            return self._execute_file_import(file_data_object, source_url)
+
+        self.logger.info('Calculating md5 on file "%s"...' % source_url)
+        md5 = source.calculate_md5()
         file_data_object.update({'md5': md5,
                                  'filename': log_name})
         file_data_object['file_resource'].update({'md5': md5})
@@ -551,7 +1510,7 @@ class FileManager:
             source_url
         )
 
-    def _execute_file_import(self, file_data_object, source_url):
+    def _execute_file_import(self, file_data_object, source_url, move=False):
         # A new file_data_object will typically have a file_resource with 
         # status=incomplete
         # If the server is configured not to save multiple files with
@@ -572,9 +1531,21 @@ class FileManager:
             destination = Destination(
                 file_data_object['file_resource']['file_url'],
                 self.settings)
-            self.logger.info(
-                '   copying to destination %s ...' % destination.get_url())
-            source.copy_to(destination)
+            if move and source.type == 'local' \
+               and destination.type == 'local':
+                self.logger.info(
+                    '   moving to destination %s ...' % destination.get_url())
+                if not file_data_object.get('md5'):
+                    md5 = source.calculate_md5()
+                source.move_to(destination)
+            elif file_data_object.get('md5'):
+                self.logger.info(
+                    '   copying to destination %s ...' % destination.get_url())
+                source.copy_to(destination)
+            else:
+                self.logger.info(
+                    '   copying to destination %s ...' % destination.get_url())
+                md5 = source.copy_to_and_calculate_md5(destination)
         except ApplicationDefaultCredentialsError as e:
             self._set_upload_status(file_data_object, 'failed')
             raise SystemExit(
@@ -586,13 +1557,25 @@ class FileManager:
             raise e
 
         # Signal that the upload completed successfully
-        file_data_object = self._set_upload_status(
-            file_data_object, 'complete')
+        if file_data_object.get('md5'):
+            file_data_object = self._set_upload_status(
+                file_data_object, 'complete')
+        else:
+            self.connection.finalize_file_resource(
+                file_data_object['file_resource']['uuid'], md5)
+            file_data_object = self.connection.get_data_object(
+                file_data_object['uuid'])
         self.logger.info('   imported file %s@%s' % (
             file_data_object['filename'],
             file_data_object['uuid']))
         return file_data_object
 
+    def _can_calculate_md5_during_import(self, source):
+        # Hash while uploading so the file is only read once. This needs
+        # a local source and a server that accepts the md5 afterwards.
+        return source.type == 'local' \
+            and self.settings.get('FINALIZE_MD5_AFTER_UPLOAD', False)
+
     def _set_upload_status(self, file_data_object, upload_status):
         """ Set file_data_object.file_resource.upload_status
         """
@@ -615,6 +1598,76 @@ class FileManager:
         for file_id in file_ids:
             self.export_file(file_id, destination_url=destination_url)
 
+    def export_file_data_objects(self, file_data_objects, destination_url,
+                                 concurrency=1):
+        """Copy file data objects that have already been fetched from the
+        server into the directory destination_url, running up to
+        "concurrency" copies at once. Returns a list of
+        (file_data_object, destination_url, bytes, seconds) tuples.
+        """
+        return self.export_file_data_objects_to_urls(
+            self.get_export_destination_urls(
+                file_data_objects, destination_url),
+            concurrency=concurrency)
+
+    def get_export_destination_urls(self, file_data_objects, destination_url):
+        """Resolve the destination of each file in the directory
+        destination_url before anything is copied, so that files with the
+        same name are not assigned the same path. Returns a list of
+        (file_data_object, file_destination_url) tuples.
+        """
+        reserved = set()
+        jobs = []
+        for file_data_object in file_data_objects:
+            file_destination_url = self.get_destination_file_url(
+                destination_url, file_data_object['filename'],
+                reserved=reserved)
+            reserved.add(file_destination_url)
+            jobs.append((file_data_object, file_destination_url))
+        return jobs
+
+    def export_file_data_objects_to_urls(self, jobs, concurrency=1):
+        """Copy each file in a list of (file_data_object, destination_url)
+        tuples, running up to "concurrency" copies at once.
+        """
+        if not jobs:
+            return []
+        pool = ThreadPool(max(1, min(int(concurrency), len(jobs))))
+        try:
+            return pool.map(
+                lambda job: self._export_file_data_object(*job), jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _export_file_data_object(self, file_data_object, destination_url):
+        destination = Destination(destination_url, self.settings)
+        self.logger.info('Exporting file %s@%s to %s...' % (
+            file_data_object['filename'],
+            file_data_object['uuid'],
+            destination.get_url()))
+        start = time.time()
+        self._copy_file_data_object(file_data_object, destination)
+        seconds = time.time() - start
+        if destination.type == 'local':
+            size = os.path.getsize(destination.get_path())
+        else:
+            size = None
+        self.logger.info('...finished exporting file %s' % destination.get_url())
+        return (file_data_object, destination.get_url(), size, seconds)
+
+    def _copy_file_data_object(self, file_data_object, destination):
+        source = Source(file_data_object['file_resource']['file_url'],
+                        self.settings)
+        md5 = file_data_object['file_resource'].get('md5')
+        if self.cache is None or not md5 \
+           or source.type == 'local' or destination.type != 'local':
+            source.copy_to(destination)
+            return
+        self.cache.materialize(
+            md5, destination.get_path(),
+            lambda path: source.copy_to(Destination(path, self.settings)))
+
     def export_file(self, file_id, destination_url=None):
         # Error raised if there is not exactly one matching file.
         file_data_object = self.connection.get_file_data_object_index(query_string=file_id, max=1, min=1)[0]
@@ -623,37 +1676,34 @@ class FileManager:
             destination_url = os.getcwd()
         default_name = file_data_object['filename']
         destination_url = self.get_destination_file_url(destination_url, default_name)
-        destination = Destination(destination_url, self.settings)
-
-        self.logger.info('Exporting file %s@%s to %s...' % (file_data_object['filename'], file_data_object['uuid'], destination.get_url()))
-
-        # Copy from the first file location
-        source_url = file_data_object['file_resource']['file_url']
-        Source(source_url, self.settings).copy_to(destination)
-
-        self.logger.info('...finished exporting file')
+        self._export_file_data_object(file_data_object, destination_url)
 
-    def get_destination_file_url(self, requested_destination, default_name):
+    def get_destination_file_url(self, requested_destination, default_name,
+                                 reserved=()):
         """destination may be a file, a directory, or None
         This function accepts the specified file desitnation, 
-        or creates a sensible default that will not overwrite an existing file.
+        or creates a sensible default that will not overwrite an existing file
+        or any of the urls in "reserved".
         """
         if requested_destination is None:
             auto_destination = os.path.join(os.getcwd(), default_name)
-            destination = self._rename_to_avoid_overwrite(auto_destination)
+            destination = self._rename_to_avoid_overwrite(
+                auto_destination, reserved=reserved)
         elif Destination(requested_destination, self.settings).is_dir():
             auto_destination = os.path.join(requested_destination, default_name)
-            destination = self._rename_to_avoid_overwrite(auto_destination)
+            destination = self._rename_to_avoid_overwrite(
+                auto_destination, reserved=reserved)
         else:
             # Don't modify a file destination specified by the user, even if it overwrites something.
             destination = requested_destination
         return self.normalize_url(destination)
 
-    def _rename_to_avoid_overwrite(self, destination_path):
+    def _rename_to_avoid_overwrite(self, destination_path, reserved=()):
         root = destination_path
         destination = Destination(root, self.settings)
         counter = 0
-        while destination.exists():
+        while destination.exists() \
+              or self.normalize_url(destination_path) in reserved:
             counter += 1
             destination_path = '%s(%s)' % (root, counter)
             destination = Destination(destination_path, self.settings)
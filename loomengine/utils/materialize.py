@@ -0,0 +1,127 @@
+"""Strategies for placing a local file at a new local path without
+copying its bytes where the filesystem allows it.
+
+A policy is an ordered list of strategy names, tried in turn:
+
+  bind_mount  mount the stored file read-only into the task container.
+              Only TaskRunner can do this, so it must come first.
+  reflink     copy-on-write clone (FICLONE). Safe for any use, but only
+              on filesystems such as btrfs or xfs with reflink support.
+  hardlink    a second name for the same inode. The file is made
+              read-only first, since a write through either name would
+              change both.
+  copy        a full copy.
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+import stat
+
+
+STRATEGIES = ('bind_mount', 'reflink', 'hardlink', 'copy')
+DEFAULT_POLICY = ('reflink', 'copy')
+
+# ioctl request number for FICLONE (Linux >= 4.5), used to make a
+# copy-on-write clone of a file on btrfs, xfs, and other filesystems
+# that support reflinks.
+FICLONE = 0x40049409
+
+
+class MaterializationError(Exception):
+    pass
+
+
+def parse_policy(value):
+    """Parse a comma-separated policy like "reflink,hardlink,copy".
+    Blank or None gives DEFAULT_POLICY. "copy" is added at the end if it
+    is missing, so that every policy has a strategy that always works.
+    """
+    if not value:
+        return DEFAULT_POLICY
+    if isinstance(value, basestring):
+        value = value.split(',')
+    policy = tuple([name.strip().lower() for name in value if name.strip()])
+    unknown = [name for name in policy if name not in STRATEGIES]
+    if unknown:
+        raise MaterializationError(
+            'Unknown materialization strategies "%s". Choose from "%s"'
+            % ('", "'.join(unknown), '", "'.join(STRATEGIES)))
+    if 'bind_mount' in policy[1:]:
+        raise MaterializationError(
+            'Materialization strategy "bind_mount" must come first')
+    if 'copy' not in policy:
+        policy += ('copy',)
+    return policy
+
+
+def materialize(source_path, destination_path, policy=DEFAULT_POLICY):
+    """Place source_path at destination_path with the first strategy in
+    policy that works here, skipping bind_mount. Returns the name of the
+    strategy used.
+    """
+    _makedirs(os.path.dirname(destination_path))
+    for name in policy:
+        if name == 'bind_mount':
+            continue
+        try:
+            _strategies[name](source_path, destination_path)
+            return name
+        except (IOError, OSError) as e:
+            if name == 'copy' or not _is_unsupported_error(e):
+                raise
+            if os.path.exists(destination_path):
+                os.remove(destination_path)
+    raise MaterializationError(
+        'Could not materialize %s at %s with policy "%s"'
+        % (source_path, destination_path, ','.join(policy)))
+
+
+def move(source_path, destination_path):
+    """Move a file, which is a rename if both paths are on one filesystem.
+    """
+    _makedirs(os.path.dirname(destination_path))
+    shutil.move(source_path, destination_path)
+
+
+def reflink(source_path, destination_path):
+    with open(source_path, 'rb') as source:
+        with open(destination_path, 'wb') as destination:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+
+
+def hardlink(source_path, destination_path):
+    mode = os.stat(source_path).st_mode
+    read_only = mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    if mode != read_only:
+        os.chmod(source_path, read_only)
+    os.link(source_path, destination_path)
+
+
+def copy(source_path, destination_path):
+    shutil.copy(source_path, destination_path)
+
+
+_strategies = {
+    'reflink': reflink,
+    'hardlink': hardlink,
+    'copy': copy,
+}
+
+
+def _is_unsupported_error(e):
+    # Errors meaning "not possible here", as opposed to e.g. ENOENT or
+    # ENOSPC, which would fail for every strategy.
+    return e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EINVAL,
+                       errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+                       errno.ENOSYS, errno.EACCES)
+
+
+def _makedirs(directory):
+    # Tolerates other processes creating the same directory concurrently
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -1,11 +1,86 @@
 import hashlib
+import os
+import shutil
+
+# Large reads, in a multiple of the filesystem block size, keep the
+# number of system calls low on multi-GB files.
+BUFFER_SIZE = 1024*1024*8
 
 def calculate_md5sum(file_path):
     with open(file_path, 'rb') as f:
         m = hashlib.md5()
         while True:
-            data = f.read(8192)
+            data = f.read(BUFFER_SIZE)
             if not data:
                 break
             m.update(data)
     return m.hexdigest()
+
+def copy_and_calculate_md5sum(source_path, destination_path):
+    """Copy a file and return its md5, reading the source only once.
+    """
+    m = hashlib.md5()
+    with open(source_path, 'rb') as source:
+        with open(destination_path, 'wb') as destination:
+            while True:
+                data = source.read(BUFFER_SIZE)
+                if not data:
+                    break
+                m.update(data)
+                destination.write(data)
+    shutil.copymode(source_path, destination_path)
+    return m.hexdigest()
+
+
+class MD5Reader(object):
+    """Wraps a file opened for reading and calculates the md5 of the
+    bytes read through it, e.g. by an uploader.
+
+    The uploader may seek back and re-read a range, as when a chunk is
+    retried. Bytes that have already been hashed are not hashed again.
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.md5 = hashlib.md5()
+        self.hashed_bytes = 0
+
+    def read(self, size=-1):
+        start = self.file_obj.tell()
+        data = self.file_obj.read(size)
+        if start > self.hashed_bytes:
+            raise Exception(
+                'Cannot calculate md5 because bytes %s to %s were skipped'
+                % (self.hashed_bytes, start))
+        end = start + len(data)
+        if end > self.hashed_bytes:
+            self.md5.update(data[self.hashed_bytes - start:])
+            self.hashed_bytes = end
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file_obj.seek(offset, whence)
+
+    def hash_until(self, offset):
+        """Hash bytes up to offset without moving the read position,
+        e.g. bytes sent before an interrupted upload was resumed.
+        """
+        position = self.file_obj.tell()
+        self.file_obj.seek(self.hashed_bytes)
+        while self.hashed_bytes < offset:
+            if not self.read(min(BUFFER_SIZE, offset - self.hashed_bytes)):
+                break
+        self.file_obj.seek(position)
+
+    def tell(self):
+        return self.file_obj.tell()
+
+    def fileno(self):
+        return self.file_obj.fileno()
+
+    def hexdigest(self):
+        if self.hashed_bytes != os.fstat(self.fileno()).st_size:
+            raise Exception(
+                'Cannot calculate md5 because only %s bytes were read'
+                % self.hashed_bytes)
+        return self.md5.hexdigest()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from loomengine.utils.checkpoint import TransferCheckpoint
+
+
+class TestTransferCheckpoint(unittest.TestCase):
+
+    key = {'source': 'gs://bucket/file.txt', 'size': 1000}
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'checkpoints', 'file.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testSaveAndLoad(self):
+        TransferCheckpoint(self.path, self.key).save(completed_chunks=[0, 2])
+        data = TransferCheckpoint(self.path, self.key).load()
+        self.assertEqual(data, {'completed_chunks': [0, 2]})
+
+    def testLoadIgnoresDifferentKey(self):
+        TransferCheckpoint(self.path, self.key).save(completed_chunks=[0, 2])
+        changed_key = dict(self.key, size=2000)
+        self.assertEqual(TransferCheckpoint(self.path, changed_key).load(), {})
+
+    def testLoadMissingOrCorrupt(self):
+        self.assertEqual(TransferCheckpoint(self.path, self.key).load(), {})
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{"key": ')
+        self.assertEqual(TransferCheckpoint(self.path, self.key).load(), {})
+
+    def testDelete(self):
+        checkpoint = TransferCheckpoint(self.path, self.key)
+        checkpoint.save(session_url='https://upload')
+        checkpoint.delete()
+        self.assertFalse(os.path.exists(self.path))
+        # Deleting again is not an error
+        checkpoint.delete()
+
+    def testInDirectory(self):
+        checkpoint1 = TransferCheckpoint.in_directory(self.tempdir, self.key)
+        checkpoint2 = TransferCheckpoint.in_directory(
+            self.tempdir, dict(self.key))
+        checkpoint3 = TransferCheckpoint.in_directory(
+            self.tempdir, dict(self.key, size=2000))
+        self.assertEqual(checkpoint1.path, checkpoint2.path)
+        self.assertNotEqual(checkpoint1.path, checkpoint3.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
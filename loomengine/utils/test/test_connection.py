@@ -1,6 +1,8 @@
+import requests
 import unittest
 
 from loomengine.utils import connection
+from loomengine.utils.exceptions import ServerConnectionError
 
 class MockResponse:
 
@@ -51,6 +53,85 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(self.connection.data, self.data)
 
 
+class TestConnectionRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = connection.Connection(
+            'root_url', retry_deadline_seconds=0.5)
+        self.connection.RETRY_INITIAL_DELAY_SECONDS = 0.01
+        self.calls = 0
+
+    def _fail_times(self, failures):
+        def query_function():
+            self.calls += 1
+            if self.calls <= failures:
+                raise requests.exceptions.ConnectionError('refused')
+            return MockResponse()
+        return query_function
+
+    def test_retry_until_success(self):
+        response = self.connection._make_request_to_server(
+            self._fail_times(2), raise_for_status=False)
+        self.assertTrue(isinstance(response, MockResponse))
+        self.assertEqual(self.calls, 3)
+
+    def test_retry_until_deadline(self):
+        with self.assertRaises(ServerConnectionError):
+            self.connection._make_request_to_server(
+                self._fail_times(1000), raise_for_status=False)
+        self.assertTrue(self.calls > 1)
+
+
+class MockPageResponse(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class MockPagedSession(object):
+    # Serves 'files/' in pages of 2 items
+
+    def __init__(self, items):
+        self.items = items
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(url)
+        if url.endswith('files/'):
+            start = 0
+        else:
+            start = int(url.split('cursor=')[1])
+        if start + 2 < len(self.items):
+            next_url = 'root_url/api/files/?cursor=%s' % (start + 2)
+        else:
+            next_url = None
+        return MockPageResponse({'next': next_url, 'previous': None,
+                                 'results': self.items[start:start+2]})
+
+
+class TestConnectionPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = connection.Connection('root_url')
+        self.connection.session = MockPagedSession(range(5))
+
+    def test_get_object_index_reads_all_pages(self):
+        self.assertEqual(self.connection._get_object_index('files/'),
+                         [0, 1, 2, 3, 4])
+        self.assertEqual(len(self.connection.session.requests), 3)
+
+    def test_get_object_index_stops_after_max(self):
+        self.assertEqual(
+            self.connection._get_object_index('files/', max=1), [0, 1])
+        self.assertEqual(len(self.connection.session.requests), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
                 
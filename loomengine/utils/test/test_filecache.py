@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from loomengine.utils.filecache import FileCache
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = FileCache(os.path.join(self.tempdir, 'cache'),
+                               max_bytes=10)
+        self.fetch_count = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _fetch(self, content):
+        def fetch(path):
+            self.fetch_count += 1
+            with open(path, 'w') as f:
+                f.write(content)
+        return fetch
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def testMaterialize(self):
+        destination = os.path.join(self.tempdir, 'work', 'a.txt')
+        self.cache.materialize('md5a', destination, self._fetch('aaaa'))
+        self.assertEqual(self._read(destination), 'aaaa')
+        self.assertEqual(self.fetch_count, 1)
+
+    def testMaterializeCachedFileIsNotFetchedAgain(self):
+        destination1 = os.path.join(self.tempdir, 'work1', 'a.txt')
+        destination2 = os.path.join(self.tempdir, 'work2', 'a.txt')
+        self.cache.materialize('md5a', destination1, self._fetch('aaaa'))
+        self.cache.materialize('md5a', destination2, self._fetch('aaaa'))
+        self.assertEqual(self._read(destination2), 'aaaa')
+        self.assertEqual(self.fetch_count, 1)
+
+    def testMaterializeNeverHardLinks(self):
+        cache = FileCache(os.path.join(self.tempdir, 'cache'), max_bytes=10,
+                          materialization_policy='hardlink,copy')
+        destination = os.path.join(self.tempdir, 'work', 'a.txt')
+        cache.materialize('md5a', destination, self._fetch('aaaa'))
+        self.assertEqual(cache.policy, ('copy',))
+        self.assertNotEqual(
+            os.stat(destination).st_ino,
+            os.stat(os.path.join(self.tempdir, 'cache', 'files', 'md5a')).st_ino)
+
+    def testEvictLeastRecentlyUsed(self):
+        self.cache.materialize('md5a', os.path.join(self.tempdir, 'a'),
+                               self._fetch('aaaaaa'))
+        os.utime(self.cache._get_cached_path('md5a'), (1, 1))
+        self.cache.materialize('md5b', os.path.join(self.tempdir, 'b'),
+                               self._fetch('bbbbbb'))
+        self.assertFalse(os.path.exists(self.cache._get_cached_path('md5a')))
+        self.assertTrue(os.path.exists(self.cache._get_cached_path('md5b')))
+        # Materialized copies survive eviction
+        self.assertEqual(self._read(os.path.join(self.tempdir, 'a')), 'aaaaaa')
+
+    def testFailedFetchLeavesNoEntry(self):
+        def fetch(path):
+            with open(path, 'w') as f:
+                f.write('partial')
+            raise Exception('fetch failed')
+        with self.assertRaises(Exception):
+            self.cache.materialize(
+                'md5a', os.path.join(self.tempdir, 'a'), fetch)
+        self.assertFalse(os.path.exists(self.cache._get_cached_path('md5a')))
+        self.assertEqual(os.listdir(self.cache.tmp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,484 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from loomengine.utils import filemanager
+from loomengine.utils.exceptions import DuplicateFileError
+
+
+class MockConnection(object):
+    # Records bulk requests made by FileManager.import_files_in_batch
+
+    def __init__(self, existing_files=()):
+        self.existing_files = list(existing_files)
+        self.created = []
+        self.upload_status = {}
+        self.md5_queries = 0
+
+    def get_file_data_objects_by_md5(self, md5_list):
+        self.md5_queries += 1
+        matches = dict((md5, []) for md5 in md5_list)
+        for file in self.existing_files:
+            if file['md5'] in matches:
+                matches[file['md5']].append(file)
+        return matches
+
+    def post_data_objects_in_bulk(self, data_objects):
+        for data_object in data_objects:
+            data_object['uuid'] = 'uuid-%s' % len(self.created)
+            data_object['file_resource'] = {
+                'uuid': 'resource-%s' % len(self.created),
+                'file_url': data_object['destination_url'],
+                'upload_status': 'incomplete'}
+            self.created.append(data_object)
+        return data_objects
+
+    def set_upload_status_in_bulk(self, file_resource_ids, upload_status):
+        for file_resource_id in file_resource_ids:
+            self.upload_status[file_resource_id] = upload_status
+        return {'count': len(file_resource_ids)}
+
+
+class MockFileManager(filemanager.FileManager):
+
+    HASH_PROCESSES = 2
+
+    def __init__(self, connection, destination_dir):
+        self.connection = connection
+        self.settings = {}
+        self.cache = None
+        self.logger = filemanager.logging.getLogger(__name__)
+        self.destination_dir = destination_dir
+
+    def _get_file_data_object_for_import(self, source, md5, note):
+        data_object = filemanager.FileManager._get_file_data_object_for_import(
+            self, source, md5, note)
+        data_object['destination_url'] = os.path.join(
+            self.destination_dir, source.get_filename())
+        return data_object
+
+
+class TestFileManagerBatchImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tempdir, 'source')
+        self.destination_dir = os.path.join(self.tempdir, 'destination')
+        os.mkdir(self.source_dir)
+        self.urls = []
+        for i in range(5):
+            path = os.path.join(self.source_dir, 'file%s.txt' % i)
+            with open(path, 'w') as f:
+                f.write('content %s\n' % i)
+            self.urls.append('file://' + path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testImportFilesInBatch(self):
+        connection = MockConnection()
+        manager = MockFileManager(connection, self.destination_dir)
+        files = manager.import_files_in_batch(self.urls, 'note')
+        self.assertEqual(len(files), 5)
+        self.assertEqual(connection.md5_queries, 1)
+        self.assertEqual(
+            sorted(connection.upload_status.values()), ['complete'] * 5)
+        self.assertEqual(
+            connection.created[0]['md5'],
+            hashlib.md5('content 0\n').hexdigest())
+        self.assertEqual(sorted(os.listdir(self.destination_dir)),
+                         ['file%s.txt' % i for i in range(5)])
+
+    def testImportFilesInBatchDuplicateError(self):
+        connection = MockConnection(existing_files=[{
+            'md5': hashlib.md5('content 3\n').hexdigest(),
+            'filename': 'other.txt',
+            'source_type': 'imported',
+            'file_import': {'source_url': 'file:///other.txt'}}])
+        manager = MockFileManager(connection, self.destination_dir)
+        with self.assertRaises(DuplicateFileError):
+            manager.import_files_in_batch(self.urls, 'note')
+        # Nothing is created if any file is a duplicate
+        self.assertEqual(connection.created, [])
+
+    def testImportFilesInBatchResume(self):
+        connection = MockConnection(existing_files=[
+            {'md5': hashlib.md5('content 0\n').hexdigest(),
+             'uuid': 'done',
+             'filename': 'file0.txt',
+             'source_type': 'imported',
+             'file_import': {'source_url': self.urls[0]},
+             'file_resource': {'uuid': 'done-resource',
+                               'upload_status': 'complete'}},
+            {'md5': hashlib.md5('content 1\n').hexdigest(),
+             'uuid': 'interrupted',
+             'filename': 'file1.txt',
+             'source_type': 'imported',
+             'file_import': {'source_url': self.urls[1]},
+             'file_resource': {
+                 'uuid': 'interrupted-resource',
+                 'file_url': os.path.join(self.destination_dir, 'file1.txt'),
+                 'upload_status': 'incomplete'}}])
+        manager = MockFileManager(connection, self.destination_dir)
+        files = manager.import_files_in_batch(self.urls, 'note')
+        self.assertEqual(len(files), 5)
+        self.assertEqual(len(connection.created), 3)
+        self.assertEqual(connection.upload_status['interrupted-resource'],
+                         'complete')
+        self.assertNotIn('done-resource', connection.upload_status)
+
+    def testImportFilesInBatchForceDuplicates(self):
+        connection = MockConnection(existing_files=[
+            {'md5': hashlib.md5('content 0\n').hexdigest(),
+             'uuid': 'done',
+             'filename': 'file0.txt',
+             'source_type': 'imported',
+             'file_import': {'source_url': self.urls[0]},
+             'file_resource': {'uuid': 'done-resource',
+                               'upload_status': 'complete'}}])
+        manager = MockFileManager(connection, self.destination_dir)
+        files = manager.import_files_in_batch(
+            self.urls, 'note', force_duplicates=True)
+        # A new copy is made even of the file imported before
+        self.assertEqual(len(files), 5)
+        self.assertEqual(len(connection.created), 5)
+        self.assertNotIn('done', [file['uuid'] for file in files])
+        self.assertEqual(connection.md5_queries, 0)
+
+
+class MemorySource(filemanager.AbstractSource):
+    # A storage backend that keeps files in a dict, for testing the registry
+
+    type = 'memory'
+    files = {}
+
+    def __init__(self, url, settings):
+        self.url = url
+
+    def calculate_md5(self):
+        return hashlib.md5(self.read()).hexdigest()
+
+    def get_url(self):
+        return self.url
+
+    def get_filename(self):
+        return os.path.basename(self.url)
+
+    def stat(self):
+        return {'size': len(self.read()), 'md5': None}
+
+    def read_range(self, start, end):
+        return self.read()[start:end+1]
+
+    def read(self):
+        return self.files[self.url]
+
+    def delete(self):
+        del self.files[self.url]
+
+
+class MemorySourceSet(filemanager.AbstractSourceSet):
+
+    def __init__(self, pattern, settings):
+        self.sources = [MemorySource(pattern, settings)]
+
+    def __iter__(self):
+        return self.sources.__iter__()
+
+
+class MemoryDestination(filemanager.AbstractDestination):
+
+    type = 'memory'
+
+    def __init__(self, url, settings):
+        self.url = url
+        self.settings = settings
+
+    def get_url(self):
+        return self.url
+
+    def exists(self):
+        return self.url in MemorySource.files
+
+    def is_dir(self):
+        return False
+
+    def write(self, content):
+        MemorySource.files[self.url] = content
+
+
+class Memory2LocalCopier(filemanager.AbstractCopier):
+
+    def copy(self):
+        self.destination.write(self.source.read())
+
+    def move(self):
+        self.copy()
+        self.source.delete()
+
+
+class Local2MemoryCopier(filemanager.AbstractCopier):
+
+    def copy(self):
+        self.destination.write(self.source.read())
+
+    def move(self):
+        self.copy()
+        self.source.delete()
+
+
+class TestStorageBackendRegistry(unittest.TestCase):
+
+    def setUp(self):
+        filemanager.register_storage_backend(
+            'memory', MemorySourceSet, MemorySource, MemoryDestination)
+        filemanager.register_copier('memory', 'local', Memory2LocalCopier)
+        filemanager.register_copier('local', 'memory', Local2MemoryCopier)
+        MemorySource.files['memory://a.txt'] = 'some content'
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        del filemanager._storage_backends['memory']
+        del filemanager._copiers[('memory', 'local')]
+        del filemanager._copiers[('local', 'memory')]
+        MemorySource.files.clear()
+        shutil.rmtree(self.tempdir)
+
+    def testFactoriesUseRegisteredBackend(self):
+        self.assertIsInstance(
+            filemanager.Source('memory://a.txt', {}), MemorySource)
+        self.assertIsInstance(
+            filemanager.Destination('memory://b.txt', {}), MemoryDestination)
+        self.assertIsInstance(
+            list(filemanager.SourceSet('memory://a.txt', {}))[0], MemorySource)
+        self.assertIsInstance(
+            filemanager.Source(os.path.join(self.tempdir, 'a.txt'), {}),
+            filemanager.LocalSource)
+
+    def testUnknownSchemeError(self):
+        with self.assertRaises(Exception):
+            filemanager.Source('unknown://a.txt', {})
+
+    def testCopyWithRegisteredCopier(self):
+        path = os.path.join(self.tempdir, 'a.txt')
+        filemanager.Source('memory://a.txt', {}).copy_to(
+            filemanager.Destination(path, {}))
+        with open(path) as f:
+            self.assertEqual(f.read(), 'some content')
+
+    def testCopyStagedThroughLocalFile(self):
+        # No memory-to-memory copier is registered
+        copier = filemanager.Copier(
+            filemanager.Source('memory://a.txt', {}),
+            filemanager.Destination('memory://b.txt', {}))
+        self.assertIsInstance(copier, filemanager.StagedCopier)
+        copier.copy()
+        self.assertEqual(MemorySource.files['memory://b.txt'], 'some content')
+
+    def testReadRange(self):
+        path = os.path.join(self.tempdir, 'a.txt')
+        with open(path, 'w') as f:
+            f.write('0123456789')
+        source = filemanager.Source(path, {})
+        self.assertEqual(source.read_range(2, 5), '2345')
+        self.assertEqual(source.stat()['size'], 10)
+
+
+class MockBlob(object):
+
+    def __init__(self, name, md5, size):
+        self.name = name
+        self._properties = {
+            'name': name,
+            'md5Hash': md5.decode('hex').encode('base64').strip(),
+            'size': str(size)}
+
+
+class MockBucket(object):
+    # Bucket listing for GoogleStorageSourceSet. Blobs are never fetched
+    # one at a time.
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.prefixes = []
+
+    def list_blobs(self, prefix=None):
+        self.prefixes.append(prefix)
+        return [blob for blob in self.blobs if blob.name.startswith(prefix)]
+
+    def get_blob(self, blob_id):
+        raise AssertionError('Unexpected request for blob %s' % blob_id)
+
+
+class TestGoogleStorageSourceSet(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = MockBucket([
+            MockBlob('data/a.txt', hashlib.md5('a').hexdigest(), 1),
+            MockBlob('data/b.txt', hashlib.md5('bb').hexdigest(), 2),
+            MockBlob('data/c.dat', hashlib.md5('ccc').hexdigest(), 3),
+            MockBlob('data/sub/', hashlib.md5('').hexdigest(), 0),
+            MockBlob('other/d.txt', hashlib.md5('d').hexdigest(), 1)])
+        self.original_get_gcs_bucket = filemanager._get_gcs_bucket
+        filemanager._get_gcs_bucket = lambda settings, bucket_id: self.bucket
+        self.settings = {'GCE_PROJECT': 'project'}
+
+    def tearDown(self):
+        filemanager._get_gcs_bucket = self.original_get_gcs_bucket
+
+    def _get_urls(self, pattern):
+        return [source.get_url() for source in
+                filemanager.SourceSet(pattern, self.settings)]
+
+    def testWildcard(self):
+        self.assertEqual(self._get_urls('gs://bucket/data/*.txt'),
+                         ['gs://bucket/data/a.txt', 'gs://bucket/data/b.txt'])
+        self.assertEqual(self.bucket.prefixes, ['data/'])
+
+    def testPrefix(self):
+        self.assertEqual(self._get_urls('gs://bucket/data/'),
+                         ['gs://bucket/data/a.txt', 'gs://bucket/data/b.txt',
+                          'gs://bucket/data/c.dat'])
+
+    def testMetadataFromListing(self):
+        source = list(filemanager.SourceSet(
+            'gs://bucket/data/b*', self.settings))[0]
+        self.assertEqual(source.calculate_md5(), hashlib.md5('bb').hexdigest())
+        self.assertEqual(source.stat(),
+                         {'size': 2, 'md5': hashlib.md5('bb').hexdigest()})
+
+
+class MockRewriteConnection(object):
+    # Finishes a rewrite after "calls" requests
+
+    def __init__(self, calls, resource):
+        self.calls = calls
+        self.resource = resource
+        self.requests = []
+
+    def api_request(self, method, path, query_params=None, data=None):
+        self.requests.append((path, dict(query_params)))
+        if len(self.requests) < self.calls:
+            return {'done': False,
+                    'rewriteToken': 'token%s' % len(self.requests)}
+        return {'done': True, 'resource': self.resource}
+
+
+class MockGoogleStorageObject(object):
+
+    def __init__(self, url, name, crc32c, connection=None):
+        self.url = url
+        self.blob = filemanager.gcloud.storage.blob.Blob(
+            name, MockPathBucket())
+        self.blob._set_properties({'crc32c': crc32c})
+        self.client = MockClient(connection)
+
+    def get_url(self):
+        return self.url
+
+
+class MockPathBucket(object):
+
+    path = '/b/bucket'
+
+
+class MockClient(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+
+class TestGoogleStorageCopier(unittest.TestCase):
+
+    def testRewriteContinuesWithToken(self):
+        connection = MockRewriteConnection(3, {'crc32c': 'abc='})
+        source = MockGoogleStorageObject(
+            'gs://bucket/a', 'a', 'abc=', connection)
+        destination = MockGoogleStorageObject('gs://bucket/b', 'b', None)
+        filemanager.GoogleStorageCopier(source, destination).copy()
+        self.assertEqual(
+            [query_params for (path, query_params) in connection.requests],
+            [{}, {'rewriteToken': 'token1'}, {'rewriteToken': 'token2'}])
+        self.assertEqual(connection.requests[0][0],
+                         '/b/bucket/o/a/rewriteTo/b/bucket/o/b')
+        self.assertEqual(destination.blob.crc32c, 'abc=')
+
+    def testRewriteIntegrityCheck(self):
+        connection = MockRewriteConnection(1, {'crc32c': 'xyz='})
+        source = MockGoogleStorageObject(
+            'gs://bucket/a', 'a', 'abc=', connection)
+        destination = MockGoogleStorageObject('gs://bucket/b', 'b', None)
+        with self.assertRaises(Exception):
+            filemanager.GoogleStorageCopier(source, destination).copy()
+
+
+@unittest.skipUnless(filemanager.crcmod, 'crcmod is not installed')
+class TestHashingStream(unittest.TestCase):
+
+    def testCrc32c(self):
+        stream = filemanager._HashingStream()
+        stream.write('123')
+        stream.write('456789')
+        # Check value for crc-32c
+        self.assertEqual(stream.get_crc32c(),
+                         '\xe3\x06\x92\x83'.encode('base64').strip())
+        self.assertEqual(stream.md5.hexdigest(),
+                         hashlib.md5('123456789').hexdigest())
+
+
+@unittest.skipUnless(os.getenv('LOOM_TEST_S3_ENDPOINT_URL')
+                     and os.getenv('LOOM_TEST_S3_BUCKET'),
+                     'Set LOOM_TEST_S3_ENDPOINT_URL and LOOM_TEST_S3_BUCKET '\
+                     'to test against an S3-compatible server, e.g. MinIO. '\
+                     'Credentials are read from AWS_ACCESS_KEY_ID and '\
+                     'AWS_SECRET_ACCESS_KEY.')
+class TestS3Backend(unittest.TestCase):
+
+    content = 'some file content\n' * 1000
+
+    def setUp(self):
+        self.settings = {
+            'S3_ENDPOINT_URL': os.getenv('LOOM_TEST_S3_ENDPOINT_URL')}
+        self.prefix = 's3://%s/loom-test-%s/' % (
+            os.getenv('LOOM_TEST_S3_BUCKET'), uuid.uuid4())
+        self.tempdir = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.tempdir, 'source.txt')
+        with open(self.local_path, 'w') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        for source in filemanager.SourceSet(self.prefix + '*', self.settings):
+            source.delete()
+        shutil.rmtree(self.tempdir)
+
+    def testUploadStatReadAndDownload(self):
+        url = self.prefix + 'file.txt'
+        md5 = filemanager.Source(self.local_path, self.settings)\
+                         .copy_to_and_calculate_md5(
+                             filemanager.Destination(url, self.settings))
+        self.assertEqual(md5, hashlib.md5(self.content).hexdigest())
+
+        source = filemanager.Source(url, self.settings)
+        self.assertEqual(source.stat(),
+                         {'size': len(self.content), 'md5': md5})
+        self.assertEqual(source.read_range(5, 8), self.content[5:9])
+
+        download_path = os.path.join(self.tempdir, 'download.txt')
+        source.copy_to(filemanager.Destination(download_path, self.settings))
+        with open(download_path) as f:
+            self.assertEqual(f.read(), self.content)
+
+    def testListWithWildcard(self):
+        for name in ['a.txt', 'b.txt', 'c.dat']:
+            filemanager.Destination(
+                self.prefix + name, self.settings).write(name)
+        urls = sorted([source.get_url() for source in filemanager.SourceSet(
+            self.prefix + '*.txt', self.settings)])
+        self.assertEqual(urls, [self.prefix + 'a.txt', self.prefix + 'b.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from loomengine.utils import materialize
+
+
+class TestParsePolicy(unittest.TestCase):
+
+    def testDefault(self):
+        self.assertEqual(materialize.parse_policy(None),
+                         materialize.DEFAULT_POLICY)
+        self.assertEqual(materialize.parse_policy(''),
+                         materialize.DEFAULT_POLICY)
+
+    def testParse(self):
+        self.assertEqual(materialize.parse_policy(' Reflink, hardlink,copy'),
+                         ('reflink', 'hardlink', 'copy'))
+
+    def testCopyIsAlwaysLast(self):
+        self.assertEqual(materialize.parse_policy('bind_mount,hardlink'),
+                         ('bind_mount', 'hardlink', 'copy'))
+
+    def testUnknownStrategy(self):
+        with self.assertRaises(materialize.MaterializationError):
+            materialize.parse_policy('reflink,symlink')
+
+    def testBindMountMustComeFirst(self):
+        with self.assertRaises(materialize.MaterializationError):
+            materialize.parse_policy('reflink,bind_mount')
+
+
+class TestMaterialize(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tempdir, 'source.txt')
+        with open(self.source, 'w') as f:
+            f.write('some content')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def testCopy(self):
+        destination = os.path.join(self.tempdir, 'a', 'b', 'copy.txt')
+        self.assertEqual(
+            materialize.materialize(self.source, destination, ('copy',)),
+            'copy')
+        self.assertEqual(self._read(destination), 'some content')
+        self.assertNotEqual(os.stat(self.source).st_ino,
+                            os.stat(destination).st_ino)
+
+    def testHardlinkMakesSourceReadOnly(self):
+        destination = os.path.join(self.tempdir, 'link.txt')
+        self.assertEqual(
+            materialize.materialize(self.source, destination, ('hardlink',)),
+            'hardlink')
+        self.assertEqual(os.stat(self.source).st_ino,
+                         os.stat(destination).st_ino)
+        self.assertFalse(os.stat(self.source).st_mode & stat.S_IWUSR)
+
+    def testFallsBackWhenUnsupported(self):
+        def unsupported(source_path, destination_path):
+            raise OSError(errno.EOPNOTSUPP, 'not supported')
+        original = materialize._strategies['reflink']
+        materialize._strategies['reflink'] = unsupported
+        try:
+            destination = os.path.join(self.tempdir, 'fallback.txt')
+            self.assertEqual(
+                materialize.materialize(
+                    self.source, destination, ('reflink', 'copy')),
+                'copy')
+            self.assertEqual(self._read(destination), 'some content')
+        finally:
+            materialize._strategies['reflink'] = original
+
+    def testMissingSourceIsNotRetried(self):
+        with self.assertRaises(IOError):
+            materialize.materialize(
+                os.path.join(self.tempdir, 'missing.txt'),
+                os.path.join(self.tempdir, 'destination.txt'),
+                ('reflink', 'copy'))
+
+    def testBindMountIsSkipped(self):
+        destination = os.path.join(self.tempdir, 'copy.txt')
+        self.assertEqual(
+            materialize.materialize(
+                self.source, destination, ('bind_mount', 'copy')),
+            'copy')
+
+    def testMove(self):
+        destination = os.path.join(self.tempdir, 'moved', 'source.txt')
+        materialize.move(self.source, destination)
+        self.assertFalse(os.path.exists(self.source))
+        self.assertEqual(self._read(destination), 'some content')
+
+
+if __name__ == '__main__':
+    unittest.main()
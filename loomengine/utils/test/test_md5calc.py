@@ -0,0 +1,62 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from loomengine.utils import md5calc
+
+
+class TestMd5calc(unittest.TestCase):
+
+    content = 'some file content\n' * 1000
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.tempdir, 'source.txt')
+        with open(self.source_path, 'w') as f:
+            f.write(self.content)
+        self.md5 = hashlib.md5(self.content).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testCopyAndCalculateMd5sum(self):
+        destination_path = os.path.join(self.tempdir, 'destination.txt')
+        md5 = md5calc.copy_and_calculate_md5sum(
+            self.source_path, destination_path)
+        self.assertEqual(md5, self.md5)
+        with open(destination_path) as f:
+            self.assertEqual(f.read(), self.content)
+
+    def testMD5ReaderWithRewind(self):
+        with open(self.source_path, 'rb') as f:
+            reader = md5calc.MD5Reader(f)
+            reader.read(5000)
+            # Re-reading a range, as on a retried chunk, is not hashed twice
+            reader.seek(1000)
+            while reader.read(4096):
+                pass
+            self.assertEqual(reader.hexdigest(), self.md5)
+
+    def testMD5ReaderHashUntil(self):
+        with open(self.source_path, 'rb') as f:
+            reader = md5calc.MD5Reader(f)
+            # As when resuming an upload from byte 7000
+            reader.seek(7000)
+            reader.hash_until(7000)
+            self.assertEqual(reader.tell(), 7000)
+            while reader.read(4096):
+                pass
+            self.assertEqual(reader.hexdigest(), self.md5)
+
+    def testMD5ReaderIncompleteRead(self):
+        with open(self.source_path, 'rb') as f:
+            reader = md5calc.MD5Reader(f)
+            reader.read(100)
+            with self.assertRaises(Exception):
+                reader.hexdigest()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import errno
+import os
+import time
+
+from loomengine.utils.filelock import FileLock
+
+
+class HostHeartbeat(object):
+    """Sends heartbeats for all task runners on this host in one request.
+
+    Task runners on one host share heartbeat_dir. On each beat, a runner
+    touches its own file there. Then, if no request has been sent in the
+    last interval, it sends one for every runner whose file was touched
+    recently. So the server gets about one request per interval from
+    each host, however many task runners are on it.
+    """
+
+    LOCK_FILE = '.lock'
+    SENT_FILE = '.sent'
+    # A runner is still alive if it touched its file this recently,
+    # as a multiple of the interval
+    ALIVE_INTERVALS = 1.5
+    # Files left by runners that exited without stop() are removed
+    # after this many intervals
+    STALE_INTERVALS = 10
+
+    def __init__(self, connection, heartbeat_dir, task_attempt_id,
+                 interval_seconds, logger):
+        self.connection = connection
+        self.heartbeat_dir = heartbeat_dir
+        self.task_attempt_id = task_attempt_id
+        self.interval_seconds = interval_seconds
+        self.logger = logger
+
+    def beat(self):
+        # The lock also creates heartbeat_dir if needed
+        with FileLock(self._get_path(self.LOCK_FILE)):
+            self._touch(self._get_path(self.task_attempt_id))
+            # Slightly less than the interval, so that the runner that
+            # sent the last request will send the next one on time
+            if time.time() - self._get_mtime(self.SENT_FILE) \
+               < 0.9 * self.interval_seconds:
+                return
+            task_attempt_ids = self._get_alive_task_attempt_ids()
+            try:
+                self.connection.post_task_attempt_heartbeats(task_attempt_ids)
+            except Exception as e:
+                # Another runner will try again on its next beat
+                self.logger.warning('Failed to send heartbeats: %s' % str(e))
+                return
+            self._touch(self._get_path(self.SENT_FILE))
+        self.logger.debug('Sent heartbeats for %s task attempts'
+                          % len(task_attempt_ids))
+
+    def stop(self):
+        try:
+            os.remove(self._get_path(self.task_attempt_id))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _get_alive_task_attempt_ids(self):
+        now = time.time()
+        task_attempt_ids = []
+        for filename in os.listdir(self.heartbeat_dir):
+            if filename.startswith('.'):
+                continue
+            age = now - self._get_mtime(filename)
+            if age < self.ALIVE_INTERVALS * self.interval_seconds:
+                task_attempt_ids.append(filename)
+            elif age > self.STALE_INTERVALS * self.interval_seconds:
+                try:
+                    os.remove(self._get_path(filename))
+                except OSError:
+                    pass
+        return task_attempt_ids
+
+    def _get_path(self, filename):
+        return os.path.join(self.heartbeat_dir, filename)
+
+    def _get_mtime(self, filename):
+        try:
+            return os.path.getmtime(self._get_path(filename))
+        except OSError:
+            return 0
+
+    def _touch(self, path):
+        with open(path, 'a'):
+            os.utime(path, None)
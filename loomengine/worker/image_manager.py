@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import argparse
+import docker
+import hashlib
+import os
+import time
+
+from loomengine.utils.filelock import FileLock
+from loomengine.utils.logger import get_stdout_logger
+
+
+class ContainerPullError(Exception):
+    pass
+
+
+class ImageManager(object):
+    """Makes docker images available on this host with as few pulls as
+    possible.
+
+    An image is not pulled if it is already local, unless its tag is
+    "latest" and it was not pulled in the last PULL_FRESHNESS_SECONDS.
+    Task runners on one host share lock_dir, so only one of them pulls a
+    given image at a time. The others wait for that pull to finish and
+    then use the image.
+    """
+
+    DOCKER_SOCKET = 'unix://var/run/docker.sock'
+    PULL_FRESHNESS_SECONDS = 300
+    # Log progress of a layer at most this often
+    PROGRESS_INTERVAL_SECONDS = 10
+
+    def __init__(self, docker_client, lock_dir, logger):
+        self.docker_client = docker_client
+        self.lock_dir = lock_dir
+        self.logger = logger
+
+    def get_image(self, image, progress_callback=None):
+        """Pull image if needed. Returns the local image id.
+        progress_callback, if given, is called with each progress message
+        from the pull.
+        """
+        image = self.normalize_image(image)
+        if self._is_ready(image):
+            self.logger.info('Using local image %s' % image)
+            return self.get_local_image_id(image)
+        with self._lock(image):
+            # Another process may have pulled it while we waited
+            if not self._is_ready(image):
+                self._pull(image, progress_callback)
+                self._mark_pulled(image)
+            else:
+                self.logger.info('Image %s was pulled by another process'
+                                 % image)
+        return self.get_local_image_id(image)
+
+    @classmethod
+    def normalize_image(cls, image):
+        # Tag is required. Otherwise docker-py pull will download all tags.
+        if '@' in image or ':' in image.split('/')[-1]:
+            return image
+        return image + ':latest'
+
+    def get_local_image_id(self, image):
+        try:
+            return self.docker_client.inspect_image(image)['Id']
+        except docker.errors.NotFound:
+            return None
+
+    def _is_ready(self, image):
+        if self.get_local_image_id(image) is None:
+            return False
+        if '@' in image or not image.endswith(':latest'):
+            # Pinned by digest or a specific tag
+            return True
+        # "latest" may have moved. Check again unless recently pulled.
+        return time.time() - self._get_pull_time(image) \
+            < self.PULL_FRESHNESS_SECONDS
+
+    def _pull(self, image, progress_callback=None):
+        self.logger.info('Pulling image %s' % image)
+        if '@' in image:
+            (repository, tag) = (image, None)
+        else:
+            (repository, tag) = image.rsplit(':', 1)
+        last_logged = {}
+        # Progress is read as it streams rather than all at once
+        for data in self.docker_client.pull(
+                repository, tag=tag, stream=True, decode=True):
+            if data.get('error') or data.get('errorDetail'):
+                raise ContainerPullError(
+                    data.get('errorDetail') or data.get('error'))
+            message = self._format_progress(data)
+            if progress_callback is not None:
+                progress_callback(message)
+            layer = data.get('id')
+            if not data.get('progressDetail') or time.time() \
+               - last_logged.get(layer, 0) > self.PROGRESS_INTERVAL_SECONDS:
+                last_logged[layer] = time.time()
+                self.logger.debug(message)
+        self.logger.info('Pulled image %s' % image)
+
+    def _format_progress(self, data):
+        return ' '.join([str(data[key]) for key in
+                         ['id', 'status', 'progress'] if data.get(key)])
+
+    def _get_lock_path(self, image, extension):
+        return os.path.join(
+            self.lock_dir,
+            hashlib.sha1(image).hexdigest() + extension)
+
+    def _lock(self, image):
+        return FileLock(self._get_lock_path(image, '.lock'))
+
+    def _get_pull_time(self, image):
+        try:
+            return os.path.getmtime(self._get_lock_path(image, '.pulled'))
+        except OSError:
+            return 0
+
+    def _mark_pulled(self, image):
+        with open(self._get_lock_path(image, '.pulled'), 'w') as f:
+            f.write(image)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(__file__)
+    parser.add_argument('-i',
+                        '--image',
+                        required=True,
+                        help='Docker image to pull')
+    parser.add_argument('-d',
+                        '--lock_dir',
+                        required=True,
+                        help='Directory for locks shared by task runners '\
+                        'on this host')
+    parser.add_argument('-l',
+                        '--log_level',
+                        required=False,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        default='INFO',
+                        help='Log level')
+    return parser
+
+
+# pip entrypoint requires a function with no arguments
+def main():
+    """Pre-warm an image before the tasks that need it are started
+    """
+    args = get_parser().parse_args()
+    logger = get_stdout_logger(__name__, args.log_level)
+    manager = ImageManager(
+        docker.Client(base_url=ImageManager.DOCKER_SOCKET),
+        args.lock_dir, logger)
+    manager.get_image(args.image)
+
+if __name__=='__main__':
+    main()
@@ -5,7 +5,6 @@ import copy
 from datetime import datetime
 import docker
 import errno
-import json
 import os
 import requests
 import string
@@ -13,13 +12,18 @@ import subprocess
 import sys
 import threading
 import time
+import urlparse
 import uuid
 
 import loomengine.utils
+from loomengine.utils.filecache import FileCache
 from loomengine.utils.filemanager import FileManager
+from loomengine.utils import materialize
 from loomengine.utils.connection import Connection
 from loomengine.utils.logger import get_file_logger, get_stdout_logger
 from loomengine.utils.helper import init_directory
+from loomengine.worker.heartbeats import HostHeartbeat
+from loomengine.worker.image_manager import ImageManager
 
 
 class WorkerSettingsError(Exception):
@@ -28,9 +32,6 @@ class WorkerSettingsError(Exception):
 class ContainerStartError(Exception):
     pass
 
-class ContainerPullError(Exception):
-    pass
-
 class TaskAttemptNotFoundError(Exception):
     pass
 
@@ -45,9 +46,24 @@ class TaskRunner(object):
 
     DOCKER_SOCKET = 'unix://var/run/docker.sock'
     LOOM_RUN_SCRIPT_NAME = 'loom_run_script'
+    CONTAINER_DIR = '/loom_workspace'
+    # Buffered events are sent to the server with each heartbeat, on
+    # fail or finish, or when this many are waiting.
+    MAX_BUFFERED_EVENTS = 50
+    # If the connection to Docker drops while waiting for the container
+    WAIT_ATTEMPTS = 10
+    WAIT_RETRY_SECONDS = 5
+    # How long to wait for logs to finish streaming after the container
+    # exits, before fetching them whole instead
+    LOG_STREAM_TIMEOUT_SECONDS = 60
 
     def __init__(self, args=None, mock_connection=None, mock_filemanager=None):
         self.is_failed = False
+        self.events = []
+        self.input_mounts = []
+        self.log_stream_errors = []
+        self.events_lock = threading.Lock()
+        self.host_heartbeat = None
         if args is None:
             args = self._get_args()
         self.settings = {
@@ -82,8 +98,12 @@ class TaskRunner(object):
             if mock_filemanager is not None:
                 self.filemanager = mock_filemanager
             else:
-                self.filemanager = FileManager(self.settings['MASTER_URL'])
                 self.settings.update(self._get_worker_settings())
+                self.filemanager = FileManager(
+                    self.settings['MASTER_URL'],
+                    cache=self._get_input_cache(),
+                    materialization_policy=self.settings.get(
+                        'MATERIALIZATION_POLICY'))
                 self._init_docker_client()
                 self._init_working_dir()
         except Exception as e:
@@ -114,6 +134,15 @@ class TaskRunner(object):
             raise WorkerSettingsError('Worker settings not found')
         return settings
 
+    def _get_input_cache(self):
+        max_gb = float(self.settings.get('INPUT_CACHE_SIZE_GB', 0))
+        if not self.settings.get('INPUT_CACHE_DIR') or max_gb <= 0:
+            return None
+        return FileCache(self.settings['INPUT_CACHE_DIR'],
+                         max_bytes=int(max_gb*1024*1024*1024),
+                         materialization_policy=self.settings.get(
+                             'MATERIALIZATION_POLICY'))
+
     def _init_docker_client(self):
         self.docker_client = docker.Client(base_url=self.DOCKER_SOCKET)
         self._verify_docker()
@@ -131,19 +160,35 @@ class TaskRunner(object):
 
     def run_with_heartbeats(self, function):
         heartbeat_interval = int(self.settings['HEARTBEAT_INTERVAL_SECONDS'])
-        polling_interval = 1
+
+        self.host_heartbeat = self._get_host_heartbeat(heartbeat_interval)
 
         t = threading.Thread(target=function)
         t.start()
 
         self._send_heartbeat()
-        last_heartbeat = datetime.now()
+        last_heartbeat = time.time()
 
+        # Wakes when the next heartbeat is due or as soon as function returns
         while t.is_alive():
-            time.sleep(polling_interval)
-            if (datetime.now() - last_heartbeat).total_seconds() > heartbeat_interval:
+            t.join(max(0, last_heartbeat + heartbeat_interval - time.time()))
+            if t.is_alive():
                 self._send_heartbeat()
-                last_heartbeat = datetime.now()
+                last_heartbeat = time.time()
+
+        if self.host_heartbeat is not None:
+            self.host_heartbeat.stop()
+
+    def _get_host_heartbeat(self, heartbeat_interval):
+        # Older servers don't give a HEARTBEAT_DIR. Heartbeats are then
+        # sent as TaskAttempt events.
+        if not self.settings.get('HEARTBEAT_DIR'):
+            return None
+        return HostHeartbeat(self.connection,
+                             self.settings['HEARTBEAT_DIR'],
+                             self.settings['TASK_ATTEMPT_ID'],
+                             heartbeat_interval,
+                             self.logger)
 
     def main(self):
         run_error = None
@@ -209,16 +254,66 @@ class TaskRunner(object):
         if self.task_attempt.get('inputs') is None:
             self.logger.info('No inputs.')
             return
-        file_data_object_ids = []
+        # Inputs are rendered with their file_resource, so no need to
+        # look each one up again before copying.
+        file_data_objects = []
         for input in self.task_attempt['inputs']:
-            data_object = self.connection.get_data_object(input['data_object']['uuid'])
-            if data_object['type'] == 'file':
-                file_data_object_ids.append('@'+data_object['uuid'])
-        self.logger.debug('Copying inputs %s to %s.' % ( file_data_object_ids,
-                                                         self.settings['WORKING_DIR']))
-        self.filemanager.export_files(
-            file_data_object_ids,
-            destination_url=self.settings['WORKING_DIR'])
+            data_object = input['data_object']
+            if data_object['type'] != 'file':
+                continue
+            if data_object.get('is_array'):
+                # A gathered input. Each member is copied.
+                file_data_objects.extend(data_object['members'])
+            else:
+                file_data_objects.append(data_object)
+        self.logger.debug('Copying inputs %s to %s.' % (
+            ['@'+data_object['uuid'] for data_object in file_data_objects],
+            self.settings['WORKING_DIR']))
+        jobs = self.filemanager.get_export_destination_urls(
+            file_data_objects, self.settings['WORKING_DIR'])
+        if self._use_bind_mounts():
+            jobs = self._mount_local_inputs(jobs)
+        results = self.filemanager.export_file_data_objects_to_urls(
+            jobs,
+            concurrency=self.settings.get('INPUT_COPY_CONCURRENCY', 1))
+        for (data_object, destination_url, size, seconds) in results:
+            self._timepoint('Copied input file',
+                            detail=self._format_copy_stats(
+                                data_object, destination_url, size, seconds))
+
+    def _use_bind_mounts(self):
+        policy = materialize.parse_policy(
+            self.settings.get('MATERIALIZATION_POLICY'))
+        return policy[0] == 'bind_mount'
+
+    def _mount_local_inputs(self, jobs):
+        # Inputs already stored on this host are mounted read-only into
+        # the container instead of copied. Returns the jobs still to copy.
+        to_copy = []
+        for (data_object, destination_url) in jobs:
+            file_url = urlparse.urlparse(
+                data_object['file_resource']['file_url'])
+            if file_url.scheme != 'file':
+                to_copy.append((data_object, destination_url))
+                continue
+            host_path = file_url.path
+            relative_path = os.path.relpath(
+                urlparse.urlparse(destination_url).path,
+                self.settings['WORKING_DIR'])
+            self.input_mounts.append(
+                (host_path, os.path.join(self.CONTAINER_DIR, relative_path)))
+            self._timepoint('Mounted input file', detail='%s@%s from %s' % (
+                data_object['filename'], data_object['uuid'], host_path))
+        return to_copy
+
+    def _format_copy_stats(self, data_object, destination_url, size, seconds):
+        detail = '%s@%s to %s in %.1fs' % (
+            data_object['filename'], data_object['uuid'],
+            destination_url, seconds)
+        if size is not None and seconds > 0:
+            detail += ' (%s bytes, %.1f MB/s)' % (
+                size, size / seconds / (1024*1024))
+        return detail
 
     def _try_to_create_run_script(self):
         self.logger.info('Creating run script')
@@ -242,11 +337,10 @@ class TaskRunner(object):
         self._timepoint('Fetching image')
 
         try:
-            self._pull_image()
-            image_id = self.docker_client.inspect_image(self._get_docker_image())['Id']
+            image_id = self._pull_image()
             self._set_image_id(image_id)
             self.logger.info(
-                'Pulled image %s and received image id %s' % (
+                'Using image %s with image id %s' % (
                     self._get_docker_image(), image_id))
         except Exception as e:
             self._fail(
@@ -256,22 +350,15 @@ class TaskRunner(object):
 
 
     def _pull_image(self):
-        pull_data = self._parse_docker_output(
-            self.docker_client.pull(self._get_docker_image()))
-        if pull_data[-1].get('errorDetail'):
-            raise ContainerPullError(pull_data[-1].get('errorDetail'))
-        else:
-            self.logger.debug(json.dumps(pull_data, indent=2, separators=(',', ': ')))
+        # Skips the pull if the image is already here, and waits for
+        # another task runner that is already pulling it.
+        image_manager = ImageManager(
+            self.docker_client, self.settings['IMAGE_LOCK_DIR'], self.logger)
+        return image_manager.get_image(self._get_docker_image())
 
     def _get_docker_image(self):
-        # Tag is required. Otherwise docker-py pull will download all tags.
-        docker_image = self.task_attempt['environment']['docker_image']
-        if not ':' in docker_image:
-            docker_image = docker_image + ':latest'
-        return docker_image
-
-    def _parse_docker_output(self, data):
-        return [json.loads(line) for line in data.strip().split('\r\n')]
+        return ImageManager.normalize_image(
+            self.task_attempt['environment']['docker_image'])
 
     def _try_to_create_container(self):
         self._timepoint('Creating container')
@@ -288,20 +375,23 @@ class TaskRunner(object):
         docker_image = self._get_docker_image()
         interpreter = self.task_attempt['interpreter']
         host_dir = self.settings['WORKING_DIR']
-        container_dir = '/loom_workspace'
+        container_dir = self.CONTAINER_DIR
 
         command = interpreter.split(' ')
         command.append(self.LOOM_RUN_SCRIPT_NAME)
-        
+
+        # Input files mounted read-only over paths in the working directory
+        volumes = [container_dir]
+        binds = ['%s:%s:rw' % (host_dir, container_dir)]
+        for (host_path, container_path) in self.input_mounts:
+            volumes.append(container_path)
+            binds.append('%s:%s:ro' % (host_path, container_path))
+
         self.container = self.docker_client.create_container(
             image=docker_image,
             command=command,
-            volumes=[container_dir],
-            host_config=self.docker_client.create_host_config(
-                binds={host_dir: {
-                    'bind': container_dir,
-                    'mode': 'rw',
-                }}),
+            volumes=volumes,
+            host_config=self.docker_client.create_host_config(binds=binds),
             working_dir=container_dir,
         )
 
@@ -309,6 +399,7 @@ class TaskRunner(object):
         self._timepoint('Starting analysis')
         try:
             self.docker_client.start(self.container)
+            self._start_log_streams()
             self._verify_container_started_running()
         except Exception as e:
             self._fail('Failed to start analysis', detail=str(e))
@@ -325,7 +416,7 @@ class TaskRunner(object):
     def _try_to_get_returncode(self):
         self._timepoint('Running analysis')
         try:
-            returncode = self._poll_for_returncode()
+            returncode = self._wait_for_returncode()
             if returncode == 0:
                 return
             else:
@@ -341,27 +432,84 @@ class TaskRunner(object):
                 detail=str(e))
             # Do not raise error. Attempt to save log files.
 
-    def _poll_for_returncode(self, poll_interval_seconds=1):
-        while True:
+    def _wait_for_returncode(self):
+        # Blocks in one request until the container exits, rather than
+        # polling. If the connection to Docker is lost, check the
+        # container and wait again.
+        for attempt in range(self.WAIT_ATTEMPTS):
             try:
-                container_data = self.docker_client.inspect_container(self.container)
-            except Exception as e:
-                raise Exception('Unable to inspect Docker container: "%s"' % str(e))
+                return self._get_docker_client(timeout=None).wait(
+                    self.container, timeout=None)
+            except requests.exceptions.RequestException as e:
+                self.logger.warning(
+                    'Lost connection while waiting for container: "%s"'
+                    % str(e))
+                returncode = self._get_returncode_if_exited()
+                if returncode is not None:
+                    return returncode
+                time.sleep(self.WAIT_RETRY_SECONDS)
+        raise Exception('Unable to wait for Docker container after %s attempts'
+                        % self.WAIT_ATTEMPTS)
+
+    def _get_returncode_if_exited(self):
+        try:
+            container_data = self.docker_client.inspect_container(self.container)
+        except Exception as e:
+            raise Exception('Unable to inspect Docker container: "%s"' % str(e))
 
-            if not container_data.get('State'):
-                raise Exception(
-                    'Could not parse container info from Docker: "%s"' % container_data)
+        if not container_data.get('State'):
+            raise Exception(
+                'Could not parse container info from Docker: "%s"' % container_data)
 
-            if container_data['State'].get('Status') == 'exited':
-                # Success
-                return container_data['State'].get('ExitCode')
-            elif container_data['State'].get('Status') == 'running':
-                time.sleep(poll_interval_seconds)
-            else:
-                # Error -- process did not complete
-                message = 'Docker container has unexpected status "%s"' % \
-                          container_data['State'].get('Status')
-                raise Exception(message)
+        if container_data['State'].get('Status') == 'exited':
+            return container_data['State'].get('ExitCode')
+        elif container_data['State'].get('Status') == 'running':
+            return None
+        else:
+            # Error -- process did not complete
+            message = 'Docker container has unexpected status "%s"' % \
+                      container_data['State'].get('Status')
+            raise Exception(message)
+
+    def _get_docker_client(self, timeout=None):
+        # For requests that stay open until the container exits. A
+        # separate client is used since the default one times out, and
+        # its connection pool is shared with other threads.
+        return docker.Client(base_url=self.DOCKER_SOCKET, timeout=timeout)
+
+    def _start_log_streams(self):
+        # Logs are written to disk as the container produces them, so
+        # nothing needs to be fetched when it exits
+        self.log_threads = []
+        for (log_file, stdout, stderr) in [
+                (self.settings['STDOUT_LOG_FILE'], True, False),
+                (self.settings['STDERR_LOG_FILE'], False, True)]:
+            init_directory(os.path.dirname(os.path.abspath(log_file)))
+            t = threading.Thread(target=self._stream_log,
+                                 args=(log_file, stdout, stderr))
+            t.daemon = True
+            t.start()
+            self.log_threads.append(t)
+
+    def _stream_log(self, log_file, stdout, stderr):
+        try:
+            with open(log_file, 'w') as f:
+                for data in self._get_docker_client(timeout=None).logs(
+                        self.container, stdout=stdout, stderr=stderr,
+                        stream=True, follow=True):
+                    f.write(data)
+                    f.flush()
+        except Exception as e:
+            self.logger.error('Failed to stream log %s: "%s"'
+                              % (log_file, str(e)))
+            self.log_stream_errors.append(log_file)
+
+    def _wait_for_log_streams(self):
+        # Streams end when the container exits
+        for t in getattr(self, 'log_threads', []):
+            t.join(self.LOG_STREAM_TIMEOUT_SECONDS)
+            if t.is_alive():
+                self.log_stream_errors.append(t)
 
     def _try_to_save_process_logs(self):
         self.logger.debug('Saving process logs')
@@ -378,6 +526,14 @@ class TaskRunner(object):
             self.logger.debug('No container, so no process logs to save.')
             return
 
+        self._wait_for_log_streams()
+        if not getattr(self, 'log_threads', None) or self.log_stream_errors:
+            # Streaming never started or failed. Fetch the logs whole.
+            self._fetch_process_logs()
+        self._import_log_file(self.settings['STDOUT_LOG_FILE'])
+        self._import_log_file(self.settings['STDERR_LOG_FILE'])
+
+    def _fetch_process_logs(self):
         init_directory(
             os.path.dirname(os.path.abspath(self.settings['STDOUT_LOG_FILE'])))
         with open(self.settings['STDOUT_LOG_FILE'], 'w') as stdoutlog:
@@ -390,8 +546,6 @@ class TaskRunner(object):
             stderrlog.write(
                 self.docker_client.logs(self.container, stderr=True, stdout=False)
             )
-        self._import_log_file(self.settings['STDOUT_LOG_FILE'])
-        self._import_log_file(self.settings['STDERR_LOG_FILE'])
 
     def _import_log_file(self, filepath):
         try:
@@ -423,9 +577,12 @@ class TaskRunner(object):
             if output['type'] == 'file':
                 filename = output['source']['filename']
                 try:
+                    # Outputs are not used after the task, so move them
+                    # into storage instead of copying
                     data_object = self.filemanager.import_result_file(
                         output,
-                        os.path.join(self.settings['WORKING_DIR'], filename)
+                        os.path.join(self.settings['WORKING_DIR'], filename),
+                        move=True
                     )
                     self.logger.debug('Saved file output "%s"' % data_object['uuid'])
                 except IOError as e:
@@ -443,12 +600,13 @@ class TaskRunner(object):
 
                 elif output['source'].get('stream'):
                     # Get result from stream
+                    # Process logs are saved to disk before outputs
                     if output['source'].get('stream') == 'stdout':
-                        output_text = self.docker_client.logs(
-                            self.container, stderr=False, stdout=True)
+                        output_text = self._read_log_file(
+                            self.settings['STDOUT_LOG_FILE'])
                     elif output['source'].get('stream') == 'stderr':
-                        output_text = self.docker_client.logs(
-                            self.container, stderr=True, stdout=False)
+                        output_text = self._read_log_file(
+                            self.settings['STDERR_LOG_FILE'])
                     else:
                         raise Exception(
                             'Could not save output "%s" because source is unknown stream type "%s"' %  (output['channel'], output['source']['stream']))
@@ -456,9 +614,13 @@ class TaskRunner(object):
                     raise Exception(
                         'Could not save output "%s" because did not include a filename or a stream: "%s"' %  (output['channel'], output['source']))
 
-                data_object = self._save_nonfile_output(output, output_text)
+                self._save_nonfile_output(output, output_text)
                 self.logger.debug(
-                    'Saved %s output "%s"' % (output['type'], data_object['id']))
+                    'Queued %s output "%s"' % (output['type'], output['channel']))
+
+    def _read_log_file(self, log_file):
+        with open(log_file, 'r') as f:
+            return f.read()
 
     def _save_nonfile_output(self, output, output_text):
         data_type = output['type']
@@ -467,48 +629,102 @@ class TaskRunner(object):
             'value': output_text
         }
         output.update({'data_object': data_object})
-        return self.connection.update_task_attempt_output(output['id'], output)
+        self._add_event('output', output)
 
     # Updates to TaskAttempt
+    #
+    # These are buffered and sent in one request with _flush_events.
+    # The server applies each batch in order in a single transaction.
+
+    def _add_event(self, event_type, data=None, flush=False):
+        with self.events_lock:
+            self.events.append({'type': event_type, 'data': data})
+            if flush or len(self.events) >= self.MAX_BUFFERED_EVENTS:
+                self._flush_events()
+
+    def _flush_events(self):
+        # Caller must hold events_lock. Events are cleared only once
+        # they are posted, so that a failed post is retried with the
+        # next flush. A batch that the server rejects as invalid would
+        # be rejected again, so it is replaced with an error timepoint
+        # and any fail or finish event that it held.
+        if not self.events:
+            return
+        try:
+            self._post_events()
+        except requests.exceptions.HTTPError as e:
+            if not self._is_rejected(e):
+                raise
+            self.logger.error('Server rejected events %s: "%s"'
+                              % (self.events, str(e)))
+            self.events = [{'type': 'timepoint',
+                            'data': self._get_timepoint(
+                                'Server rejected events from the TaskRunner',
+                                detail=str(e), is_error=True)}] \
+                + [event for event in self.events
+                   if event['type'] in ('fail', 'finish')]
+            try:
+                self._post_events()
+            except requests.exceptions.HTTPError as e:
+                if not self._is_rejected(e):
+                    raise
+                self.logger.error('Server rejected events %s: "%s"'
+                                  % (self.events, str(e)))
+                self.events = []
+
+    def _post_events(self):
+        self.connection.post_task_attempt_events(
+            self.settings['TASK_ATTEMPT_ID'], self.events)
+        self.events = []
+
+    def _is_rejected(self, error):
+        return error.response is not None \
+            and 400 <= error.response.status_code < 500
 
     def _send_heartbeat(self):
-        self.connection.update_task_attempt(
-            self.settings['TASK_ATTEMPT_ID'],
-            {}
-        )
+        if self.host_heartbeat is None:
+            self._add_event('update', {}, flush=True)
+            return
+        # Events that fail to post are kept for the next flush, and
+        # must not stop the heartbeat
+        with self.events_lock:
+            try:
+                self._flush_events()
+            except Exception as e:
+                self.logger.warning('Failed to send events: "%s"' % str(e))
+        self.host_heartbeat.beat()
 
     def _set_container_id(self, container_id):
-        self.connection.update_task_attempt(
-            self.settings['TASK_ATTEMPT_ID'],
-            {'container_id': container_id}
-        )
+        self._add_event('update', {'container_id': container_id})
 
     def _set_image_id(self, image_id):
-        self.connection.update_task_attempt(
-            self.settings['TASK_ATTEMPT_ID'],
-            {'image_id': image_id}
-        )
+        self._add_event('update', {'image_id': image_id})
 
     def _timepoint(self, message, detail='', is_error=False):
-        timepoint = {'message': message,
-                     'detail': detail,
-                     'is_error': is_error
-        }
+        timepoint = self._get_timepoint(message, detail=detail,
+                                        is_error=is_error)
         if is_error:
             self.logger.error('Adding error %s' % timepoint)
         else:
             self.logger.debug('Adding timepoint %s' % timepoint)
-        self.connection.post_task_attempt_timepoint(
-            self.settings['TASK_ATTEMPT_ID'], timepoint)
+        self._add_event('timepoint', timepoint)
+
+    def _get_timepoint(self, message, detail='', is_error=False):
+        return {'message': message,
+                'detail': detail,
+                'is_error': is_error,
+                # Record when the event happened, not when it is sent
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+        }
 
     def _fail(self, message, detail=''):
         self.is_failed = True
         self.logger.error(message + ': ' + detail)
         self._timepoint(message, detail=detail, is_error=True)
-        self.connection.post_task_attempt_fail(self.settings['TASK_ATTEMPT_ID'])
+        self._add_event('fail', flush=True)
 
     def _finish(self):
-        self.connection.post_task_attempt_finish(self.settings['TASK_ATTEMPT_ID'])
+        self._add_event('finish', flush=True)
 
     # Parser
 
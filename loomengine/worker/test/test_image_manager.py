@@ -0,0 +1,111 @@
+import docker
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from loomengine.worker.image_manager import ImageManager, ContainerPullError
+
+
+class StubDockerClient(object):
+    # Images are local once pulled, or if listed in local_images
+
+    def __init__(self, local_images=(), pull_error=None):
+        self.local_images = set(local_images)
+        self.pull_error = pull_error
+        self.pulls = []
+
+    def inspect_image(self, image):
+        if image not in self.local_images:
+            raise docker.errors.NotFound(
+                'No such image: %s' % image, None,
+                explanation='No such image: %s' % image)
+        return {'Id': 'sha256:%s' % image}
+
+    def pull(self, repository, tag=None, stream=False, decode=False):
+        self.pulls.append((repository, tag))
+        if self.pull_error:
+            return [{'error': self.pull_error}]
+        image = repository if tag is None else '%s:%s' % (repository, tag)
+        self.local_images.add(image)
+        return [{'id': 'layer1', 'status': 'Downloading',
+                 'progressDetail': {'current': 1, 'total': 2},
+                 'progress': '[=>  ]'},
+                {'status': 'Downloaded newer image for %s' % image}]
+
+
+class TestImageManager(unittest.TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.logger = logging.getLogger(__name__)
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def _get_manager(self, client):
+        return ImageManager(client, self.lock_dir, self.logger)
+
+    def testNormalizeImage(self):
+        self.assertEqual(ImageManager.normalize_image('ubuntu'),
+                         'ubuntu:latest')
+        self.assertEqual(ImageManager.normalize_image('localhost:5000/ubuntu'),
+                         'localhost:5000/ubuntu:latest')
+        self.assertEqual(ImageManager.normalize_image('ubuntu:16.04'),
+                         'ubuntu:16.04')
+        self.assertEqual(ImageManager.normalize_image('ubuntu@sha256:abc'),
+                         'ubuntu@sha256:abc')
+
+    def testLocalTaggedImageIsNotPulled(self):
+        client = StubDockerClient(local_images=['ubuntu:16.04'])
+        image_id = self._get_manager(client).get_image('ubuntu:16.04')
+        self.assertEqual(image_id, 'sha256:ubuntu:16.04')
+        self.assertEqual(client.pulls, [])
+
+    def testLocalDigestIsReady(self):
+        client = StubDockerClient(local_images=['ubuntu@sha256:abc'])
+        manager = self._get_manager(client)
+        self.assertTrue(manager._is_ready('ubuntu@sha256:abc'))
+        manager.get_image('ubuntu@sha256:abc')
+        self.assertEqual(client.pulls, [])
+
+    def testMissingImageIsPulledOnce(self):
+        client = StubDockerClient()
+        manager = self._get_manager(client)
+        self.assertFalse(manager._is_ready('ubuntu:16.04'))
+        manager.get_image('ubuntu:16.04')
+        manager.get_image('ubuntu:16.04')
+        self.assertEqual(client.pulls, [('ubuntu', '16.04')])
+
+    def testLatestIsPulledUnlessFresh(self):
+        client = StubDockerClient(local_images=['ubuntu:latest'])
+        manager = self._get_manager(client)
+        # Never pulled by this host, so it may be out of date
+        self.assertFalse(manager._is_ready('ubuntu:latest'))
+        manager.get_image('ubuntu')
+        self.assertTrue(manager._is_ready('ubuntu:latest'))
+        manager.get_image('ubuntu')
+        self.assertEqual(client.pulls, [('ubuntu', 'latest')])
+
+    def testStaleLatestIsPulledAgain(self):
+        client = StubDockerClient(local_images=['ubuntu:latest'])
+        manager = self._get_manager(client)
+        manager.get_image('ubuntu')
+        stale = time.time() - ImageManager.PULL_FRESHNESS_SECONDS - 1
+        os.utime(manager._get_lock_path('ubuntu:latest', '.pulled'),
+                 (stale, stale))
+        self.assertFalse(manager._is_ready('ubuntu:latest'))
+        manager.get_image('ubuntu')
+        self.assertEqual(len(client.pulls), 2)
+
+    def testPullError(self):
+        client = StubDockerClient(pull_error='manifest unknown')
+        progress = []
+        with self.assertRaises(ContainerPullError):
+            self._get_manager(client).get_image(
+                'ubuntu:nope', progress_callback=progress.append)
+        # Not marked as pulled
+        self.assertEqual(self._get_manager(client)._get_pull_time(
+            'ubuntu:nope'), 0)
@@ -0,0 +1,132 @@
+import argparse
+import requests
+import shutil
+import tempfile
+import unittest
+
+from loomengine.worker.task_runner import TaskRunner
+
+
+def get_file(name):
+    return {'uuid': 'uuid-%s' % name,
+            'type': 'file',
+            'is_array': False,
+            'filename': name,
+            'file_resource': {'file_url': 'gs://bucket/%s' % name}}
+
+
+class MockConnection(object):
+
+    def __init__(self, task_attempt):
+        self.task_attempt = task_attempt
+        self.events = []
+        # Batches with one of these event types get a 400 response
+        self.rejected_event_types = []
+        self.is_down = False
+
+    def get_task_attempt(self, task_attempt_id):
+        return self.task_attempt
+
+    def post_task_attempt_events(self, task_attempt_id, events):
+        if self.is_down:
+            raise requests.exceptions.ConnectionError('No response')
+        if [event for event in events
+            if event['type'] in self.rejected_event_types]:
+            response = requests.Response()
+            response.status_code = 400
+            raise requests.exceptions.HTTPError(
+                '400 Client Error', response=response)
+        self.events.extend(events)
+
+
+class MockHostHeartbeat(object):
+
+    def __init__(self):
+        self.beats = 0
+
+    def beat(self):
+        self.beats += 1
+
+
+class MockFileManager(object):
+
+    def __init__(self):
+        self.exported = []
+
+    def get_export_destination_urls(self, file_data_objects, destination_url):
+        return [(file_data_object,
+                 '%s/%s' % (destination_url, file_data_object['filename']))
+                for file_data_object in file_data_objects]
+
+    def export_file_data_objects_to_urls(self, jobs, concurrency=1):
+        self.exported.extend(jobs)
+        return [(data_object, destination_url, None, 0)
+                for (data_object, destination_url) in jobs]
+
+
+class TestTaskRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def _get_task_runner(self, task_attempt):
+        args = argparse.Namespace(task_attempt_id='attempt-1',
+                                  master_url='http://localhost',
+                                  log_level='CRITICAL',
+                                  log_file=None)
+        self.connection = MockConnection(task_attempt)
+        self.filemanager = MockFileManager()
+        task_runner = TaskRunner(args=args,
+                                 mock_connection=self.connection,
+                                 mock_filemanager=self.filemanager)
+        task_runner.settings['WORKING_DIR'] = self.working_dir
+        return task_runner
+
+    def testCopyInputsWithArray(self):
+        task_attempt = {'inputs': [
+            {'channel': 'single', 'data_object': get_file('a.txt')},
+            {'channel': 'gathered', 'data_object': {
+                'uuid': 'uuid-array',
+                'type': 'file',
+                'is_array': True,
+                'members': [get_file('b.txt'), get_file('c.txt')]}},
+            {'channel': 'word', 'data_object': {
+                'uuid': 'uuid-word',
+                'type': 'string',
+                'is_array': False,
+                'value': 'hello'}}]}
+        task_runner = self._get_task_runner(task_attempt)
+        task_runner._copy_inputs()
+        self.assertEqual(
+            [destination_url for (data_object, destination_url)
+             in self.filemanager.exported],
+            ['%s/%s' % (self.working_dir, name)
+             for name in ['a.txt', 'b.txt', 'c.txt']])
+
+    def testRejectedEventsAreDropped(self):
+        task_runner = self._get_task_runner({})
+        self.connection.rejected_event_types = ['output']
+        task_runner._add_event('output', {'id': 0})
+        task_runner._finish()
+        self.assertEqual(
+            [event['type'] for event in self.connection.events],
+            ['timepoint', 'finish'])
+        self.assertTrue(self.connection.events[0]['data']['is_error'])
+        self.assertEqual(task_runner.events, [])
+
+    def testHeartbeatWhenEventsFail(self):
+        task_runner = self._get_task_runner({})
+        task_runner.host_heartbeat = MockHostHeartbeat()
+        self.connection.is_down = True
+        task_runner._timepoint('waiting')
+        task_runner._send_heartbeat()
+        self.assertEqual(task_runner.host_heartbeat.beats, 1)
+        # Kept for the next flush
+        self.connection.is_down = False
+        task_runner._send_heartbeat()
+        self.assertEqual(self.connection.events[-1]['data']['message'],
+                         'waiting')
+        self.assertEqual(task_runner.events, [])
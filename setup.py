@@ -89,6 +89,7 @@ setup(
     install_requires=[
                         'ansible==2.2.0.0',
                         'apache-libcloud==1.3.0',
+                        'boto==2.43.0',
                         'celery==4.0.0',
                         'Django==1.10.3',
                         'django-celery-results==1.0.1',
@@ -144,6 +145,7 @@ setup(
          'console_scripts': [
              'loom=loomengine.client.main:main',
              'loom-taskrunner=loomengine.worker.task_runner:main',
+             'loom-pull-image=loomengine.worker.image_manager:main',
          ],
      },
 )